@@ -113,6 +113,11 @@ CORS_ALLOW_HEADERS = [
     'x-user-email',  # Add custom header
 ]
 
+# Keyset pagination cursor for list endpoints
+CORS_EXPOSE_HEADERS = [
+    'x-next-cursor',
+]
+
 # Cross-Origin-Opener-Policy settings for Google OAuth
 SECURE_CROSS_ORIGIN_OPENER_POLICY = 'same-origin-allow-popups'
 CROSS_ORIGIN_OPENER_POLICY = 'same-origin-allow-popups'
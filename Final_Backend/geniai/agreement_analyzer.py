@@ -1,8 +1,10 @@
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
 import re
 
+from providers import get_llm
+from prompt_builder import SUMMARY_TOKEN_BUDGET, record_prompt, truncate_to_tokens
+
 try:
     from google.cloud import secretmanager as google_secretmanager
 except Exception:
@@ -12,22 +14,12 @@ load_dotenv()
 
 class AgreementAnalyzer:
     def __init__(self):
-        self.api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-        if not self.api_key:
-            raise RuntimeError("Missing GEMINI_API_KEY/GOOGLE_API_KEY in environment.")
-        genai.configure(api_key=self.api_key)
-        
-        # Initialize Gemini model
-        for model_name in ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-1.0-pro"]:
-            try:
-                self.model = genai.GenerativeModel(model_name)
-                _ = self.model.generate_content("ping")
-                print(f"Using Gemini API model: {model_name}")
-                break
-            except Exception:
-                continue
-        else:
-            raise RuntimeError("Failed to initialize any Gemini API model.")
+        # Gemini by default, or the fake provider when LLM_PROVIDER=fake
+        self.model = get_llm()
+
+    def _generate(self, prompt, purpose="summary"):
+        record_prompt(purpose, prompt)
+        return self.model.generate_content(prompt)
 
     def detect_agreement_type(self, text):
         """Detect the type of legal agreement based on content analysis."""
@@ -53,7 +45,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(detection_prompt)
+            response = self._generate(detection_prompt, "agreement_type")
             result = getattr(response, 'text', str(response)).strip()
             return result
         except Exception as e:
@@ -89,7 +81,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(rental_summary_prompt)
+            response = self._generate(rental_summary_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating rental summary: {e}")
@@ -121,7 +113,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(commercial_summary_prompt)
+            response = self._generate(commercial_summary_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating commercial lease summary: {e}")
@@ -153,7 +145,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(pg_summary_prompt)
+            response = self._generate(pg_summary_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating PG/Hostel summary: {e}")
@@ -186,7 +178,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(maintenance_summary_prompt)
+            response = self._generate(maintenance_summary_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating maintenance agreement summary: {e}")
@@ -214,7 +206,7 @@ class AgreementAnalyzer:
         Keep it between 200-250 words.
         """
         try:
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating employment summary: {e}")
@@ -242,7 +234,7 @@ class AgreementAnalyzer:
         Keep it between 200-250 words.
         """
         try:
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating service agreement summary: {e}")
@@ -271,7 +263,7 @@ class AgreementAnalyzer:
         Keep it between 200-250 words.
         """
         try:
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating purchase agreement summary: {e}")
@@ -300,13 +292,15 @@ class AgreementAnalyzer:
         Keep it between 200-250 words.
         """
         try:
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating partnership agreement summary: {e}")
             return "Error: Unable to generate partnership agreement summary."
 
     def generate_summary(self, text):
+        # Callers pass document_excerpt(); anything longer is cut to the summary budget
+        text = truncate_to_tokens(text, SUMMARY_TOKEN_BUDGET)
         print("Analyzing document type...")
         agreement_type = self.detect_agreement_type(text)
         print(f"Detected: {agreement_type}")
@@ -348,7 +342,7 @@ class AgreementAnalyzer:
             """
             
             try:
-                response = self.model.generate_content(generic_prompt)
+                response = self._generate(generic_prompt)
                 summary = getattr(response, 'text', str(response))
             except Exception as e:
                 print(f"Error generating generic summary: {e}")
@@ -420,7 +414,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(detailed_rental_prompt)
+            response = self._generate(detailed_rental_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating detailed rental summary: {e}")
@@ -490,7 +484,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(detailed_commercial_prompt)
+            response = self._generate(detailed_commercial_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating detailed commercial lease summary: {e}")
@@ -561,7 +555,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(detailed_pg_prompt)
+            response = self._generate(detailed_pg_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating detailed PG/Hostel summary: {e}")
@@ -629,7 +623,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(detailed_maintenance_prompt)
+            response = self._generate(detailed_maintenance_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating detailed maintenance agreement summary: {e}")
@@ -701,7 +695,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(detailed_employment_prompt)
+            response = self._generate(detailed_employment_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating detailed employment summary: {e}")
@@ -772,7 +766,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(detailed_service_prompt)
+            response = self._generate(detailed_service_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating detailed service agreement summary: {e}")
@@ -843,7 +837,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(detailed_purchase_prompt)
+            response = self._generate(detailed_purchase_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating detailed purchase agreement summary: {e}")
@@ -914,7 +908,7 @@ class AgreementAnalyzer:
         """
         
         try:
-            response = self.model.generate_content(detailed_partnership_prompt)
+            response = self._generate(detailed_partnership_prompt)
             return getattr(response, 'text', str(response))
         except Exception as e:
             print(f"Error generating detailed partnership agreement summary: {e}")
@@ -922,6 +916,8 @@ class AgreementAnalyzer:
 
     def generate_detailed_summary(self, text):
         """Generate a detailed, comprehensive summary (600-700 words) with clause analysis and risk identification."""
+        # Callers pass document_excerpt(); anything longer is cut to the summary budget
+        text = truncate_to_tokens(text, SUMMARY_TOKEN_BUDGET)
         print("Analyzing document type for detailed summary...")
         agreement_type = self.detect_agreement_type(text)
         print(f"Detected: {agreement_type}")
@@ -995,7 +991,7 @@ class AgreementAnalyzer:
             """
             
             try:
-                response = self.model.generate_content(generic_detailed_prompt)
+                response = self._generate(generic_detailed_prompt)
                 summary = getattr(response, 'text', str(response))
             except Exception as e:
                 print(f"Error generating detailed generic summary: {e}")
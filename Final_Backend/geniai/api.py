@@ -10,24 +10,30 @@ import uuid
 import faiss
 import numpy as np
 from datetime import datetime
-from fastapi import Request
+from fastapi import Request, Response
 from asgiref.sync import sync_to_async
-from google.cloud import storage
 from google.cloud import secretmanager
 from dotenv import load_dotenv
-import tempfile
+
+from storage_backend import ObjectNotFound, get_storage, resolve_uri
+from vector_index import load_index, load_meta, read_index
+from user_index import get_user_index_store
+from lexical_index import load_lexical
+from artifact import PackedArtifact, artifact_path, is_artifact, write_artifact
+from embedding_store import embeddings_path, save_embeddings
 
 # Load environment from .env if present
-storage_client = storage.Client()
-secret_client = secretmanager.SecretManagerServiceClient()
+secret_client = None  # Secret Manager client, created on first use so imports work offline
 
 # Config
 PROJECT_ID = os.getenv("GCP_PROJECT") or os.getenv("GOOGLE_CLOUD_PROJECT") or "gen-ai-legal"
-GCS_BUCKET_NAME = "legal-agreement-analyzer-gen-ai-legal"  # ✅ unified name
 
 def get_secret(secret_id, version="latest"):
     """Fetch secret from GCP Secret Manager."""
+    global secret_client
     try:
+        if secret_client is None:
+            secret_client = secretmanager.SecretManagerServiceClient()
         name = f"projects/{PROJECT_ID}/secrets/{secret_id}/versions/{version}"
         response = secret_client.access_secret_version(request={"name": name})
         return response.payload.data.decode("UTF-8")
@@ -35,119 +41,71 @@ def get_secret(secret_id, version="latest"):
         print(f"⚠️ Secret Manager fetch failed for {secret_id}: {e}")
         return None
 # ---------------------------
-# GCS Helper Functions
+# Storage Helper Functions (backend chosen by STORAGE_BACKEND, see storage_backend.py)
 # ---------------------------
 
 def upload_to_gcs(file_content: bytes, file_path: str, user_id: str) -> str:
-    """Upload file to GCS and return the GCS path."""
-    bucket = storage_client.bucket("legal-agreement-analyzer-gen-ai-legal")
+    """Upload file to storage and return the object path."""
     gcs_path = f"users/{user_id}/documents/{file_path}"
-    blob = bucket.blob(gcs_path)
-    blob.upload_from_string(file_content)
+    get_storage().put(gcs_path, file_content)
     return gcs_path
 
-def save_faiss_index_to_gcs(index, chunks, user_id: str, document_id: str):
-    """Save FAISS index and chunks to GCS."""
-    bucket = storage_client.bucket("legal-agreement-analyzer-gen-ai-legal")
-    index_path = f"users/{user_id}/vectorstore/{document_id}/index.faiss"
-    index_blob = bucket.blob(index_path)
-
-    fd, temp_path = tempfile.mkstemp(suffix=".faiss")
-    os.close(fd)
-    try:
-        faiss.write_index(index, temp_path)
-        with open(temp_path, "rb") as f:
-            index_blob.upload_from_file(f)
-    finally:
-        try:
-            os.remove(temp_path)
-        except Exception:
-            pass
-
-    chunks_path = f"users/{user_id}/vectorstore/{document_id}/chunks.json"
-    chunks_blob = bucket.blob(chunks_path)
-    chunks_blob.upload_from_string(json.dumps(chunks, ensure_ascii=False))
-
-    return index_path, chunks_path
+def save_faiss_index_to_gcs(index, chunks, user_id: str, document_id: str, summary: Optional[dict] = None,
+                            embeddings: Optional[np.ndarray] = None):
+    """Save FAISS index, chunks, BM25 and summary to storage as one packed artifact (see artifact.py),
+    plus the raw embeddings for re-indexing (see embedding_store.py). Returns the artifact's path."""
+    storage = get_storage()
+    artifact = write_artifact(storage, artifact_path(user_id, document_id), index, chunks, summary)
+    if embeddings is not None:
+        save_embeddings(storage, embeddings_path(user_id, document_id), embeddings)
+    return artifact
 
 def load_faiss_index_from_gcs(user_id: str, document_id: str):
-    """Load FAISS index and chunks from GCS."""
-    bucket = storage_client.bucket("legal-agreement-analyzer-gen-ai-legal")
-    index_path = f"users/{user_id}/vectorstore/{document_id}/index.faiss"
-    index_blob = bucket.blob(index_path)
-
-    fd, temp_path = tempfile.mkstemp(suffix=".faiss")
-    os.close(fd)
+    """Load FAISS index and chunks from storage."""
+    storage = get_storage()
     try:
-        index_blob.download_to_filename(temp_path)
-        index = faiss.read_index(temp_path)
-    finally:
-        try:
-            os.remove(temp_path)
-        except Exception:
-            pass
+        packed = PackedArtifact(storage, artifact_path(user_id, document_id))
+        return packed.load_index(), packed.spans()
+    except ObjectNotFound:
+        pass
+    # Documents stored before the packed format
+    index_path = f"users/{user_id}/vectorstore/{document_id}/index.faiss"
+    index = read_index(storage, index_path)
 
     chunks_path = f"users/{user_id}/vectorstore/{document_id}/chunks.json"
-    chunks_blob = bucket.blob(chunks_path)
-    chunks_content = chunks_blob.download_as_text()
-    chunks = json.loads(chunks_content)
+    chunks = json.loads(storage.get_text(chunks_path))
 
     return index, chunks
 
 def save_summary_to_gcs(summary_data: dict, user_id: str, document_id: str):
-    """Save summary to GCS."""
-    bucket = storage_client.bucket("legal-agreement-analyzer-gen-ai-legal")
+    """Save summary to storage."""
     summary_path = f"users/{user_id}/summaries/{document_id}_summary.json"
-    summary_blob = bucket.blob(summary_path)
-    summary_blob.upload_from_string(json.dumps(summary_data, ensure_ascii=False))
+    get_storage().put(summary_path, json.dumps(summary_data, ensure_ascii=False), content_type="application/json")
     return summary_path
 
 def load_summary_from_gcs(user_id: str, document_id: str):
-    """Load summary from GCS."""
-    bucket = storage_client.bucket("legal-agreement-analyzer-gen-ai-legal")
+    """Load summary from storage."""
+    try:
+        summary = PackedArtifact(get_storage(), artifact_path(user_id, document_id)).summary
+        if summary is not None:
+            return summary
+    except ObjectNotFound:
+        pass
     summary_path = f"users/{user_id}/summaries/{document_id}_summary.json"
-    summary_blob = bucket.blob(summary_path)
-    summary_content = summary_blob.download_as_text()
-    return json.loads(summary_content)
+    return json.loads(get_storage().get_text(summary_path))
 
 def save_chat_session_to_gcs(chat_data: dict, user_id: str):
-    """Save chat session to GCS."""
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
-    chat_path = f"users/{user_id}/chat_sessions/{chat_data['id']}.json"
-    chat_blob = bucket.blob(chat_path)
-    chat_blob.upload_from_string(json.dumps(chat_data, ensure_ascii=False))
-    return chat_path
+    """Save chat session to GCS and the user's session index."""
+    return get_chat_storage().put_session(user_id, chat_data)
 
 def load_chat_sessions_from_gcs(user_id: str):
-    """Load chat sessions from GCS."""
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
-    prefix = f"users/{user_id}/chat_sessions/"
-    blobs = bucket.list_blobs(prefix=prefix)
-
-    sessions = []
-    for blob in blobs:
-        if blob.name.endswith(".json"):
-            try:
-                content = blob.download_as_text()
-                session_data = json.loads(content)
-                sessions.append(session_data)
-            except Exception as e:
-                print(f"Error loading chat session {blob.name}: {e}")
-    return sessions
+    """Load chat sessions from the user's GCS session index (one read)."""
+    return get_chat_storage().list_sessions(user_id)
 
 def update_chat_session_in_gcs(chat_id: str, updates: dict, user_id: str):
     """Update chat session in GCS."""
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
-    chat_path = f"users/{user_id}/chat_sessions/{chat_id}.json"
-    chat_blob = bucket.blob(chat_path)
-
     try:
-        existing_content = chat_blob.download_as_text()
-        existing_data = json.loads(existing_content)
-        existing_data.update(updates)
-        existing_data["last_updated"] = datetime.now().isoformat()
-        chat_blob.upload_from_string(json.dumps(existing_data, ensure_ascii=False))
-        return True
+        return get_chat_storage().patch_session(user_id, chat_id, updates)
     except Exception as e:
         print(f"Error updating chat session: {e}")
         return False
@@ -171,8 +129,9 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backEnd.settings')
 import django
 django.setup()
 
-from geniai.django_sync import DjangoSync
-from geniai.gcs_chat_storage import GCSChatStorage
+from geniai.django_sync import DjangoSync, get_cached_user, get_cached_user_by_id
+from users.google_auth import GoogleTokenError, verify_google_token
+from geniai.gcs_chat_storage import GCSChatStorage, get_chat_storage
 
 # Import our existing modules
 from chat_naming import (
@@ -185,17 +144,25 @@ from chat_naming import (
 from agreement_analyzer import AgreementAnalyzer
 from create_db import (
     load_pdf, 
-    split_text, 
+    split_spans, 
     get_embeddings, 
     build_faiss_index
 )
 from query import (
     load_index_and_chunks,
     embed_query,
+    retrieve_scored,
     search,
+    OFF_TOPIC_REPLY,
     load_gemini_model
 )
-import requests as http
+from context_packing import merge_chunks
+from prompt_builder import build_answer_prompt, document_excerpt
+from session_registry import get_registry
+from auth import verify_jwt_token
+from cursor import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, page_size
+from outbox import record_chat_messages, start_flusher, stop_flusher, get_outbox
+import metrics
 
 app = FastAPI(
     title="Legal Agreement Analyzer API",
@@ -216,6 +183,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Pydantic models for request/response
@@ -263,6 +231,7 @@ class ChatHistoryResponse(BaseModel):
     success: bool
     messages: List[ChatMessage]
     chat_id: str
+    next_cursor: Optional[str] = None
 
 class ChatSession(BaseModel):
     id: str
@@ -273,6 +242,21 @@ class ChatSession(BaseModel):
     last_updated: str
     message_count: int
 
+class SearchRequest(BaseModel):
+    query: str
+    k: int = 10
+
+class SearchHit(BaseModel):
+    document_id: str
+    filename: Optional[str] = None
+    chunk_index: int
+    distance: float
+    text: str
+
+class SearchResponse(BaseModel):
+    success: bool
+    results: List[SearchHit]
+
 class GoogleLoginRequest(BaseModel):
     token: str
 
@@ -282,47 +266,134 @@ class LoginResponse(BaseModel):
     user_id: Optional[str] = None
     email: Optional[str] = None
 
-# Global variables for current session
-current_chat_id = None
-current_document_id = None
-
-# Chat messages storage
-CHAT_MESSAGES_FILE = "data/chat_messages.json"
-
-def load_chat_messages():
-    """Load chat messages from file."""
-    if os.path.exists(CHAT_MESSAGES_FILE):
-        with open(CHAT_MESSAGES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def save_chat_messages(messages):
-    """Save chat messages to file."""
-    os.makedirs(os.path.dirname(CHAT_MESSAGES_FILE), exist_ok=True)
-    with open(CHAT_MESSAGES_FILE, "w", encoding="utf-8") as f:
-        json.dump(messages, f, indent=2, ensure_ascii=False)
-
-def save_chat_message(chat_id: str, message_type: str, content: str):
-    """Save a single chat message."""
-    messages = load_chat_messages()
-    if chat_id not in messages:
-        messages[chat_id] = []
-    
-    message = {
+def new_chat_message(message_type: str, content: str) -> dict:
+    """Build a chat message with a stable id (used as the idempotency key downstream)."""
+    return {
         "id": str(uuid.uuid4()),
         "message_type": message_type,
         "content": content,
         "created_at": datetime.now().isoformat()
     }
-    
-    messages[chat_id].append(message)
-    save_chat_messages(messages)
-    return message
+
+def record_chat_turn(chat_id: str, messages: List[dict], user_email: Optional[str] = None) -> int:
+    """
+    Queue a turn's messages in the outbox; local, Django and GCS writes happen
+    in the background flusher. Returns the chat's message count including them
+    and any earlier turns still waiting in the outbox.
+    """
+    # Pending first: a record delivered after this read is already stored and not counted twice
+    pending = [m["id"] for m in get_outbox().pending_messages(chat_id)]
+    count = get_registry().message_count_with_pending(chat_id, pending)
+    record_chat_messages(chat_id, messages, user_email=user_email)
+    return count + len(messages)
 
 def get_chat_messages(chat_id: str) -> List[dict]:
     """Get all messages for a chat session."""
-    messages = load_chat_messages()
-    return messages.get(chat_id, [])
+    return get_registry().get_messages(chat_id)
+
+def _lookup_request_user(user_id: Optional[str], user_email: Optional[str]):
+    """Cached user by token user_id, else by email. Returns None if neither resolves."""
+    from users.models import User
+    try:
+        if user_id:
+            return get_cached_user_by_id(user_id)
+        if user_email:
+            return get_cached_user(user_email)
+    except User.DoesNotExist:
+        pass
+    return None
+
+async def resolve_request_user(http_request: Request):
+    """
+    The requesting User, resolved once per request and kept on request.state.
+    
+    A valid bearer token wins (verified payloads are cached per token); the
+    x-user-email header is used otherwise. Both go through the user cache.
+    """
+    if hasattr(http_request.state, "user"):
+        return http_request.state.user
+    user_id = None
+    auth_header = http_request.headers.get('authorization') or ''
+    if auth_header.lower().startswith('bearer '):
+        try:
+            user_id = verify_jwt_token(auth_header[7:].strip()).get('user_id')
+        except HTTPException as e:
+            print(f"Bearer token not usable for user lookup: {e.detail}")
+    http_request.state.token_user_id = user_id
+    try:
+        user = await sync_to_async(_lookup_request_user)(user_id, http_request.headers.get('x-user-email'))
+    except Exception as e:
+        print(f"User lookup failed: {e}")
+        user = None
+    http_request.state.user = user
+    return user
+
+async def resolve_user_email(http_request: Request) -> Optional[str]:
+    """User email of the request's user or x-user-email header, falling back to the most recent user."""
+    user = await resolve_request_user(http_request)
+    user_email = user.email if user else http_request.headers.get('x-user-email')
+    if not user_email:
+        try:
+            from users.models import User
+            recent_user = await sync_to_async(User.objects.order_by('-id').first)()
+            if recent_user:
+                user_email = recent_user.email
+                print(f"DEBUG: Using fallback user email: {user_email}")
+        except Exception:
+            pass
+    return user_email
+
+async def resolve_verified_email(http_request: Request) -> Optional[str]:
+    """
+    Email of the user named by a verified bearer token, or None. Unlike
+    resolve_user_email there is no x-user-email header and no most-recent-user
+    fallback, so routes that act on a user's data must use this.
+    """
+    user = await resolve_request_user(http_request)
+    if user is None or not getattr(http_request.state, "token_user_id", None):
+        return None
+    return user.email
+
+async def get_django_sync(http_request: Request, user_email: str) -> DjangoSync:
+    """DjangoSync for the request's user, reusing the already-resolved record when it matches."""
+    user = await resolve_request_user(http_request)
+    if user is not None and user.email == user_email:
+        return DjangoSync(user=user)
+    return await sync_to_async(DjangoSync)(user_email=user_email)
+
+def _latest_session_ids(user_email: str, chat_id: Optional[str]):
+    """(chat_id, document_id) of the given chat, or of the user's most recently active chat."""
+    from geniai.models import ChatSession
+    sessions = ChatSession.objects.filter(user__email=user_email)
+    if chat_id:
+        sessions = sessions.filter(id=chat_id)
+    else:
+        sessions = sessions.filter(document__isnull=False).order_by('-last_updated')
+    row = sessions.values_list('id', 'document_id').first()
+    if row is None:
+        return chat_id, None
+    return str(row[0]), str(row[1]) if row[1] else None
+
+async def resolve_session_ids(user_email: Optional[str], chat_id: Optional[str], document_id: Optional[str]):
+    """
+    Fill in a request's missing chat/document ids from the requesting user's
+    sessions (the chat's own document, else the user's most recent chat).
+    Backed by the shared database, so any worker resolves the same ids.
+    `user_email` must come from resolve_verified_email, never from a header.
+    """
+    if document_id or not user_email:
+        return chat_id, document_id
+    try:
+        resolved_chat_id, document_id = await sync_to_async(_latest_session_ids)(user_email, chat_id)
+        chat_id = chat_id or resolved_chat_id
+    except Exception as e:
+        print(f"Session lookup failed: {e}")
+    if chat_id and not document_id:
+        session = get_registry().get(chat_id)
+        # Someone else's chat is treated as unknown, even if its id is known
+        if session and session.get("user_id") == storage_user_id(user_email):
+            document_id = session.get("document_id")
+    return chat_id, document_id
 
 async def check_document_uploaded(document_id: str) -> bool:
     """Check if a document has been uploaded and processed in GCS."""
@@ -350,28 +421,43 @@ async def root():
             "get_chat_sessions": "GET /api/chat-sessions",
             "get_chat_history": "GET /api/chat-history/{chat_id}",
             "update_chat_session": "POST /api/update-chat-session",
+            "search": "POST /api/search",
+            "delete_document": "DELETE /api/documents/{document_id}",
             "health": "GET /api/health"
         }
     }
 
+@app.on_event("startup")
+async def start_background_workers():
+    """Start the outbox flusher that persists chat messages off the request path."""
+    start_flusher()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    stop_flusher()
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint."""
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Process metrics, including outbox lag."""
+    data = metrics.snapshot()
+    data["outbox"] = get_outbox().stats()
+    return data
+
 @app.post("/api/google-login", response_model=LoginResponse)
 async def google_login(request: GoogleLoginRequest):
     """Handle Google OAuth login."""
     try:
-        # Verify Google token
-        google_verify_url = f"https://oauth2.googleapis.com/tokeninfo?id_token={request.token}"
-        response = http.get(google_verify_url)
-        
-        if response.status_code != 200:
+        # Verify the Google ID token locally against cached signing keys
+        try:
+            user_info = verify_google_token(request.token)
+        except GoogleTokenError:
             raise HTTPException(status_code=400, detail="Invalid Google token")
         
-        user_info = response.json()
-        
         # Extract user information
         email = user_info.get('email')
         user_id = user_info.get('sub')
@@ -402,8 +488,6 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
     Upload and process a legal document PDF.
     Creates embeddings, builds search index, and generates a chat session.
     """
-    global current_chat_id, current_document_id
-    
     try:
         # Validate file type
         if not file.filename.lower().endswith('.pdf'):
@@ -428,7 +512,8 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
         print(f"Loaded PDF with {len(text)} characters")
         
         # Split into chunks
-        chunks = split_text(text, chunk_size=1200, overlap=200)
+        # Offsets into one copy of the text, overlap not duplicated (see chunk_spans.py)
+        chunks = split_spans(text, chunk_size=1200, overlap=200)
         print(f"Created {len(chunks)} chunks")
         
         # Generate embeddings
@@ -440,40 +525,20 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
         print("Building FAISS index...")
         index = build_faiss_index(embeddings)
         
-        # Extract user email from request first
-        user_email = request.headers.get('x-user-email')
-        auth_header = request.headers.get('authorization')
-        
+        # Resolve the requesting user once (token or x-user-email, then cached)
+        user_email = await resolve_user_email(request)
         print(f"=== UPLOAD DEBUG ===")
-        print(f"x-user-email header: {user_email}")
-        print(f"authorization header: {auth_header}")
-        print(f"All headers: {dict(request.headers)}")
-        
-        # If no user email, try to get from any authenticated user for now
-        if not user_email:
-            print("Warning: No user email in headers, using fallback")
-            try:
-                from users.models import User
-                recent_user = await sync_to_async(User.objects.order_by('-id').first)()
-                if recent_user:
-                    user_email = recent_user.email
-                    print(f"Using recent user email: {user_email}")
-            except Exception as e:
-                print(f"Fallback user lookup failed: {e}")
+        print(f"Resolved user email: {user_email}")
         
         # Save to GCS (required) - use local function instead of create_db
         gcs_user_id = user_email.replace('@', '_').replace('.', '_') if user_email else 'anonymous'
         
-        print(f"Saving to GCS for user: {gcs_user_id}")
-        gcs_index_path, gcs_chunks_path = save_faiss_index_to_gcs(index, chunks, gcs_user_id, document_id)
-        print(f"Successfully saved to GCS: {gcs_index_path}, {gcs_chunks_path}")
-        
         # Generate initial summary and chat name
         chat_name = None
         initial_summary = None
         try:
             analyzer = AgreementAnalyzer()
-            summary_text = " ".join(chunks[:5])  # Use first 5 chunks for summary
+            summary_text = document_excerpt(chunks)  # Start of the document, up to SUMMARY_TOKEN_BUDGET
             summary_result = analyzer.generate_summary(summary_text)
             
             # Store the initial summary
@@ -504,12 +569,26 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
             # Fallback chat name
             chat_name = generate_chat_name(document_name=file.filename)
         
+        # Index, chunks, BM25 and summary go to storage as one packed artifact
+        print(f"Saving to GCS for user: {gcs_user_id}")
+        gcs_artifact_path = save_faiss_index_to_gcs(
+            index, chunks, gcs_user_id, document_id, initial_summary, embeddings
+        )
+        print(f"Successfully saved to GCS: {gcs_artifact_path}")
+        
+        # Add the chunks to the user's cross-document index (/api/search)
+        try:
+            get_user_index_store().add_document(gcs_user_id, document_id, embeddings, chunks, file.filename)
+        except Exception as e:
+            print(f"⚠️ Warning: Failed to update user search index: {e}")
+        
         # Save chat session
         save_chat_session(
             chat_id=chat_id,
             chat_name=chat_name,
             document_name=file.filename,
-            document_path=file_path
+            document_path=file_path,
+            user_id=gcs_user_id
         )
 
         print(f"Final user email for Django sync: {user_email}")
@@ -521,26 +600,20 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
                 raise Exception("No user email for Django sync")
             
             # Create DjangoSync and GCS storage
-            django_sync = await sync_to_async(DjangoSync)(auth_header=auth_header, user_email=user_email)
-            gcs_chat = GCSChatStorage()
-            
-            # Upload PDF to GCS (required)
-            from google.cloud import storage
-            storage_client = storage.Client()
-            bucket_name = os.getenv("GCS_BUCKET_NAME", "legal-agreement-analyzer-gen-ai-legal")
-            bucket = storage_client.bucket(bucket_name)
+            django_sync = await get_django_sync(request, user_email)
+            gcs_chat = get_chat_storage()
             
-            # Upload PDF to GCS
+            # Upload PDF to storage (required)
+            storage = get_storage()
             pdf_blob_path = f"users/{gcs_user_id}/documents/{document_id}/{file.filename}"
-            pdf_blob = bucket.blob(pdf_blob_path)
             
-            print(f"Uploading PDF to GCS: gs://{bucket_name}/{pdf_blob_path}")
+            print(f"Uploading PDF to storage: {storage.uri(pdf_blob_path)}")
             with open(file_path, "rb") as f:
-                pdf_blob.upload_from_file(f)
+                storage.put(pdf_blob_path, f.read(), content_type=file.content_type or "application/pdf")
             
-            gcs_pdf_uri = f"gs://{bucket_name}/{pdf_blob_path}"
-            gcs_vector_uri = f"gs://{bucket_name}/{gcs_index_path}"
-            gcs_chunks_uri_full = f"gs://{bucket_name}/{gcs_chunks_path}"
+            gcs_pdf_uri = storage.uri(pdf_blob_path)
+            # The packed artifact holds both the vectors and the chunks
+            gcs_vector_uri = gcs_chunks_uri_full = storage.uri(gcs_artifact_path)
             
             print(f"Successfully uploaded to GCS:")
             print(f"  PDF: {gcs_pdf_uri}")
@@ -573,38 +646,19 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
                 'document_id': document_id,
                 'created_at': datetime.now().isoformat()
             }
-            gcs_chat.save_chat_session(user_email, session_data)
-            print(f"Chat session saved to GCS: {chat_id}")
+            if gcs_chat.save_chat_session(user_email, session_data):
+                print(f"Chat session saved to GCS: {chat_id}")
+            else:
+                print(f"⚠️ Warning: Chat session {chat_id} not saved to GCS")
             
-            # Save initial summary message to Django and GCS
+            # Queue initial summary message for local, Django and GCS persistence
             if initial_summary:
                 summary_text = f"Here is a summary of the uploaded document:\n\n{initial_summary['summary']}"
-                
-                # Save to Django
-                await sync_to_async(django_sync.create_chat_message)(chat_id, "assistant", summary_text)
-                print(f"Summary message saved to Django for chat {chat_id}")
-                
-                # Save to GCS
-                gcs_user_id = user_email.replace('@', '_').replace('.', '_')
-                message_data = {
-                    'id': f"summary_{datetime.now().isoformat()}",
-                    'message_type': 'assistant',
-                    'content': summary_text,
-                    'created_at': datetime.now().isoformat()
-                }
-                bucket = storage_client.bucket("legal-agreement-analyzer-gen-ai-legal")
-                message_path = f"users/{gcs_user_id}/chat_messages/{chat_id}/{message_data['id']}.json"
-                message_blob = bucket.blob(message_path)
-                message_blob.upload_from_string(json.dumps(message_data, ensure_ascii=False))
-                print(f"Summary message saved to GCS: {message_path}")
+                record_chat_turn(chat_id, [new_chat_message("assistant", summary_text)], user_email)
+                print(f"Summary message queued for chat {chat_id}")
             
-            # Create Summary in GCS and Django
+            # Create Summary in Django (storage has it in the packed artifact)
             if initial_summary:
-                # Save summary to GCS
-                gcs_summary_path = save_summary_to_gcs(initial_summary, gcs_user_id, document_id)
-                print(f"Summary saved to GCS: gs://{bucket_name}/{gcs_summary_path}")
-                
-                # Save summary to Django
                 summary_created = await sync_to_async(django_sync.create_summary)(document_id, initial_summary)
                 print(f"Summary created in Django: {summary_created}")
         except Exception as django_error:
@@ -613,22 +667,16 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
             traceback.print_exc()
             # Continue without Django sync - the FastAPI functionality will still work
 
-        
-        # Update global variables
-        current_chat_id = chat_id
-        current_document_id = document_id
 
-                # Save to GCS as backup
+        # Record the session in the user's storage index as a backup
+        # (index, chunks and summary were already written above)
         try:
-            gcs_user_id = user_email.replace('@', '_').replace('.', '_') if user_email else "anonymous"
-            gcs_index_path, gcs_chunks_path = save_faiss_index_to_gcs(index, chunks, gcs_user_id, document_id)
-            save_summary_to_gcs(initial_summary, gcs_user_id, document_id)
             save_chat_session_to_gcs(
                 {
                     "id": chat_id,
                     "name": chat_name,
                     "document_name": file.filename,
-                    "document_path": f"gs://{GCS_BUCKET_NAME}/users/{gcs_user_id}/documents/{document_id}/{file.filename}",
+                    "document_path": get_storage().uri(f"users/{gcs_user_id}/documents/{document_id}/{file.filename}"),
                     "document_id": document_id,
                     "created_at": datetime.now().isoformat(),
                     "last_updated": datetime.now().isoformat(),
@@ -636,7 +684,7 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
                 },
                 gcs_user_id,
             )
-            print(f"✓ Document, index, summary, and session also stored in GCS")
+            print(f"✓ Session also stored in GCS")
         except Exception as e:
             print(f"⚠️ Warning: Failed to save to GCS: {e}")
 
@@ -678,7 +726,7 @@ async def generate_chat_name_endpoint(request: ChatNameRequest):
         raise HTTPException(status_code=500, detail=f"Error generating chat name: {str(e)}")
 
 @app.post("/api/ask-question", response_model=QueryResponse)
-async def ask_question(request: QueryRequest):
+async def ask_question(request: QueryRequest, http_request: Request):
     print(f"\n=== ASK QUESTION CALLED ===")
     print(f"Query: {request.query}")
     print(f"Chat ID: {request.chat_id}")
@@ -687,12 +735,21 @@ async def ask_question(request: QueryRequest):
     Ask a question about the uploaded legal document.
     Users can only chat after uploading a document and getting a response from Vertex AI.
     """
-    global current_chat_id, current_document_id
-    
+    turn_messages = []
+    turn_recorded = False
+    user_email = None
     try:
-        # Check if document is uploaded and processed
-        document_id = request.document_id or current_document_id
+        # Missing ids are resolved only from the sessions of a token-verified user;
+        # the x-user-email header and most-recent-user fallback never pick a chat
+        user_email = await resolve_user_email(http_request)
+        verified_email = await resolve_verified_email(http_request)
+        chat_id, document_id = await resolve_session_ids(verified_email, request.chat_id, request.document_id)
         
+        if not document_id and not verified_email:
+            raise HTTPException(
+                status_code=401,
+                detail="Sign in, or pass the chat_id and document_id to ask about."
+            )
         if not document_id:
             raise HTTPException(
                 status_code=400, 
@@ -713,59 +770,37 @@ async def ask_question(request: QueryRequest):
             if not doc.gcs_vector_uri or not doc.gcs_chunks_uri:
                 raise HTTPException(status_code=404, detail="Document vectors not found in GCS.")
             
-            # Load from GCS using database info
-            from google.cloud import storage
-            import tempfile
-            import io
-            storage_client = storage.Client()
-            
-            print(f"Loading from GCS: {doc.gcs_vector_uri}")
-            
-            # Download FAISS index from GCS to memory
-            bucket_name = doc.gcs_vector_uri.split('/')[2]
-            index_blob_path = '/'.join(doc.gcs_vector_uri.split('/')[3:])
-            bucket = storage_client.bucket(bucket_name)
-            index_blob = bucket.blob(index_blob_path)
+            # Load from storage using database info
+            print(f"Loading from storage: {doc.gcs_vector_uri}")
+            index_store, vector_path = resolve_uri(doc.gcs_vector_uri)
+            chunks_store, chunks_path = resolve_uri(doc.gcs_chunks_uri)
             
         except Exception as db_error:
             print(f"Database connection failed: {db_error}")
             print("Falling back to GCS-only approach...")
             
-            # Fallback: Load from GCS using the document_id
-            from google.cloud import storage
-            import tempfile
-            import io
-            storage_client = storage.Client()
+            # Fallback: find the document in storage using the document_id
+            storage = get_storage()
+            index_store = chunks_store = storage
             
-            # Try to find the document in GCS using the document_id
-            bucket_name = os.getenv("GCS_BUCKET_NAME", "legal-agreement-analyzer-gen-ai-legal")
-            bucket = storage_client.bucket(bucket_name)
-            
-            # Try different path structures to find the document
-            possible_paths = [
-                # Try with anonymous user first (most common fallback)
-                f"users/anonymous/vectorstore/{document_id}/index.faiss",
-                f"users/anonymous/vectorstore/{document_id}/chunks.json",
-                # Try with different user patterns
-                f"users/xyz_gmail_com/vectorstore/{document_id}/index.faiss",
-                f"users/xyz_gmail_com/vectorstore/{document_id}/chunks.json",
-                # Try old path structure
-                f"documents/{document_id}/index.faiss",
-                f"documents/{document_id}/chunks.json",
+            # (index path, chunks path) candidates, the requesting user's folder first;
+            # a packed artifact holds both in one object
+            user_ids = list(dict.fromkeys([storage_user_id(user_email), storage_user_id(None)]))
+            possible_paths = [(artifact_path(uid, document_id),) * 2 for uid in user_ids]
+            possible_paths += [
+                (f"users/{uid}/vectorstore/{document_id}/index.faiss",
+                 f"users/{uid}/vectorstore/{document_id}/chunks.json")
+                for uid in user_ids
             ]
+            # Old path structure
+            possible_paths.append((f"documents/{document_id}/index.faiss", f"documents/{document_id}/chunks.json"))
             
             vector_path = None
             chunks_path = None
             
             # Find the correct paths by checking existence
-            for i in range(0, len(possible_paths), 2):
-                test_vector_path = possible_paths[i]
-                test_chunks_path = possible_paths[i + 1]
-                
-                index_blob = bucket.blob(test_vector_path)
-                chunks_blob = bucket.blob(test_chunks_path)
-                
-                if index_blob.exists() and chunks_blob.exists():
+            for test_vector_path, test_chunks_path in possible_paths:
+                if storage.exists(test_vector_path) and storage.exists(test_chunks_path):
                     vector_path = test_vector_path
                     chunks_path = test_chunks_path
                     print(f"Found document at: {vector_path}")
@@ -773,66 +808,43 @@ async def ask_question(request: QueryRequest):
             
             if not vector_path or not chunks_path:
                 # List all available files to help debug
-                print("Available files in GCS bucket:")
-                for blob in bucket.list_blobs(prefix="users/"):
-                    if document_id in blob.name:
-                        print(f"  {blob.name}")
+                print("Available files in storage:")
+                for name in storage.list(prefix="users/"):
+                    if document_id in name:
+                        print(f"  {name}")
                 
                 raise HTTPException(status_code=404, detail=f"Document vectors not found in GCS for document {document_id}. Please re-upload the document.")
             
-            print(f"Loading from GCS fallback: {vector_path}")
-            index_blob = bucket.blob(vector_path)
-        
-        # Download to bytes and save to a writable temp directory
-        index_data = index_blob.download_as_bytes()
-        
-        # Use absolute path based on current file location
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        temp_dir = os.path.join(current_dir, "temp")
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_index_path = os.path.join(temp_dir, f"index_{document_id}.faiss")
-        
-        print(f"Current working directory: {os.getcwd()}")
-        print(f"Current file directory: {current_dir}")
-        print(f"Temp directory: {temp_dir}")
-        
-        with open(temp_index_path, "wb") as f:
-            f.write(index_data)
+            print(f"Loading from storage fallback: {vector_path}")
         
-        print(f"FAISS index saved to: {temp_index_path}")
-        print(f"File exists: {os.path.exists(temp_index_path)}")
-        print(f"File size: {os.path.getsize(temp_index_path) if os.path.exists(temp_index_path) else 'N/A'} bytes")
-        print(f"Absolute path: {os.path.abspath(temp_index_path)}")
-        
-        # Verify the file was written correctly
-        if not os.path.exists(temp_index_path):
-            raise Exception(f"Failed to create temp file: {temp_index_path}")
-        
-        if os.path.getsize(temp_index_path) == 0:
-            raise Exception(f"Temp file is empty: {temp_index_path}")
-        
-        index = faiss.read_index(temp_index_path)
-        print(f"FAISS index loaded successfully with {index.ntotal} vectors")
-        
-        # Don't clean up temp file yet - keep it for the duration of the request
-        
-        # Download chunks from GCS
-        try:
-            # Try database approach first
-            chunks_blob_path = '/'.join(doc.gcs_chunks_uri.split('/')[3:])
-            chunks_blob = bucket.blob(chunks_blob_path)
-        except:
-            # Fallback approach
-            chunks_blob = bucket.blob(chunks_path)
-        
-        chunks_data = chunks_blob.download_as_text()
-        chunks = json.loads(chunks_data)
+        if is_artifact(vector_path):
+            # Packed artifact: range-read the index and BM25 now, chunk texts only when used
+            try:
+                chunks = PackedArtifact(index_store, vector_path)
+            except ObjectNotFound as e:
+                raise HTTPException(status_code=404, detail=f"Document vectors not found in GCS: {e}")
+            index_meta = chunks.meta
+            index = chunks.load_index()
+            lexical = chunks.lexical()
+        else:
+            # Deserialize the index straight from the downloaded bytes (no temp files)
+            try:
+                index_data = index_store.get(vector_path)
+                chunks_data = chunks_store.get_text(chunks_path)
+            except ObjectNotFound as e:
+                raise HTTPException(status_code=404, detail=f"Document vectors not found in GCS: {e}")
+            if not index_data:
+                raise Exception(f"Stored index is empty: {vector_path}")
+            
+            index_meta = load_meta(index_store, vector_path)
+            index = load_index(index_data, index_meta)
+            chunks = json.loads(chunks_data)
+            lexical = load_lexical(chunks_store, chunks_path, chunks)
+        print(f"FAISS index loaded successfully with {index.ntotal} vectors ({(index_meta or {}).get('type', 'flat')})")
         
         print(f"Successfully loaded from GCS: {len(chunks)} chunks")
         
         # Get or create chat session
-        chat_id = request.chat_id or current_chat_id
-        
         if not chat_id:
             # Create new chat session for this document
             chat_id = str(uuid.uuid4())
@@ -847,20 +859,8 @@ async def ask_question(request: QueryRequest):
             )
             # Also create in Django
             try:
-                # Get user email from headers or use fallback
-                user_email = request.headers.get('x-user-email')
-                if not user_email:
-                    try:
-                        from users.models import User
-                        recent_user = await sync_to_async(User.objects.order_by('-id').first)()
-                        if recent_user:
-                            user_email = recent_user.email
-                    except Exception:
-                        pass
-                
                 if user_email:
-                    auth_header = request.headers.get('authorization')
-                    django_sync = await sync_to_async(DjangoSync)(auth_header=auth_header, user_email=user_email)
+                    django_sync = await get_django_sync(http_request, user_email)
                     await sync_to_async(django_sync.create_chat_session)(chat_id, chat_name, document_id)
                     print(f"Chat session {chat_id} created in Django")
                 else:
@@ -869,63 +869,18 @@ async def ask_question(request: QueryRequest):
                 print(f"ERROR: Django chat session creation failed: {e}")
                 import traceback
                 traceback.print_exc()
-            current_chat_id = chat_id
         
-        # Save user message locally and to Django
-        save_chat_message(chat_id, "user", request.query)
-        
-        try:
-            # Get user email from headers or use fallback
-            user_email = request.headers.get('x-user-email')
-            auth_header = request.headers.get('authorization')
-            print(f"=== MESSAGE SYNC DEBUG ===")
-            print(f"user_email: {user_email}")
-            print(f"auth_header: {auth_header}")
-            print(f"chat_id: {chat_id}")
-            print(f"query: {request.query}")
-            print(f"All headers: {dict(request.headers)}")
-            
-            if not user_email:
-                try:
-                    from users.models import User
-                    recent_user = await sync_to_async(User.objects.order_by('-id').first)()
-                    if recent_user:
-                        user_email = recent_user.email
-                        print(f"DEBUG: Using fallback user email: {user_email}")
-                except Exception:
-                    pass
-            
-            if user_email:
-                django_sync = await sync_to_async(DjangoSync)(auth_header=auth_header, user_email=user_email)
-                await sync_to_async(django_sync.create_chat_message)(chat_id, "user", request.query)
-                print(f"✓ User message saved to Django for chat {chat_id}")
-                
-                # Also save to GCS
-                gcs_user_id = user_email.replace('@', '_').replace('.', '_')
-                message_data = {
-                    'id': f"user_{datetime.now().isoformat()}",
-                    'message_type': 'user',
-                    'content': request.query,
-                    'created_at': datetime.now().isoformat()
-                }
-                bucket = storage_client.bucket(os.getenv("GCS_BUCKET_NAME", "legal-agreement-analyzer-gen-ai-legal"))
-                message_path = f"users/{gcs_user_id}/chat_messages/{chat_id}/{message_data['id']}.json"
-                message_blob = bucket.blob(message_path)
-                message_blob.upload_from_string(json.dumps(message_data, ensure_ascii=False))
-                print(f"✓ User message saved to GCS: {message_path}")
-            else:
-                print("✗ ERROR: No user email found for Django message sync")
-        except Exception as e:
-            print(f"✗ ERROR: Django message creation failed: {e}")
-            import traceback
-            traceback.print_exc()
+        # The user message is persisted together with the answer (write-behind, see outbox.py)
+        if not user_email:
+            print("✗ ERROR: No user email found, messages will only be stored locally")
+        turn_messages.append(new_chat_message("user", request.query))
         
         # Handle special "summary" command
         if request.query.lower() == "summary":
             # Generate detailed summary using AgreementAnalyzer
             try:
                 analyzer = AgreementAnalyzer()
-                summary_text = " ".join(chunks[:5])  # Use first 5 chunks for summary
+                summary_text = document_excerpt(chunks)  # Start of the document, up to SUMMARY_TOKEN_BUDGET
                 summary_result = analyzer.generate_detailed_summary(summary_text)
                 
                 response_text = f"Agreement Type: {summary_result['agreement_type']}\n"
@@ -935,189 +890,202 @@ async def ask_question(request: QueryRequest):
                 response_text += summary_result['summary']
                 response_text += "\n" + "=" * 60
                 
-                # Save assistant response locally and to Django
-                save_chat_message(chat_id, "assistant", response_text)
-                try:
-                    # Get user email for Django sync
-                    user_email = request.headers.get('x-user-email')
-                    auth_header = request.headers.get('authorization')
-                    if not user_email:
-                        try:
-                            from users.models import User
-                            recent_user = await sync_to_async(User.objects.order_by('-id').first)()
-                            if recent_user:
-                                user_email = recent_user.email
-                        except Exception:
-                            pass
-                    
-                    if user_email:
-                        django_sync = await sync_to_async(DjangoSync)(auth_header=auth_header, user_email=user_email)
-                        await sync_to_async(django_sync.create_chat_message)(chat_id, "assistant", response_text)
-                        print(f"Assistant message saved to Django for chat {chat_id}")
-                except Exception as e:
-                    print(f"ERROR: Django assistant message creation failed: {e}")
-                    import traceback
-                    traceback.print_exc()
+                # Queue user question and assistant response for persistence
+                turn_messages.append(new_chat_message("assistant", response_text))
+                message_count = record_chat_turn(chat_id, turn_messages, user_email)
+                turn_recorded = True
                 
                 return QueryResponse(
                     success=True,
                     response=response_text,
                     chat_id=chat_id,
-                    message_count=len(get_chat_messages(chat_id))
+                    message_count=message_count
                 )
                 
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Error generating detailed summary: {str(e)}")
         
+        # Hybrid retrieval: FAISS + BM25 fused by rank, BM25 alone if embedding is down
+        retrieval = retrieve_scored(index, chunks, request.query, k=3, lexical=lexical)
+        
+        # Nothing in the document is close to the question, or nothing was retrieved
+        # (embedding down and no BM25 hit): answer without a generation call
+        if retrieval["relevant"] is False or not retrieval["ids"]:
+            print(f"Relevance gate: best similarity {retrieval['best_similarity']}, "
+                  f"best BM25 {retrieval['best_bm25']:.2f}, {len(retrieval['ids'])} chunks; skipping Gemini")
+            turn_messages.append(new_chat_message("assistant", OFF_TOPIC_REPLY))
+            message_count = record_chat_turn(chat_id, turn_messages, user_email)
+            turn_recorded = True
+            return QueryResponse(
+                success=True,
+                response=OFF_TOPIC_REPLY,
+                chat_id=chat_id,
+                message_count=message_count
+            )
+        
         # Load Gemini model for regular queries
         model = load_gemini_model()
+        top_idx = retrieval["ids"]
+        # Overlapping picks are sent as one passage
+        context = merge_chunks(chunks, top_idx)
         
-        # Embed query and search
-        q_vec = embed_query(request.query)
-        top_idx = search(index, q_vec, k=3)
-        context = [chunks[i] for i in top_idx]
-        
-        # Build prompt for legal analysis
-        prompt = f"""You are a professional legal assistant who explains complex legal documents in simple, easy-to-understand language for people without legal backgrounds.
-
-CONTEXT FROM DOCUMENT:
-{"\n\n".join(context)}
-
-USER QUESTION: {request.query}
-
-INSTRUCTIONS:
-- **Use simple language** - Explain legal terms in plain English that anyone can understand
-- **Break down complexity** - Take complex legal concepts and make them clear and accessible
-- **Provide practical understanding** - Help users grasp what the legal language actually means for them
-- **Maintain professionalism** - Be helpful and informative while staying professional
-- **Give detailed answers when needed** - If the question requires steps, procedures, or comprehensive explanation, provide them
-
-RESPONSE STYLE:
-- Start with a clear, direct answer to the question
-- **If the question requires detailed steps or procedures, provide them clearly**
-- **Use bullet points and numbered lists when they make complex information easier to understand**
-- Break down complex legal concepts into simple, understandable parts
-- Use examples and practical explanations when helpful
-- Avoid legal jargon and complex terminology
-- Be informative and helpful without being overly casual
-- **Adapt response length to the complexity of the question**
-
-Remember: Your goal is to make legal documents understandable for non-legal professionals. Use clear, simple language while maintaining professional credibility. If a question needs detailed steps or comprehensive explanation, provide it."""
+        # Build prompt for legal analysis, packed into the model's token budget
+        prompt = build_answer_prompt(request.query, context, model=model)
 
         # Generate response
         resp = model.generate_content(prompt)
         response_text = getattr(resp, 'text', str(resp))
         
-        # Save assistant response locally and to Django
-        save_chat_message(chat_id, "assistant", response_text)
-        try:
-            # Get user email for Django sync
-            user_email = request.headers.get('x-user-email')
-            auth_header = request.headers.get('authorization')
-            if not user_email:
-                try:
-                    from users.models import User
-                    recent_user = await sync_to_async(User.objects.order_by('-id').first)()
-                    if recent_user:
-                        user_email = recent_user.email
-                except Exception:
-                    pass
-            
-            if user_email:
-                django_sync = await sync_to_async(DjangoSync)(auth_header=auth_header, user_email=user_email)
-                await sync_to_async(django_sync.create_chat_message)(chat_id, "assistant", response_text)
-                print(f"Assistant message saved to Django for chat {chat_id}")
-                
-                # Also save to GCS
-                gcs_user_id = user_email.replace('@', '_').replace('.', '_')
-                message_data = {
-                    'id': f"assistant_{datetime.now().isoformat()}",
-                    'message_type': 'assistant',
-                    'content': response_text,
-                    'created_at': datetime.now().isoformat()
-                }
-                bucket = storage_client.bucket(os.getenv("GCS_BUCKET_NAME", "legal-agreement-analyzer-gen-ai-legal"))
-                message_path = f"users/{gcs_user_id}/chat_messages/{chat_id}/{message_data['id']}.json"
-                message_blob = bucket.blob(message_path)
-                message_blob.upload_from_string(json.dumps(message_data, ensure_ascii=False))
-                print(f"✓ Assistant message saved to GCS: {message_path}")
-            else:
-                print(f"ERROR: No user email for Django sync")
-        except Exception as e:
-            print(f"ERROR: Django assistant message creation failed: {e}")
-            import traceback
-            traceback.print_exc()
-            # Don't let this fail the whole request - but log it clearly
-            print(f"CRITICAL: Message sync to database failed - messages will only be stored locally")
-            pass
-        
-        # Update chat session
-        try:
-            sessions = load_chat_sessions()
-            for session in sessions:
-                if session["id"] == chat_id:
-                    session["message_count"] = len(get_chat_messages(chat_id))
-                    session["last_updated"] = datetime.now().isoformat()
-                    break
-            
-            # Save updated sessions
-            data_dir = "data"
-            os.makedirs(data_dir, exist_ok=True)
-            sessions_file = os.path.join(data_dir, "chat_sessions.json")
-            with open(sessions_file, "w", encoding="utf-8") as f:
-                json.dump(sessions, f, indent=2, ensure_ascii=False)
-                
-        except Exception as e:
-            print(f"Warning: Could not update chat session: {e}")
-        
-        # Clean up temp FAISS index file
-        try:
-            if 'temp_index_path' in locals() and os.path.exists(temp_index_path):
-                os.remove(temp_index_path)
-                print(f"Cleaned up temp file: {temp_index_path}")
-        except Exception as cleanup_error:
-            print(f"Warning: Could not clean up temp file: {cleanup_error}")
+        # Queue user question and assistant response for persistence; the
+        # outbox flusher also bumps the local session's message_count
+        turn_messages.append(new_chat_message("assistant", response_text))
+        message_count = record_chat_turn(chat_id, turn_messages, user_email)
+        turn_recorded = True
         
         return QueryResponse(
             success=True,
             response=response_text,
             chat_id=chat_id,
-            message_count=len(get_chat_messages(chat_id))
+            message_count=message_count
         )
         
     except Exception as e:
         print(f"Error processing question: {e}")
-        # Clean up temp FAISS index file in case of error
-        try:
-            if 'temp_index_path' in locals() and os.path.exists(temp_index_path):
-                os.remove(temp_index_path)
-                print(f"Cleaned up temp file after error: {temp_index_path}")
-        except Exception as cleanup_error:
-            print(f"Warning: Could not clean up temp file after error: {cleanup_error}")
+        # Keep the user's question even if answering failed
+        if turn_messages and not turn_recorded:
+            try:
+                record_chat_turn(chat_id, turn_messages, user_email)
+            except Exception as record_error:
+                print(f"Warning: Could not queue user message: {record_error}")
         raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
 
+def storage_user_id(user_email: Optional[str]) -> str:
+    """Folder name for a user's objects in storage."""
+    return user_email.replace('@', '_').replace('.', '_') if user_email else "anonymous"
+
+@app.post("/api/search", response_model=SearchResponse)
+async def search_documents(request: SearchRequest, http_request: Request):
+    """Top matching chunks across all of the requesting user's documents, in one vector search."""
+    user_email = await resolve_verified_email(http_request)
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Sign in to search your documents.")
+    k = max(1, min(request.k, 50))
+    try:
+        shard = get_user_index_store().load(storage_user_id(user_email))
+        if shard.index is None:
+            return SearchResponse(success=True, results=[])
+        # At the shard's own size, which predates any EMBEDDING_OUTPUT_DIM change
+        q_vec = embed_query(request.query, shard.index.d)
+        hits = shard.search(q_vec, k)
+        return SearchResponse(success=True, results=[SearchHit(**hit) for hit in hits])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching documents: {str(e)}")
+
+def _delete_document_record(user_email: str, document_id: str) -> bool:
+    """Delete the user's Document row (chunks and summary cascade; chat sessions are kept)."""
+    from geniai.models import Document
+    deleted, _ = Document.objects.filter(id=document_id, user__email=user_email).delete()
+    return deleted > 0
+
+@app.delete("/api/documents/{document_id}")
+async def delete_document(document_id: str, http_request: Request):
+    """Delete a document's vectors, summary and database record, and drop it from the user's search index."""
+    user_email = await resolve_verified_email(http_request)
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Sign in to delete documents.")
+    user_id = storage_user_id(user_email)
+    try:
+        in_index = get_user_index_store().remove_document(user_id, document_id)
+        try:
+            in_db = await sync_to_async(_delete_document_record)(user_email, document_id)
+        except Exception as e:
+            print(f"⚠️ Django delete failed for document {document_id}: {e}")
+            in_db = False
+
+        storage = get_storage()
+        prefixes = [f"users/{user_id}/vectorstore/{document_id}/", f"users/{user_id}/documents/{document_id}/"]
+        names = [name for prefix in prefixes for name in storage.list(prefix)]
+        summary_path = f"users/{user_id}/summaries/{document_id}_summary.json"
+        if storage.exists(summary_path):
+            names.append(summary_path)
+        for name in names:
+            try:
+                storage.delete(name)
+            except ObjectNotFound:
+                pass
+
+        if not (in_index or in_db or names):
+            raise HTTPException(status_code=404, detail="Document not found.")
+        return {"success": True, "document_id": document_id, "deleted_objects": len(names)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
+
 @app.get("/api/chat-sessions", response_model=List[ChatSession])
-async def get_chat_sessions(user_id: Optional[str] = None):
-    """Get all chat sessions."""
+async def get_chat_sessions(response: Response, user_id: Optional[str] = None,
+                            limit: Optional[int] = None, cursor: Optional[str] = None):
+    """
+    Get chat sessions newest first, one page at a time. The cursor for the
+    next page is returned in the X-Next-Cursor header.
+    """
     try:
+        limit = page_size(limit)
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        sessions = None
         if user_id:
             try:
-                return load_chat_sessions_from_gcs(user_id)
+                # The GCS session index is a single object; page it in memory
+                sessions = sorted(
+                    load_chat_sessions_from_gcs(user_id),
+                    key=lambda s: (s.get("last_updated") or "", str(s.get("id"))),
+                    reverse=True,
+                )
+                if after:
+                    sessions = [s for s in sessions if (s.get("last_updated") or "", str(s.get("id"))) < after]
+                sessions = sessions[:limit + 1]
             except Exception as e:
                 print(f"⚠️ GCS load failed, falling back to local: {e}")
-        return load_chat_sessions()
+                sessions = None
+        if sessions is None:
+            sessions = get_registry().list(limit=limit + 1, after=after)
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            last = sessions[-1]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.get("last_updated") or "", last["id"])
+        return sessions
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading chat sessions: {str(e)}")
 
 @app.get("/api/chat-history/{chat_id}", response_model=ChatHistoryResponse)
-async def get_chat_history(chat_id: str):
-    """Get chat history for a specific chat session."""
+async def get_chat_history(chat_id: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                           direction: str = "forward"):
+    """
+    Get one page of chat history, oldest first (or newest first with
+    direction=backward). Pass next_cursor back as ?cursor= for the next page.
+    """
     try:
-        messages = get_chat_messages(chat_id)
+        limit = page_size(limit)
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    backward = direction == "backward"
+    try:
+        messages = get_registry().get_messages(chat_id, limit=limit + 1, after=after, backward=backward)
+        next_cursor = None
+        if len(messages) > limit:
+            # The extra row sits at the far end of the page in the paging direction
+            messages = messages[1:] if backward else messages[:limit]
+            edge = messages[0] if backward else messages[-1]
+            next_cursor = encode_cursor(edge["created_at"], edge["id"])
         return ChatHistoryResponse(
             success=True,
             messages=[ChatMessage(**msg) for msg in messages],
-            chat_id=chat_id
+            chat_id=chat_id,
+            next_cursor=next_cursor
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading chat history: {str(e)}")
@@ -5,3 +5,13 @@ class GeniaiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'geniai'
     verbose_name = 'GenAI Document Management'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.db.models.signals import post_save, post_delete
+        from .django_sync import invalidate_user_on_change
+
+        # Keep the cached user records in django_sync in step with the users table
+        User = get_user_model()
+        post_save.connect(invalidate_user_on_change, sender=User, dispatch_uid='geniai_user_cache_save')
+        post_delete.connect(invalidate_user_on_change, sender=User, dispatch_uid='geniai_user_cache_delete')
@@ -0,0 +1,253 @@
+"""
+Packed per-document artifact: one object instead of index.faiss,
+chunks.json, bm25.json and _summary.json.
+
+Layout (integers little-endian):
+
+    b"LAP1" | header length (u32) | header JSON | index | bm25 | spans | block table | text blocks
+
+The header holds the section offsets (relative to the end of the header),
+the index metadata, the compression codec and the summary. Chunks are stored
+as in chunk_spans.py: the document's UTF-8 text once, with a (start, end) u32
+byte-offset pair per chunk, so the overlap between neighbouring chunks is not
+repeated. The text is compressed in BLOCK_SIZE blocks with a table of count+1
+u64 block offsets, so a reader can range-read the index, BM25 postings, spans
+and block table in one request and then only the blocks under the top-k
+chunks -- from GCS, local disk or memory alike -- without downloading the
+whole document.
+
+Version 1 artifacts (each chunk compressed on its own, "chunks" section
+instead of spans/blocks/text) are still read.
+
+Sections are zstd-compressed when the optional `zstandard` package is
+installed (ARTIFACT_COMPRESSION=zstd, the default then) and stored raw
+otherwise (ARTIFACT_COMPRESSION=none).
+"""
+
+import os
+import json
+import struct
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from chunk_spans import ChunkSpans
+from lexical_index import BM25Index
+from vector_index import index_meta, load_index, serialize_index
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"LAP1"
+ARTIFACT_FILENAME = "document.pack"
+ARTIFACT_COMPRESSION = os.getenv("ARTIFACT_COMPRESSION", "zstd" if zstandard else "none")
+ZSTD_LEVEL = 3
+VERSION = 2
+# Raw text bytes per compressed block; a ~1.2 KB chunk spans one or two
+BLOCK_SIZE = 8192
+# First read; small documents arrive whole in it
+PREFETCH_BYTES = 64 * 1024
+# Chunk reads closer than this are merged into one range request
+COALESCE_GAP = 16 * 1024
+_PREAMBLE = struct.Struct("<4sI")
+
+
+def artifact_path(user_id: str, document_id: str) -> str:
+    return f"users/{user_id}/vectorstore/{document_id}/{ARTIFACT_FILENAME}"
+
+
+def is_artifact(name: str) -> bool:
+    return name.endswith(ARTIFACT_FILENAME)
+
+
+def _compressor(codec: str):
+    if codec == "none":
+        return lambda data: data
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("ARTIFACT_COMPRESSION=zstd needs the zstandard package")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress
+    raise ValueError(f"Unknown artifact compression: {codec}")
+
+
+def _decompressor(codec: str):
+    if codec == "none":
+        return lambda data: data
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This artifact is zstd-compressed; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress
+    raise ValueError(f"Unknown artifact compression: {codec}")
+
+
+def pack(index, chunks, summary: Optional[Dict] = None, lexical: Optional[BM25Index] = None,
+         compression: Optional[str] = None) -> bytes:
+    """Serialize one document into the packed format; `chunks` is a ChunkSpans or a list of strings."""
+    codec = compression or ARTIFACT_COMPRESSION
+    compress = _compressor(codec)
+    spans = chunks if isinstance(chunks, ChunkSpans) else ChunkSpans.from_chunks(chunks)
+    lexical = lexical or BM25Index.build(spans)
+
+    index_bytes = compress(serialize_index(index))
+    lexical_bytes = compress(lexical.to_json().encode("utf-8"))
+    span_bytes = np.stack([spans.starts, spans.ends], axis=1).astype("<u4").tobytes()
+    blocks = [compress(spans.data[i:i + BLOCK_SIZE]) for i in range(0, len(spans.data), BLOCK_SIZE)]
+    offsets = np.zeros(len(blocks) + 1, dtype="<u8")
+    if blocks:
+        offsets[1:] = np.cumsum([len(b) for b in blocks])
+    table_bytes = offsets.tobytes()
+
+    sections = {}
+    position = 0
+    for name, data in (("index", index_bytes), ("lexical", lexical_bytes), ("spans", span_bytes),
+                       ("table", table_bytes)):
+        sections[name] = [position, len(data)]
+        position += len(data)
+    sections["text"] = [position, int(offsets[-1])]
+
+    header = json.dumps({
+        "version": VERSION,
+        "compression": codec,
+        "meta": index_meta(index),
+        "chunk_count": len(spans),
+        "block_size": BLOCK_SIZE,
+        "text_length": len(spans.data),
+        "sections": sections,
+        "summary": summary,
+    }, ensure_ascii=False).encode("utf-8")
+
+    return b"".join([_PREAMBLE.pack(MAGIC, len(header)), header, index_bytes, lexical_bytes, span_bytes,
+                     table_bytes, *blocks])
+
+
+def write_artifact(storage, name: str, index, chunks, summary: Optional[Dict] = None,
+                   lexical: Optional[BM25Index] = None) -> str:
+    storage.put(name, pack(index, chunks, summary, lexical), content_type="application/octet-stream")
+    return name
+
+
+class PackedArtifact:
+    """Range-reading view of a packed artifact in a storage backend."""
+
+    def __init__(self, storage, name: str, prefetch: int = PREFETCH_BYTES):
+        self.storage = storage
+        self.name = name
+        head = storage.get_range(name, 0, prefetch)
+        magic, header_length = _PREAMBLE.unpack_from(head)
+        if magic != MAGIC:
+            raise ValueError(f"{name} is not a packed document artifact")
+        header_end = _PREAMBLE.size + header_length
+        if len(head) < header_end:
+            head += storage.get_range(name, len(head), header_end - len(head))
+        self.header = json.loads(head[_PREAMBLE.size:header_end].decode("utf-8"))
+        self._base = header_end
+        self._head = head
+        self._decompress = _decompressor(self.header["compression"])
+        self._core = None
+        self._offsets = None
+
+    @property
+    def summary(self) -> Optional[Dict]:
+        return self.header.get("summary")
+
+    @property
+    def meta(self) -> Dict:
+        return self.header["meta"]
+
+    def __len__(self):
+        return self.header["chunk_count"]
+
+    def _read(self, offset: int, length: int) -> bytes:
+        """Bytes of the data area, served from the prefetched head when possible."""
+        start = self._base + offset
+        if start + length <= len(self._head):
+            return self._head[start:start + length]
+        return self.storage.get_range(self.name, start, length)
+
+    def _section(self, name: str) -> bytes:
+        if self._core is None:
+            # Everything up to the chunk texts is adjacent: one read for all of it
+            start = self.header["sections"]["index"][0]
+            table_start, table_length = self.header["sections"]["table"]
+            self._core = (start, self._read(start, table_start + table_length - start))
+        core_start, core = self._core
+        offset, length = self.header["sections"][name]
+        return core[offset - core_start:offset - core_start + length]
+
+    def load_index(self):
+        return load_index(self._decompress(self._section("index")), self.meta)
+
+    def lexical(self) -> BM25Index:
+        return BM25Index.from_json(self._decompress(self._section("lexical")).decode("utf-8"))
+
+    def _frame_offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            self._offsets = np.frombuffer(self._section("table"), dtype="<u8")
+        return self._offsets
+
+    def _frames(self, ids: Iterable[int], blob: str) -> Dict[int, bytes]:
+        """Decompressed frames (v1 chunks, v2 text blocks) by id, with nearby reads merged."""
+        offsets = self._frame_offsets()
+        blob_start = self.header["sections"][blob][0]
+        frames = {}
+        run = []
+        for i in sorted(set(ids)) + [None]:
+            if run and (i is None or int(offsets[i]) - int(offsets[run[-1] + 1]) > COALESCE_GAP):
+                first, end = int(offsets[run[0]]), int(offsets[run[-1] + 1])
+                data = self._read(blob_start + first, end - first)
+                for j in run:
+                    frames[j] = self._decompress(data[int(offsets[j]) - first:int(offsets[j + 1]) - first])
+                run = []
+            if i is not None:
+                run.append(i)
+        return frames
+
+    def _spans(self) -> np.ndarray:
+        return np.frombuffer(self._section("spans"), dtype="<u4").reshape(-1, 2)
+
+    def fetch(self, ids: Iterable[int]) -> List[str]:
+        """Texts of the given chunks, in the order asked."""
+        ids = [int(i) for i in ids]
+        for i in ids:
+            if not 0 <= i < len(self):
+                raise IndexError(f"chunk {i} out of range")
+        if self.header["version"] == 1:
+            frames = self._frames(ids, "chunks")
+            return [frames[i].decode("utf-8") for i in ids]
+
+        spans = self._spans()
+        block_size = self.header["block_size"]
+        wanted = {i: (int(spans[i][0]), int(spans[i][1])) for i in ids}
+        blocks = self._frames((b for start, end in wanted.values() if end > start
+                               for b in range(start // block_size, (end - 1) // block_size + 1)), "text")
+        texts = {}
+        for i, (start, end) in wanted.items():
+            if end <= start:
+                texts[i] = ""
+                continue
+            first = start // block_size
+            data = b"".join(blocks[b] for b in range(first, (end - 1) // block_size + 1))
+            texts[i] = data[start - first * block_size:end - first * block_size].decode("utf-8")
+        return [texts[i] for i in ids]
+
+    def byte_spans(self) -> Optional[np.ndarray]:
+        """(n, 2) byte offsets of the chunks in the document text; None for version 1 artifacts."""
+        return self._spans() if self.header["version"] > 1 else None
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.fetch(range(*item.indices(len(self))))
+        return self.fetch([item])[0]
+
+    def spans(self) -> ChunkSpans:
+        """All chunks, holding the document text once."""
+        if self.header["version"] == 1:
+            return ChunkSpans.from_chunks(self.fetch(range(len(self))))
+        blocks = self._frames(range(len(self._frame_offsets()) - 1), "text")
+        spans = self._spans()
+        return ChunkSpans(b"".join(blocks[b] for b in sorted(blocks)), spans[:, 0].copy(), spans[:, 1].copy())
+
+    def chunks(self) -> List[str]:
+        return list(self.spans()) if self.header["version"] > 1 else self.fetch(range(len(self)))
@@ -4,6 +4,10 @@ Handles JWT token validation and user context management.
 """
 
 import jwt
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from fastapi import HTTPException, Depends, status
@@ -11,17 +15,24 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
 import json
 from pathlib import Path
+from context_store import CONTEXT_HISTORY_LIMIT, get_context_store
 
 # JWT Configuration
 SECRET_KEY = "django-insecure-_y@ihlpikbig^bbjn&q@85%x9mo(y3$b@kq$urdhny4s!li45p"  # Same as Django
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Verified token payloads keyed by sha256(token), each valid until the token's exp (LRU-bounded)
+TOKEN_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+_verified_tokens: "OrderedDict[str, tuple]" = OrderedDict()
+_verified_tokens_lock = threading.Lock()
+
 # Security scheme
 security = HTTPBearer()
 
-# In-memory storage for user contexts (replace with Redis in production)
-user_contexts: Dict[str, Dict[str, Any]] = {}
+# User contexts live in a shared store (memory/SQLite/Redis, see context_store.py)
+# so every worker sees the same current chat and history.
+context_store = get_context_store()
 
 class UserContext:
     """User context for managing conversation state"""
@@ -34,26 +45,72 @@ class UserContext:
         self.conversation_history: list = []
         self.created_at = datetime.now()
 
+    @classmethod
+    def from_store(cls, data: Dict[str, Any]) -> "UserContext":
+        context = cls(data["user_id"], data.get("username"), data.get("email"))
+        context.current_chat_id = data.get("current_chat_id")
+        context.current_document_id = data.get("current_document_id")
+        if data.get("created_at"):
+            context.created_at = datetime.fromisoformat(data["created_at"])
+        return context
+
+    def to_store(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "username": self.username,
+            "email": self.email,
+            "current_chat_id": self.current_chat_id,
+            "current_document_id": self.current_document_id,
+            "created_at": self.created_at.isoformat(),
+        }
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
 def verify_jwt_token(token: str) -> Dict[str, Any]:
     """
     Verify JWT token and return payload.
     Uses the same secret key as Django backend.
+    
+    Verified payloads are cached by token digest until the token's `exp`,
+    so repeat requests with the same token skip signature verification.
     """
+    digest = _token_digest(token)
+    now = time.time()
+    with _verified_tokens_lock:
+        cached = _verified_tokens.get(digest)
+        if cached is not None:
+            if cached[1] > now:
+                _verified_tokens.move_to_end(digest)
+                return cached[0]
+            del _verified_tokens[digest]
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has expired",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # Tokens without an expiry are never cached
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        with _verified_tokens_lock:
+            _verified_tokens[digest] = (payload, float(exp))
+            while len(_verified_tokens) > TOKEN_CACHE_SIZE:
+                _verified_tokens.popitem(last=False)
+    return payload
+
+def forget_token(token: str):
+    """Drop a token from the verification cache (e.g. on logout)."""
+    with _verified_tokens_lock:
+        _verified_tokens.pop(_token_digest(token), None)
 
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> UserContext:
     """
@@ -77,77 +134,53 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         )
     
     # Get or create user context
-    if user_id not in user_contexts:
-        user_contexts[user_id] = UserContext(user_id, username, email)
-    
-    return user_contexts[user_id]
+    data = context_store.get(user_id)
+    if data is None:
+        context = UserContext(user_id, username, email)
+        context_store.put(user_id, context.to_store())
+        return context
+    return UserContext.from_store(data)
 
 def get_user_context(user_id: str) -> Optional[UserContext]:
     """Get user context by user ID"""
-    return user_contexts.get(user_id)
+    data = context_store.get(user_id)
+    if data is None:
+        return None
+    context = UserContext.from_store(data)
+    context.conversation_history = context_store.history(user_id)
+    return context
 
 def update_user_context(user_id: str, **kwargs) -> bool:
     """Update user context with new values"""
-    if user_id in user_contexts:
-        context = user_contexts[user_id]
-        for key, value in kwargs.items():
-            if hasattr(context, key):
-                setattr(context, key, value)
-        return True
-    return False
+    return context_store.update(user_id, **kwargs)
 
 def save_user_conversation(user_id: str, chat_id: str, message: str, response: str):
-    """Save conversation message to user context"""
-    if user_id in user_contexts:
-        context = user_contexts[user_id]
-        context.conversation_history.append({
-            "timestamp": datetime.now().isoformat(),
-            "chat_id": chat_id,
-            "message": message,
-            "response": response
-        })
+    """Save conversation message to user context (history is capped by the store)"""
+    context_store.append_history(user_id, {
+        "timestamp": datetime.now().isoformat(),
+        "chat_id": chat_id,
+        "message": message,
+        "response": response
+    })
 
 def get_user_conversation_history(user_id: str, chat_id: Optional[str] = None) -> list:
     """Get user's conversation history, optionally filtered by chat_id"""
-    if user_id not in user_contexts:
-        return []
-    
-    context = user_contexts[user_id]
+    history = context_store.history(user_id)
     if chat_id:
-        return [msg for msg in context.conversation_history if msg["chat_id"] == chat_id]
-    return context.conversation_history
+        return [msg for msg in history if msg["chat_id"] == chat_id]
+    return history
 
 def clear_user_context(user_id: str):
     """Clear user context (useful for logout)"""
-    if user_id in user_contexts:
-        del user_contexts[user_id]
+    context_store.delete(user_id)
 
 # Optional: Add user context persistence to file
 def save_contexts_to_file():
-    """Save user contexts to file for persistence"""
-    try:
-        data_dir = Path("data")
-        data_dir.mkdir(exist_ok=True)
-        
-        contexts_data = {}
-        for user_id, context in user_contexts.items():
-            contexts_data[user_id] = {
-                "user_id": context.user_id,
-                "username": context.username,
-                "email": context.email,
-                "current_chat_id": context.current_chat_id,
-                "current_document_id": context.current_document_id,
-                "conversation_history": context.conversation_history,
-                "created_at": context.created_at.isoformat()
-            }
-        
-        with open(data_dir / "user_contexts.json", "w") as f:
-            json.dump(contexts_data, f, indent=2)
-    except Exception as e:
-        print(f"Error saving user contexts: {e}")
+    """Kept for compatibility: the context store persists every update as it happens."""
+    pass
 
 def load_contexts_from_file():
-    """Load user contexts from file"""
+    """Import contexts from the old data/user_contexts.json dump into the context store"""
     try:
         contexts_file = Path("data") / "user_contexts.json"
         if contexts_file.exists():
@@ -155,11 +188,10 @@ def load_contexts_from_file():
                 contexts_data = json.load(f)
             
             for user_id, data in contexts_data.items():
-                context = UserContext(data["user_id"], data["username"], data["email"])
-                context.current_chat_id = data.get("current_chat_id")
-                context.current_document_id = data.get("current_document_id")
-                context.conversation_history = data.get("conversation_history", [])
-                context.created_at = datetime.fromisoformat(data.get("created_at", datetime.now().isoformat()))
-                user_contexts[user_id] = context
+                if context_store.get(user_id) is not None:
+                    continue
+                context_store.put(user_id, data)
+                for entry in data.get("conversation_history", [])[-CONTEXT_HISTORY_LIMIT:]:
+                    context_store.append_history(user_id, entry)
     except Exception as e:
         print(f"Error loading user contexts: {e}")
@@ -0,0 +1,187 @@
+"""
+Recall versus memory for reduced and quantized embedding indexes.
+
+Builds the same index (flat by default, as per-document indexes are) under
+each compression option and reports bytes per vector, the serialized index
+size, single-query p50 latency, recall@k against exact float32 search over
+full-size vectors, and how many documents of --chunks-per-doc chunks fit in
+1 GB of cached indexes.
+
+Options (see vector_index.py; combine with "+"):
+    none, fp16, sq8     scalar quantization
+    pca384, pca256 ...  PCA fitted on the corpus itself
+    dim256 ...          keep the first dims and renormalize, which is what
+                        EMBEDDING_OUTPUT_DIM returns for text-embedding-004
+                        (only representative on real Vertex vectors)
+
+Corpora:
+    synthetic  clustered 768-d vectors (default)
+    chunks     chunk texts embedded with EMBEDDING_PROVIDER (fake unless set)
+    stored     embeddings.npy of --user's documents in storage (see embedding_store.py)
+
+    python bench_compression.py --size 20000
+    python bench_compression.py --corpus stored --user alice_example_com --output compression.json
+    python bench_compression.py --options none sq8 dim256+sq8 --index hnsw
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from datetime import datetime
+
+os.environ.setdefault("EMBEDDING_PROVIDER", "fake")
+
+import numpy as np
+import faiss
+
+from bench_retrieval import chunk_vectors, recall_at_k, synthetic_queries, synthetic_vectors
+
+DEFAULT_OPTIONS = ["none", "fp16", "sq8", "pca384", "pca256", "pca128", "pca256+sq8",
+                   "dim384", "dim256", "dim256+sq8"]
+GB = 1024 ** 3
+
+
+def stored_vectors(user_id, nq, seed=1):
+    """All of a user's stored chunk embeddings; queries are held-out chunks."""
+    from embedding_store import FILENAME, load_embeddings
+    from storage_backend import get_storage
+
+    storage = get_storage()
+    matrices = [load_embeddings(storage, name)[0] for name in storage.list(f"users/{user_id}/vectorstore/")
+                if name.endswith("/" + FILENAME)]
+    if not matrices:
+        raise SystemExit(f"No stored embeddings for {user_id}")
+    vectors = np.vstack(matrices)
+    order = np.random.default_rng(seed).permutation(len(vectors))
+    nq = min(nq, len(vectors) // 5)
+    return np.ascontiguousarray(vectors[order[nq:]]), np.ascontiguousarray(vectors[order[:nq]])
+
+
+def truncate(vectors, dims):
+    reduced = np.ascontiguousarray(vectors[:, :dims])
+    return reduced / np.linalg.norm(reduced, axis=1, keepdims=True)
+
+
+def bench_option(option, base, queries, truth, ks, kind):
+    from vector_index import build_index, choose_spec, index_meta, serialize_index
+
+    parts = option.split("+")
+    if parts[0].startswith("dim"):
+        dims = int(parts[0][3:])
+        base, queries = truncate(base, dims), truncate(queries, dims)
+        parts = parts[1:]
+    compression = "+".join(parts) or "none"
+
+    n, dim = base.shape
+    start = time.perf_counter()
+    index = build_index(base, spec=choose_spec(n, dim, kind=kind, compression=compression))
+    build_s = time.perf_counter() - start
+    size = len(serialize_index(index))
+
+    k = max(ks)
+    latencies, found = [], []
+    for q in queries:
+        t = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - t)
+        found.append(ids[0].tolist())
+
+    meta = index_meta(index)
+    return {
+        "option": option,
+        "applied": "+".join(filter(None, [f"dim{dim}" if dim != truth["dim"] else "",
+                                          f"pca{meta['pca']}" if meta.get("pca") else "",
+                                          meta.get("sq", "")])) or "none",
+        "build_s": round(build_s, 3),
+        "bytes_per_vector": round(size / n, 1),
+        "size_mb": round(size / (1024 * 1024), 2),
+        "p50_ms": round(float(np.percentile(np.array(latencies) * 1000, 50)), 4),
+        **{f"recall@{kk}": round(recall_at_k(found, truth["ids"], kk), 4) for kk in ks},
+    }
+
+
+def summarize(results, chunks_per_doc):
+    baseline = next((r for r in results if r["option"] == "none"), results[0])
+    for r in results:
+        r["x_smaller"] = round(baseline["bytes_per_vector"] / r["bytes_per_vector"], 2)
+        r["docs_per_gb"] = int(GB / (r["bytes_per_vector"] * chunks_per_doc))
+    return results
+
+
+def report_table(results, k):
+    lines = [
+        f"| option | applied | bytes/vector | x smaller | docs/GB | p50 ms | recall@{k} |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for r in results:
+        lines.append(f"| {r['option']} | {r['applied']} | {r['bytes_per_vector']} | {r['x_smaller']} | "
+                     f"{r['docs_per_gb']} | {r['p50_ms']} | {r[f'recall@{k}']} |")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure recall against memory for index compression options.")
+    parser.add_argument("--corpus", choices=["synthetic", "chunks", "stored"], default="synthetic")
+    parser.add_argument("--user", help="storage user id for --corpus stored")
+    parser.add_argument("--size", type=int, default=20000, help="vectors (synthetic and chunks corpora)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="*", default=[3, 10], help="recall@k cut-offs")
+    parser.add_argument("--options", nargs="*", default=DEFAULT_OPTIONS)
+    parser.add_argument("--index", choices=["flat", "hnsw", "ivf_pq"], default="flat")
+    parser.add_argument("--chunks-per-doc", type=int, default=40, help="for the docs/GB column")
+    parser.add_argument("--output", help="write results JSON here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    if args.corpus == "stored":
+        if not args.user:
+            parser.error("--corpus stored needs --user")
+        base, queries = stored_vectors(args.user, args.queries)
+    elif args.corpus == "chunks":
+        base, queries = chunk_vectors(args.size, args.queries)
+    else:
+        base = synthetic_vectors(args.size, seed=args.size)
+        queries = synthetic_queries(base, args.queries)
+
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, ids = exact.search(queries, max(args.k))
+    truth = {"ids": ids.tolist(), "dim": base.shape[1]}
+    del exact
+
+    results = []
+    for option in args.options:
+        print(f"  {option}...", file=sys.stderr)
+        results.append(bench_option(option, base, queries, truth, args.k, args.index))
+    summarize(results, args.chunks_per_doc)
+
+    k = max(args.k)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "faiss": getattr(faiss, "__version__", None),
+            "corpus": args.corpus,
+            "vectors": len(base),
+            "dim": int(base.shape[1]),
+            "index": args.index,
+            "k": args.k,
+            "chunks_per_doc": args.chunks_per_doc,
+        },
+        "results": results,
+        "table": report_table(results, k),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    print("\n" + report["table"], file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
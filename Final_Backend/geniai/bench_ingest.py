@@ -0,0 +1,348 @@
+"""
+Ingestion benchmark.
+
+Runs the upload pipeline stage by stage -- load_pdf, split_text, embeddings
+(fake provider, see providers.py), build_faiss_index and artifact
+serialization -- over the PDFs in data/ and over synthetic agreements, and
+prints per-stage wall time, CPU time, peak RSS and chunks/s as JSON, with the
+packed artifact size and the chunks' resident bytes next to what chunks.json
+and a list of strings would take.
+
+    python bench_ingest.py                               # samples + 100/500/1000-page synthetics
+    python bench_ingest.py --pages 100 --no-samples --output before.json
+    python bench_ingest.py --baseline before.json        # exit 1 on regressions (medians of >= 3 runs)
+
+Peak RSS is the process high-water mark after each stage (ru_maxrss), so
+`rss_growth_mb` is how much a stage raised it, not what it allocated.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tempfile
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# The benchmark never calls live models
+os.environ["EMBEDDING_PROVIDER"] = "fake"
+os.environ["LLM_PROVIDER"] = "fake"
+
+import faiss
+from pypdf import PdfReader
+
+from create_db import load_pdf, split_spans, get_embeddings, build_faiss_index
+from artifact import write_artifact
+from storage_backend import MemoryBackend
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_PAGES = [100, 500, 1000]
+STAGES = ["load_pdf", "split_text", "embed", "build_index", "serialize"]
+# Fewest runs per document whose medians are compared against a baseline
+MIN_BASELINE_REPEAT = 3
+# Stages slower than baseline by more than this fraction, and by more than the
+# noise band, are flagged. The band is NOISE_SPREADS times the larger
+# run-to-run spread (max - min over --repeat runs) of the two results, and at
+# least MIN_REGRESSION_S: stages of a few milliseconds vary by half their time.
+DEFAULT_THRESHOLD = 0.2
+MIN_REGRESSION_S = 0.05
+NOISE_SPREADS = 3
+
+
+# ---------------------------
+# Synthetic agreements
+# ---------------------------
+
+CLAUSES = [
+    "The Tenant shall pay the monthly rent of {amount} on or before the {day} day of each month.",
+    "Provided that the Landlord gives {days} days written notice, the Landlord may inspect the premises.",
+    "Notwithstanding anything contained herein, the security deposit of {amount} is refundable.",
+    "Subject to clause {ref}, either party may terminate this Agreement with {days} days notice.",
+    "In the event that the rent remains unpaid for {days} days, a late fee of {amount} applies.",
+    "The Tenant shall not sublet the premises without the prior written consent of the Landlord.",
+    "All disputes arising under this Agreement are subject to the jurisdiction of the courts at {city}.",
+    "Unless otherwise agreed, maintenance charges of {amount} are payable to the housing society.",
+    "Confidentiality obligations survive termination of this Agreement for {days} months.",
+    "Liability of either party is limited to direct damages not exceeding {amount}.",
+]
+CITIES = ["Mumbai", "Pune", "Delhi", "Bengaluru", "Chennai", "Hyderabad"]
+LINES_PER_PAGE = 48
+CHARS_PER_LINE = 95
+
+
+def synthetic_agreement_lines(pages, seed=0):
+    """Deterministic numbered clauses, roughly LINES_PER_PAGE wrapped lines per page."""
+    rng = random.Random(seed)
+    lines = ["RESIDENTIAL LEASE AGREEMENT (SYNTHETIC)", ""]
+    section = 0
+    while len(lines) < pages * LINES_PER_PAGE:
+        section += 1
+        lines.append(f"Section {section}. {rng.choice(['Rent', 'Term', 'Termination', 'Deposit', 'Maintenance'])}")
+        for sub in range(1, rng.randint(3, 7)):
+            clause = rng.choice(CLAUSES).format(
+                amount=f"Rs. {rng.randint(1, 500) * 100:,}",
+                day=rng.randint(1, 28),
+                days=rng.choice([7, 15, 30, 60, 90]),
+                ref=f"{rng.randint(1, max(section, 1))}.{rng.randint(1, 5)}",
+                city=rng.choice(CITIES),
+            )
+            text = f"{section}.{sub} {clause}"
+            while text:
+                lines.append(text[:CHARS_PER_LINE])
+                text = text[CHARS_PER_LINE:]
+        lines.append("")
+    return lines[:pages * LINES_PER_PAGE]
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(path, pages, seed=0):
+    """Write a plain-text PDF with `pages` pages of synthetic clauses."""
+    lines = synthetic_agreement_lines(pages, seed)
+    font_id, pages_id = 3, 2
+    page_ids = [4 + 2 * i for i in range(pages)]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        pages_id: f"<< /Type /Pages /Kids [{' '.join(f'{p} 0 R' for p in page_ids)}] /Count {pages} >>".encode(),
+        font_id: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for i, page_id in enumerate(page_ids):
+        page_lines = lines[i * LINES_PER_PAGE:(i + 1) * LINES_PER_PAGE]
+        body = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({_pdf_escape(l)}) Tj T*" for l in page_lines) + " ET"
+        stream = body.encode("latin-1", "replace")
+        objects[page_id] = (
+            f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        ).encode()
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n" % obj_id + objects[obj_id] + b"\nendobj\n"
+    xref = len(out)
+    count = max(objects) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % count
+    for obj_id in range(1, count):
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+
+# ---------------------------
+# Measurement
+# ---------------------------
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure(fn, *args, **kwargs):
+    """Run fn once; return (result, stats)."""
+    rss_before = _peak_rss_mb()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    rss_after = _peak_rss_mb()
+    stats = {"wall_s": wall, "cpu_s": cpu, "peak_rss_mb": rss_after}
+    if rss_before is not None:
+        stats["rss_growth_mb"] = rss_after - rss_before
+    return result, stats
+
+
+def serialize_artifacts(index, chunks, storage):
+    """What upload_document writes per document: the packed artifact (see artifact.py)."""
+    write_artifact(storage, "bench/document.pack", index, chunks)
+    return len(storage.get("bench/document.pack"))
+
+
+def chunk_memory(chunks):
+    """Resident bytes of the chunk spans, and of the same chunks as a list of strings."""
+    texts = list(chunks)
+    return chunks.nbytes, sys.getsizeof(texts) + sum(sys.getsizeof(t) for t in texts)
+
+
+def run_pipeline(path, batch_size=32):
+    """One pass over the pipeline; returns (stage stats, document facts)."""
+    storage = MemoryBackend("bench")
+    stages = {}
+    text, stages["load_pdf"] = measure(load_pdf, path)
+    chunks, stages["split_text"] = measure(split_spans, text, chunk_size=1200, overlap=200)
+    if not chunks:
+        # Scanned PDFs have no text layer; nothing to embed
+        return stages, {"chars": len(text), "chunks": 0, "artifact_bytes": 0}
+    embeddings, stages["embed"] = measure(get_embeddings, chunks, batch_size=batch_size)
+    index, stages["build_index"] = measure(build_faiss_index, embeddings)
+    artifact_bytes, stages["serialize"] = measure(serialize_artifacts, index, chunks, storage)
+    span_bytes, list_bytes = chunk_memory(chunks)
+    facts = {
+        "chars": len(text),
+        "chunks": len(chunks),
+        "artifact_bytes": artifact_bytes,
+        "chunks_json_bytes": len(json.dumps(list(chunks), ensure_ascii=False).encode("utf-8")),
+        "chunk_memory_bytes": span_bytes,
+        "chunk_list_memory_bytes": list_bytes,
+    }
+    return stages, facts
+
+
+def bench_document(name, path, repeat=MIN_BASELINE_REPEAT, batch_size=32):
+    runs = []
+    for _ in range(repeat):
+        stages, facts = run_pipeline(path, batch_size)
+        runs.append(stages)
+
+    summary = {}
+    for stage in [s for s in STAGES if s in runs[0]]:
+        samples = [run[stage] for run in runs]
+        wall = statistics.median(s["wall_s"] for s in samples)
+        summary[stage] = {
+            "wall_s": round(wall, 6),
+            "cpu_s": round(statistics.median(s["cpu_s"] for s in samples), 6),
+            "wall_spread_s": round(max(s["wall_s"] for s in samples) - min(s["wall_s"] for s in samples), 6),
+            "cpu_spread_s": round(max(s["cpu_s"] for s in samples) - min(s["cpu_s"] for s in samples), 6),
+            "peak_rss_mb": samples[-1]["peak_rss_mb"],
+            "rss_growth_mb": max(s.get("rss_growth_mb") or 0 for s in samples),
+        }
+        if stage != "load_pdf" and facts["chunks"]:
+            summary[stage]["chunks_per_s"] = round(facts["chunks"] / wall, 1) if wall > 0 else None
+
+    total = sum(stats["wall_s"] for stats in summary.values())
+    return {
+        "name": name,
+        "pages": len(PdfReader(path).pages),
+        "bytes": os.path.getsize(path),
+        **facts,
+        "total_wall_s": round(total, 6),
+        "chunks_per_s": round(facts["chunks"] / total, 1) if total > 0 and facts["chunks"] else None,
+        "stages": summary,
+    }
+
+
+def sample_pdfs(data_dir=DATA_DIR):
+    return sorted(
+        os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.lower().endswith(".pdf")
+    )
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Stages whose wall or CPU time grew by more than `threshold` over the
+    baseline and by more than the noise band (see NOISE_SPREADS).
+    """
+    previous = {doc["name"]: doc for doc in baseline.get("documents", [])}
+    regressions = []
+    for doc in results["documents"]:
+        before = previous.get(doc["name"])
+        if not before:
+            continue
+        for stage, stats in doc["stages"].items():
+            old = before.get("stages", {}).get(stage)
+            if not old:
+                continue
+            for metric in ("wall_s", "cpu_s"):
+                new_value, old_value = stats[metric], old[metric]
+                spread_key = metric.replace("_s", "_spread_s")
+                spread = max(stats.get(spread_key) or 0, old.get(spread_key) or 0)
+                noise = max(MIN_REGRESSION_S, NOISE_SPREADS * spread)
+                if new_value - old_value > noise and new_value > old_value * (1 + threshold):
+                    regressions.append({
+                        "document": doc["name"],
+                        "stage": stage,
+                        "metric": metric,
+                        "baseline": old_value,
+                        "current": new_value,
+                        "change": round(new_value / old_value - 1, 3) if old_value else None,
+                    })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the document ingestion pipeline.")
+    parser.add_argument("--pages", type=int, nargs="*", default=DEFAULT_PAGES,
+                        help="sizes of synthetic agreements to generate (default: 100 500 1000)")
+    parser.add_argument("--no-samples", action="store_true", help="skip the PDFs in data/")
+    parser.add_argument("--repeat", type=int, default=MIN_BASELINE_REPEAT,
+                        help="runs per document, medians are reported (default 3)")
+    parser.add_argument("--batch-size", type=int, default=32, help="embedding batch size")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0,
+                        help="simulated latency per embedding call (fake provider)")
+    parser.add_argument("--output", help="write results JSON here as well as to stdout")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown flagged as a regression (default 0.2)")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if args.baseline and args.repeat < MIN_BASELINE_REPEAT:
+        parser.error(f"--baseline needs --repeat {MIN_BASELINE_REPEAT} or more; single runs are too noisy to compare")
+
+    if args.embed_latency_ms:
+        import providers
+        providers.get_embedding_model().faults.latency_ms = args.embed_latency_ms
+
+    documents = []
+    if not args.no_samples:
+        for path in sample_pdfs():
+            print(f"Benchmarking {os.path.basename(path)}...", file=sys.stderr)
+            documents.append(bench_document(os.path.basename(path), path, args.repeat, args.batch_size))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            name = f"synthetic-{pages}p"
+            print(f"Benchmarking {name}...", file=sys.stderr)
+            path = write_synthetic_pdf(os.path.join(tmp, f"{name}.pdf"), pages, seed=pages)
+            documents.append(bench_document(name, path, args.repeat, args.batch_size))
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "faiss": getattr(faiss, "__version__", None),
+            "repeat": args.repeat,
+            "batch_size": args.batch_size,
+            "embed_latency_ms": args.embed_latency_ms,
+        },
+        "documents": documents,
+    }
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            results["regressions"] = compare(results, json.load(f), args.threshold)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+    if results.get("regressions"):
+        for r in results["regressions"]:
+            print(f"REGRESSION {r['document']} {r['stage']} {r['metric']}: "
+                  f"{r['baseline']:.4f}s -> {r['current']:.4f}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
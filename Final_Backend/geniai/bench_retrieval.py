@@ -0,0 +1,271 @@
+"""
+Retrieval benchmark for FAISS index types.
+
+Builds Flat, HNSW, IVF-Flat and IVF-PQ indexes over the same vectors and
+measures build time, index size, single-query p50/p99 latency and recall@k
+against exact (Flat) search, then prints a decision table: per corpus size,
+the fastest index whose recall meets --min-recall.
+
+Corpora:
+    synthetic  clustered 768-d vectors, cheap at any size (default)
+    chunks     chunk texts from data/ PDFs topped up with synthetic agreement
+               clauses, embedded with EMBEDDING_PROVIDER (fake unless set)
+
+    python bench_retrieval.py --sizes 1000 10000 100000
+    python bench_retrieval.py --corpus chunks --sizes 1000 5000 --output retrieval.json
+    python bench_retrieval.py --sizes 1000000 --indexes hnsw ivf_pq   # ~3 GB of vectors
+
+Queries are perturbed corpus vectors (synthetic) or held-out chunks, searched
+one at a time as in /api/ask-question.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+from datetime import datetime
+
+os.environ.setdefault("EMBEDDING_PROVIDER", "fake")
+
+import numpy as np
+import faiss
+
+DIM = 768
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_K = [3, 10]
+INDEX_TYPES = ["flat", "hnsw", "ivf_flat", "ivf_pq"]
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 40
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+PQ_SUBQUANTIZERS = 96  # 8 dims per sub-quantizer at 768-d
+PQ_BITS = 8
+# faiss wants ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+# ---------------------------
+# Corpora
+# ---------------------------
+
+def synthetic_vectors(n, dim=DIM, clusters=None, seed=0):
+    """Unit vectors drawn around `clusters` random centres, like topic-clustered embeddings."""
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(8, int(math.sqrt(n)))
+    centres = rng.standard_normal((clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centres[labels] + 0.35 * rng.standard_normal((n, dim)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def synthetic_queries(base, nq, seed=1):
+    rng = np.random.default_rng(seed)
+    picked = base[rng.integers(0, len(base), size=nq)]
+    queries = picked + 0.05 * rng.standard_normal(picked.shape).astype("float32")
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def chunk_texts(n):
+    """Chunks from data/ PDFs, topped up with synthetic agreements (unique per chunk)."""
+    from create_db import load_pdf, split_text
+    from bench_ingest import DATA_DIR, sample_pdfs, synthetic_agreement_lines
+
+    texts = []
+    for path in sample_pdfs(DATA_DIR):
+        try:
+            texts.extend(split_text(load_pdf(path)))
+        except Exception as e:
+            print(f"Skipping {os.path.basename(path)}: {e}", file=sys.stderr)
+    seed = 0
+    while len(texts) < n:
+        seed += 1
+        texts.extend(split_text("\n".join(synthetic_agreement_lines(50, seed=seed))))
+    return texts[:n]
+
+
+def chunk_vectors(n, nq):
+    from create_db import get_embeddings
+
+    texts = chunk_texts(n + nq)
+    vectors = get_embeddings(texts, batch_size=32)
+    return vectors[:n], vectors[n:n + nq]
+
+
+# ---------------------------
+# Index types
+# ---------------------------
+
+def ivf_nlist(n):
+    return max(1, min(int(4 * math.sqrt(n)), n // MIN_POINTS_PER_CENTROID))
+
+
+def make_index(kind, n, dim=DIM):
+    if kind == "flat":
+        return faiss.IndexFlatL2(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    if kind == "ivf_flat":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, ivf_nlist(n))
+        index.nprobe = IVF_NPROBE
+        return index
+    if kind == "ivf_pq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, ivf_nlist(n), PQ_SUBQUANTIZERS, PQ_BITS)
+        index.nprobe = IVF_NPROBE
+        return index
+    raise ValueError(f"Unknown index type: {kind}")
+
+
+def describe(kind, index):
+    if kind == "hnsw":
+        return f"M={HNSW_M} efC={HNSW_EF_CONSTRUCTION} efS={HNSW_EF_SEARCH}"
+    if kind == "ivf_flat":
+        return f"nlist={index.nlist} nprobe={index.nprobe}"
+    if kind == "ivf_pq":
+        return f"nlist={index.nlist} nprobe={index.nprobe} m={PQ_SUBQUANTIZERS} nbits={PQ_BITS}"
+    return ""
+
+
+# ---------------------------
+# Measurement
+# ---------------------------
+
+def recall_at_k(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def bench_index(kind, base, queries, truth, ks, train_size=100000):
+    n = len(base)
+    if kind == "ivf_pq" and n < (1 << PQ_BITS) * MIN_POINTS_PER_CENTROID // 4:
+        return {"index": kind, "skipped": f"too few vectors to train PQ ({n})"}
+
+    index = make_index(kind, n, base.shape[1])
+    start = time.perf_counter()
+    if not index.is_trained:
+        sample = base if n <= train_size else base[np.random.default_rng(2).choice(n, train_size, replace=False)]
+        index.train(sample)
+    index.add(base)
+    build_s = time.perf_counter() - start
+
+    k = max(ks)
+    latencies = []
+    found = []
+    for q in queries:
+        t = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - t)
+        found.append(ids[0].tolist())
+    latencies_ms = np.array(latencies) * 1000
+
+    return {
+        "index": kind,
+        "params": describe(kind, index),
+        "build_s": round(build_s, 4),
+        "size_mb": round(faiss.serialize_index(index).nbytes / (1024 * 1024), 2),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 4),
+        **{f"recall@{kk}": round(recall_at_k(found, truth, kk), 4) for kk in ks},
+    }
+
+
+def bench_size(n, args):
+    print(f"Preparing {args.corpus} corpus of {n} vectors...", file=sys.stderr)
+    if args.corpus == "chunks":
+        base, queries = chunk_vectors(n, args.queries)
+    else:
+        base = synthetic_vectors(n, seed=n)
+        queries = synthetic_queries(base, args.queries)
+
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, max(args.k))
+    truth = truth.tolist()
+    del exact
+
+    results = []
+    for kind in args.indexes:
+        print(f"  {kind}...", file=sys.stderr)
+        results.append(bench_index(kind, base, queries, truth, args.k))
+    return {"size": n, "dim": int(base.shape[1]), "queries": len(queries), "results": results}
+
+
+def choose(size_result, min_recall, k):
+    """Fastest p99 among indexes meeting min_recall at k; smaller index breaks ties."""
+    ok = [r for r in size_result["results"] if "skipped" not in r and r[f"recall@{k}"] >= min_recall]
+    if not ok:
+        return None
+    return min(ok, key=lambda r: (r["p99_ms"], r["size_mb"]))["index"]
+
+
+def decision_table(report, min_recall, k):
+    lines = [
+        f"| vectors | index | build s | size MB | p50 ms | p99 ms | recall@{k} | pick |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for size_result in report["sizes"]:
+        pick = size_result["choice"]
+        for r in size_result["results"]:
+            if "skipped" in r:
+                lines.append(f"| {size_result['size']} | {r['index']} | - | - | - | - | - | skipped: {r['skipped']} |")
+                continue
+            lines.append(
+                f"| {size_result['size']} | {r['index']} | {r['build_s']} | {r['size_mb']} | "
+                f"{r['p50_ms']} | {r['p99_ms']} | {r[f'recall@{k}']} | {'✓' if r['index'] == pick else ''} |"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index types for chunk retrieval.")
+    parser.add_argument("--sizes", type=int, nargs="*", default=DEFAULT_SIZES, help="corpus sizes (vectors)")
+    parser.add_argument("--corpus", choices=["synthetic", "chunks"], default="synthetic")
+    parser.add_argument("--indexes", nargs="*", choices=INDEX_TYPES, default=INDEX_TYPES)
+    parser.add_argument("--queries", type=int, default=200, help="queries per corpus")
+    parser.add_argument("--k", type=int, nargs="*", default=DEFAULT_K, help="recall@k cut-offs")
+    parser.add_argument("--min-recall", type=float, default=0.95,
+                        help="recall@max(k) an index needs to be picked (default 0.95)")
+    parser.add_argument("--threads", type=int, default=0, help="FAISS OpenMP threads (0 = library default)")
+    parser.add_argument("--output", help="write results JSON here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    k = max(args.k)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "faiss": getattr(faiss, "__version__", None),
+            "corpus": args.corpus,
+            "embedding_provider": os.getenv("EMBEDDING_PROVIDER") if args.corpus == "chunks" else None,
+            "min_recall": args.min_recall,
+            "k": args.k,
+        },
+        "sizes": [],
+    }
+    for n in args.sizes:
+        size_result = bench_size(n, args)
+        size_result["choice"] = choose(size_result, args.min_recall, k)
+        report["sizes"].append(size_result)
+
+    report["decision_table"] = decision_table(report, args.min_recall, k)
+    output = json.dumps(report, indent=2)
+    print(output)
+    print("\n" + report["decision_table"], file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
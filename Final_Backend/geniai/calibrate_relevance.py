@@ -0,0 +1,175 @@
+"""
+Calibrate RELEVANCE_MIN_SIMILARITY, the relevance gate in query.py.
+
+Embeds on-topic and off-topic questions against one document, records each
+question's best chunk similarity and best BM25 score, and picks the highest
+similarity threshold that still lets --target-recall of the on-topic
+questions through. It then reports how many off-topic questions that
+threshold (together with RELEVANCE_MIN_BM25) keeps away from the LLM.
+
+On-topic questions come from --questions (one per line) or, by default, are
+sentences taken from random chunks of the document. Off-topic questions come
+from --off-topic or a built-in list of general questions.
+
+    python calibrate_relevance.py                              # data/vectorstore from create_db.py
+    python calibrate_relevance.py --user alice_example_com --document <id> --questions faq.txt
+    python calibrate_relevance.py --target-recall 0.99 --output relevance.json
+
+Run it with the embedding provider used in production: fake embeddings carry
+no meaning and give no useful threshold.
+"""
+
+import re
+import sys
+import json
+import random
+import argparse
+
+import numpy as np
+
+from query import (
+    CANDIDATE_DEPTH,
+    RELEVANCE_MIN_BM25,
+    embed_query,
+    hit_similarities,
+    is_relevant,
+    load_index_and_chunks,
+    load_lexical_index,
+    search_with_scores,
+)
+
+OFF_TOPIC_QUESTIONS = [
+    "What's the weather going to be like tomorrow?",
+    "Can you recommend a good recipe for lasagna?",
+    "Who won the football world cup in 2018?",
+    "How do I reset my wifi router?",
+    "What is the capital of Australia?",
+    "Write me a poem about the ocean.",
+    "How many calories are in a banana?",
+    "What are the best places to visit in Japan?",
+    "Explain how photosynthesis works.",
+    "What time is it in New York right now?",
+    "How do I learn to play the guitar?",
+    "Which programming language should I learn first?",
+    "Tell me a joke.",
+    "How far is the moon from the earth?",
+    "What's a good movie to watch tonight?",
+    "How do I fix a flat bicycle tyre?",
+]
+
+
+def load_document(user_id=None, document_id=None):
+    """(index, chunks, lexical) of a stored document, or of the local vector store."""
+    if not user_id:
+        index, chunks = load_index_and_chunks()
+        return index, chunks, load_lexical_index(chunks)
+
+    from artifact import PackedArtifact, artifact_path
+    from storage_backend import get_storage
+
+    packed = PackedArtifact(get_storage(), artifact_path(user_id, document_id))
+    return packed.load_index(), packed.spans(), packed.lexical()
+
+
+def read_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def pseudo_questions(chunks, n, seed=0):
+    """One sentence of 6-30 words from each of up to n random chunks."""
+    rng = random.Random(seed)
+    order = list(range(len(chunks)))
+    rng.shuffle(order)
+    questions = []
+    for i in order:
+        sentences = [s.strip() for s in re.split(r"(?<=[.;:?!])\s+", chunks[i])
+                     if 6 <= len(s.split()) <= 30]
+        if sentences:
+            questions.append(rng.choice(sentences))
+        if len(questions) >= n:
+            break
+    return questions
+
+
+def score(index, lexical, questions):
+    """(best cosine similarity, best BM25 score) per question, scored as retrieve_scored does."""
+    scores = []
+    for question in questions:
+        q_vec = embed_query(question, index.d)
+        similarities = hit_similarities(index, q_vec, search_with_scores(index, q_vec, k=CANDIDATE_DEPTH))
+        lexical_hits = lexical.search(question, 1)
+        scores.append((max(similarities) if similarities else -1.0,
+                       lexical_hits[0][1] if lexical_hits else 0.0))
+    return scores
+
+
+def choose_threshold(on_topic, target_recall):
+    """Highest similarity threshold that keeps target_recall of the on-topic questions."""
+    similarities = np.sort([s for s, _ in on_topic])
+    allowed_misses = int(len(similarities) * (1 - target_recall))
+    return float(similarities[allowed_misses]) if len(similarities) else 0.0
+
+
+def gate_rate(scores, threshold, min_bm25):
+    """Fraction of questions the gate would let through."""
+    if not scores:
+        return 0.0
+    return sum(bool(is_relevant(s, b, threshold, min_bm25)) for s, b in scores) / len(scores)
+
+
+def distribution(values):
+    values = np.array(values)
+    return {p: round(float(np.percentile(values, q)), 4)
+            for p, q in (("min", 0), ("p5", 5), ("p50", 50), ("p95", 95), ("max", 100))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate the relevance gate's similarity threshold.")
+    parser.add_argument("--user", help="storage user id (email with @ and . replaced by _)")
+    parser.add_argument("--document", help="document id, with --user")
+    parser.add_argument("--questions", help="on-topic questions, one per line (default: sentences from chunks)")
+    parser.add_argument("--off-topic", help="off-topic questions, one per line (default: built-in list)")
+    parser.add_argument("--samples", type=int, default=50, help="pseudo-questions taken from chunks")
+    parser.add_argument("--target-recall", type=float, default=0.95,
+                        help="share of on-topic questions the threshold must let through")
+    parser.add_argument("--min-bm25", type=float, default=RELEVANCE_MIN_BM25)
+    parser.add_argument("--output", help="write results JSON here as well as to stdout")
+    args = parser.parse_args(argv)
+    if bool(args.user) != bool(args.document):
+        parser.error("--user and --document go together")
+
+    index, chunks, lexical = load_document(args.user, args.document)
+    on_questions = read_questions(args.questions) if args.questions else pseudo_questions(chunks, args.samples)
+    off_questions = read_questions(args.off_topic) if args.off_topic else OFF_TOPIC_QUESTIONS
+    if not on_questions:
+        raise SystemExit("No on-topic questions")
+
+    on_topic = score(index, lexical, on_questions)
+    off_topic = score(index, lexical, off_questions)
+    threshold = choose_threshold(on_topic, args.target_recall)
+
+    report = {
+        "document": args.document or "local vectorstore",
+        "on_topic_questions": len(on_topic),
+        "off_topic_questions": len(off_topic),
+        "on_topic_similarity": distribution([s for s, _ in on_topic]),
+        "off_topic_similarity": distribution([s for s, _ in off_topic]),
+        "threshold": round(threshold, 4),
+        "min_bm25": args.min_bm25,
+        "on_topic_passed": round(gate_rate(on_topic, threshold, args.min_bm25), 4),
+        "off_topic_blocked": round(1 - gate_rate(off_topic, threshold, args.min_bm25), 4),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    print(f"\nRELEVANCE_MIN_SIMILARITY={report['threshold']}  "
+          f"(on-topic passed {report['on_topic_passed']:.0%}, off-topic blocked {report['off_topic_blocked']:.0%})",
+          file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,27 +3,15 @@ import json
 import time
 from datetime import datetime
 from dotenv import load_dotenv
-import google.generativeai as genai
+from session_registry import get_registry
+from providers import get_llm
+from prompt_builder import record_prompt
 
 load_dotenv()
 
 def load_gemini_model():
-    """Load Gemini API model for chat name generation."""
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing GEMINI_API_KEY/GOOGLE_API_KEY in environment.")
-    genai.configure(api_key=api_key)
-    
-    # Prefer the most available model for quick responses
-    for model_name in ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-1.0-pro"]:
-        try:
-            model = genai.GenerativeModel(model_name)
-            _ = model.generate_content("ping")
-            print(f"Using Gemini API model for chat naming: {model_name}")
-            return model
-        except Exception:
-            continue
-    raise RuntimeError("Failed to initialize any Gemini API model for chat naming.")
+    """LLM for chat name generation (shared process-wide, see providers.py)."""
+    return get_llm()
 
 def generate_chat_name(document_name, document_summary=None, first_query=None):
     """
@@ -80,6 +68,7 @@ Examples of good names for legal agreements:
 
 Generate only the chat name, nothing else:"""
 
+        record_prompt("chat_name", prompt)
         response = model.generate_content(prompt)
         chat_name = getattr(response, 'text', str(response)).strip()
         
@@ -133,6 +122,7 @@ Examples for legal agreements:
 
 Generate only the chat name, nothing else:"""
 
+        record_prompt("chat_name", prompt)
         response = model.generate_content(prompt)
         chat_name = getattr(response, 'text', str(response)).strip()
         
@@ -158,9 +148,9 @@ Generate only the chat name, nothing else:"""
         else:
             return f"Chat {datetime.now().strftime('%m/%d %H:%M')}"
 
-def save_chat_session(chat_id, chat_name, document_name, document_path=None, created_at=None):
+def save_chat_session(chat_id, chat_name, document_name, document_path=None, created_at=None, user_id=None):
     """
-    Save chat session metadata to a JSON file.
+    Save chat session metadata to the session registry.
     """
     if created_at is None:
         created_at = datetime.now().isoformat()
@@ -174,49 +164,21 @@ def save_chat_session(chat_id, chat_name, document_name, document_path=None, cre
         "last_updated": created_at,
         "message_count": 0
     }
+    if user_id is not None:
+        chat_data["user_id"] = user_id
     
-    # Create data directory if it doesn't exist
-    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-    os.makedirs(data_dir, exist_ok=True)
-    
-    # Save to chat sessions file
-    sessions_file = os.path.join(data_dir, "chat_sessions.json")
-    
-    # Load existing sessions
-    sessions = []
-    if os.path.exists(sessions_file):
-        try:
-            with open(sessions_file, "r", encoding="utf-8") as f:
-                sessions = json.load(f)
-        except Exception as e:
-            print(f"Error loading chat sessions: {e}")
-            sessions = []
-    
-    # Add new session
-    sessions.append(chat_data)
-    
-    # Save updated sessions
     try:
-        with open(sessions_file, "w", encoding="utf-8") as f:
-            json.dump(sessions, f, indent=2, ensure_ascii=False)
+        get_registry().put(chat_data)
         print(f"Chat session saved: {chat_name}")
     except Exception as e:
         print(f"Error saving chat session: {e}")
 
-def load_chat_sessions():
+def load_chat_sessions(user_id=None):
     """
-    Load all chat sessions from the JSON file.
+    Load chat sessions from the session registry, newest first.
     """
-    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-    sessions_file = os.path.join(data_dir, "chat_sessions.json")
-    
-    if not os.path.exists(sessions_file):
-        return []
-    
     try:
-        with open(sessions_file, "r", encoding="utf-8") as f:
-            sessions = json.load(f)
-        return sessions
+        return get_registry().list(user_id=user_id)
     except Exception as e:
         print(f"Error loading chat sessions: {e}")
         return []
@@ -225,22 +187,8 @@ def update_chat_session(chat_id, updates):
     """
     Update an existing chat session.
     """
-    sessions = load_chat_sessions()
-    
-    for session in sessions:
-        if session["id"] == chat_id:
-            session.update(updates)
-            session["last_updated"] = datetime.now().isoformat()
-            break
-    
-    # Save updated sessions
-    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-    sessions_file = os.path.join(data_dir, "chat_sessions.json")
-    
     try:
-        with open(sessions_file, "w", encoding="utf-8") as f:
-            json.dump(sessions, f, indent=2, ensure_ascii=False)
-        return True
+        return get_registry().update(chat_id, updates)
     except Exception as e:
         print(f"Error updating chat session: {e}")
         return False
@@ -0,0 +1,108 @@
+"""
+Chunks as (start, end) offsets into one document text.
+
+split_text() overlaps neighbouring chunks by up to 200 characters, so keeping
+every chunk as its own string repeats about a sixth of the document in memory
+and in storage. ChunkSpans keeps the text once, as UTF-8 bytes (a str with a
+single non-ASCII character would take 2-4 bytes per character), plus two
+uint32 byte-offset arrays, and only decodes the chunks that are asked for. It
+reads like a list of strings (len, indexing, slicing, iteration), so
+embedding, BM25 and prompt code take it unchanged. artifact.py stores the same
+bytes and offsets.
+"""
+
+import sys
+from typing import Iterable, List, Sequence
+
+import numpy as np
+
+
+def _overlap(previous: str, chunk: str) -> int:
+    """Length of the longest suffix of `previous` that `chunk` starts with."""
+    if not previous or not chunk:
+        return 0
+    i = previous.find(chunk[0], max(0, len(previous) - len(chunk)))
+    while i != -1:
+        if chunk.startswith(previous[i:]):
+            return len(previous) - i
+        i = previous.find(chunk[0], i + 1)
+    return 0
+
+
+def _map_offsets(sequence, offsets: Sequence[int], length) -> np.ndarray:
+    """Offsets into `sequence` mapped through `length` of each segment between them (chars <-> UTF-8 bytes)."""
+    offsets = np.asarray(offsets, dtype="int64")
+    if sequence.isascii():
+        return offsets.astype("<u4")
+    mapped = {}
+    position = previous = 0
+    for offset in np.unique(offsets).tolist():
+        position += length(sequence[previous:offset])
+        mapped[offset] = position
+        previous = offset
+    return np.array([mapped[o] for o in offsets.tolist()], dtype="<u4")
+
+
+def _byte_offsets(text: str, offsets: Sequence[int]) -> np.ndarray:
+    return _map_offsets(text, offsets, lambda segment: len(segment.encode("utf-8")))
+
+
+def _char_offsets(data: bytes, offsets: Sequence[int]) -> np.ndarray:
+    return _map_offsets(data, offsets, lambda segment: len(segment.decode("utf-8")))
+
+
+class ChunkSpans:
+    def __init__(self, data: bytes, starts: Sequence[int], ends: Sequence[int]):
+        self.data = data
+        self.starts = np.asarray(starts, dtype="<u4")
+        self.ends = np.asarray(ends, dtype="<u4")
+
+    @classmethod
+    def from_text(cls, text: str, starts: Sequence[int], ends: Sequence[int]) -> "ChunkSpans":
+        """From character offsets into `text`."""
+        offsets = _byte_offsets(text, list(starts) + list(ends))
+        return cls(text.encode("utf-8"), offsets[:len(starts)], offsets[len(starts):])
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[str]) -> "ChunkSpans":
+        """Pack separate chunk strings, sharing text where a chunk starts with the end of the previous one."""
+        parts, starts, ends = [], [], []
+        position = 0
+        previous = ""
+        for chunk in chunks:
+            shared = _overlap(previous, chunk)
+            parts.append(chunk[shared:])
+            starts.append(position - shared)
+            position += len(chunk) - shared
+            ends.append(position)
+            previous = chunk
+        return cls.from_text("".join(parts), starts, ends)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("chunk index out of range")
+        return self.data[int(self.starts[item]):int(self.ends[item])].decode("utf-8")
+
+    def __iter__(self):
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            yield self.data[start:end].decode("utf-8")
+
+    def fetch(self, ids: Iterable[int]) -> List[str]:
+        return [self[int(i)] for i in ids]
+
+    def char_spans(self) -> np.ndarray:
+        """(n, 2) character offsets into the decoded text, for JSON storage."""
+        offsets = _char_offsets(self.data, np.concatenate([self.starts, self.ends]))
+        return np.stack([offsets[:len(self)], offsets[len(self):]], axis=1)
+
+    @property
+    def nbytes(self) -> int:
+        """Resident size: the text bytes plus both offset arrays."""
+        return sys.getsizeof(self.data) + self.starts.nbytes + self.ends.nbytes
@@ -0,0 +1,132 @@
+"""
+Post-retrieval selection and packing of context chunks.
+
+Neighbouring chunks overlap by up to 200 characters, so the nearest few are
+often near-duplicates of each other. mmr() picks k of the top candidates by
+maximal marginal relevance -- similar to the query, dissimilar to what is
+already picked -- with NumPy over all candidates at once. merge_chunks()
+then joins picked chunks that overlap or touch in the document into one
+passage, so the shared text is sent once and the prompt covers more of the
+document.
+
+    MMR_CANDIDATES  fused candidates MMR chooses from (default 10)
+    MMR_LAMBDA      1.0 ranks by relevance only, 0.0 by novelty only (default 0.7)
+"""
+
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from chunk_spans import ChunkSpans, _overlap
+
+MMR_CANDIDATES = int(os.getenv("MMR_CANDIDATES", "10"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Adjacent chunks are separated by at most the joining space
+MERGE_GAP_BYTES = 1
+
+
+def candidate_vectors(index, ids: Sequence[int]) -> Optional[np.ndarray]:
+    """Stored vectors of the candidates, unit length; None if the index cannot reconstruct them (IVF)."""
+    try:
+        vectors = np.vstack([index.reconstruct(int(i)) for i in ids]).astype("float32")
+    except RuntimeError:
+        return None
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def mmr(query_vector: np.ndarray, vectors: np.ndarray, k: int, lambda_: float = MMR_LAMBDA,
+        first: Optional[int] = None) -> List[int]:
+    """
+    Positions (into `vectors`) of k picks by maximal marginal relevance, in
+    pick order. `first`, if given, is picked first whatever its score.
+    """
+    n = len(vectors)
+    k = min(k, n)
+    query = np.asarray(query_vector, dtype="float32").reshape(-1)
+    relevance = vectors @ (query / (np.linalg.norm(query) or 1.0))
+    similarity = vectors @ vectors.T
+    redundancy = np.full(n, -np.inf, dtype="float32")
+    picked = []
+    available = np.ones(n, dtype=bool)
+    for _ in range(k):
+        if first is not None and not picked:
+            best = first
+        else:
+            # Redundancy is max similarity to the picks so far; none yet, plain relevance
+            scores = lambda_ * relevance - (1 - lambda_) * (redundancy if picked else 0.0)
+            best = int(np.argmax(np.where(available, scores, -np.inf)))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return picked
+
+
+def diversify(index, query_vector, candidates: Sequence[int], k: int, lambda_: float = MMR_LAMBDA) -> List[int]:
+    """
+    k chunk ids out of ranked `candidates`: the top-ranked one, then the rest
+    by MMR. The first k as ranked if vectors are unavailable.
+    """
+    candidates = list(candidates)
+    if len(candidates) <= k or query_vector is None:
+        return candidates[:k]
+    vectors = candidate_vectors(index, candidates)
+    if vectors is None:
+        return candidates[:k]
+    return [candidates[i] for i in mmr(query_vector, vectors, k, lambda_, first=0)]
+
+
+def _byte_spans(chunks) -> Optional[np.ndarray]:
+    """(n, 2) byte offsets of every chunk in the document text, if the chunks carry them."""
+    if isinstance(chunks, ChunkSpans):
+        return np.stack([chunks.starts, chunks.ends], axis=1)
+    byte_spans = getattr(chunks, "byte_spans", None)
+    return byte_spans() if byte_spans else None
+
+
+def _fetch(chunks, ids: Sequence[int]) -> List[str]:
+    return [chunks[i] for i in ids] if isinstance(chunks, list) else chunks.fetch(ids)
+
+
+def merge_chunks(chunks, ids: Sequence[int]) -> List[str]:
+    """
+    Texts of the chunks `ids`, with chunks that overlap or touch in the
+    document joined into one passage. Passages come in the order of their
+    best-ranked chunk. Chunks without offsets (legacy chunks.json lists) are
+    joined when consecutive and sharing text.
+    """
+    ids = list(dict.fromkeys(int(i) for i in ids))
+    if not ids:
+        return []
+    rank = {i: r for r, i in enumerate(ids)}
+    texts = dict(zip(ids, _fetch(chunks, ids)))
+    spans = _byte_spans(chunks)
+
+    # Groups of chunks in document order: [rank, text, end byte or chunk id]
+    passages = []
+    if spans is not None:
+        for i in sorted(ids, key=lambda i: (int(spans[i][0]), int(spans[i][1]))):
+            start, end = int(spans[i][0]), int(spans[i][1])
+            last = passages[-1] if passages else None
+            if last and start <= last[2] + MERGE_GAP_BYTES:
+                if end > last[2]:
+                    data = texts[i].encode("utf-8")
+                    joiner = " " if start > last[2] else ""
+                    last[1] += joiner + data[max(0, last[2] - start):].decode("utf-8")
+                    last[2] = end
+                last[0] = min(last[0], rank[i])
+            else:
+                passages.append([rank[i], texts[i], end])
+    else:
+        for i in sorted(ids):
+            last = passages[-1] if passages else None
+            shared = _overlap(last[1], texts[i]) if last and last[2] == i - 1 else 0
+            if shared:
+                last[1] += texts[i][shared:]
+                last[0] = min(last[0], rank[i])
+                last[2] = i
+            else:
+                passages.append([rank[i], texts[i], i])
+
+    return [text for _, text, _ in sorted(passages, key=lambda p: p[0])]
@@ -0,0 +1,467 @@
+"""
+Shared store for per-user conversation contexts.
+
+A context holds a user's identity fields, their current chat/document and a
+capped conversation history. Every context expires after CONTEXT_TTL_SECONDS
+without writes. Updates touch one user's record only; history appends keep
+at most CONTEXT_HISTORY_LIMIT entries per user.
+
+Backends (CONTEXT_STORE env):
+    memory  - per-process dicts, for single-worker development
+    sqlite  - shared SQLite file (WAL), default; works across workers on one host
+    redis   - any Redis-protocol server (REDIS_URL); works across hosts
+
+LocalRedis is an in-process stand-in for the subset of Redis commands the
+redis backend uses, so that backend can be exercised without a server.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from session_registry import DATA_DIR
+
+CONTEXT_STORE = os.getenv("CONTEXT_STORE", "sqlite")
+CONTEXT_STORE_PATH = os.getenv("CONTEXT_STORE_PATH", os.path.join(DATA_DIR, "user_contexts.db"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CONTEXT_TTL_SECONDS = int(os.getenv("CONTEXT_TTL_SECONDS", str(7 * 24 * 3600)))
+CONTEXT_HISTORY_LIMIT = int(os.getenv("CONTEXT_HISTORY_LIMIT", "50"))
+
+# Context fields other than the history
+CONTEXT_FIELDS = (
+    "user_id", "username", "email", "current_chat_id", "current_document_id", "created_at",
+)
+
+
+class MemoryContextStore:
+    """Per-process store. Contexts are not shared between workers."""
+
+    def __init__(self, ttl: int = CONTEXT_TTL_SECONDS, history_limit: int = CONTEXT_HISTORY_LIMIT):
+        self.ttl = ttl
+        self.history_limit = history_limit
+        self._lock = threading.Lock()
+        self._contexts: Dict[str, Dict[str, Any]] = {}
+        self._history: Dict[str, deque] = {}
+        self._expires: Dict[str, float] = {}
+
+    def _expired(self, user_id: str) -> bool:
+        if self._expires.get(user_id, 0) > time.time():
+            return False
+        self._contexts.pop(user_id, None)
+        self._history.pop(user_id, None)
+        self._expires.pop(user_id, None)
+        return True
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if self._expired(user_id):
+                return None
+            return dict(self._contexts[user_id])
+
+    def put(self, user_id: str, fields: Dict[str, Any]):
+        """Create or replace a context (a live context's history is kept)."""
+        with self._lock:
+            self._expired(user_id)
+            self._contexts[user_id] = {k: fields.get(k) for k in CONTEXT_FIELDS}
+            self._contexts[user_id]["user_id"] = user_id
+            self._expires[user_id] = time.time() + self.ttl
+
+    def update(self, user_id: str, **fields) -> bool:
+        with self._lock:
+            if self._expired(user_id):
+                return False
+            self._contexts[user_id].update({k: v for k, v in fields.items() if k in CONTEXT_FIELDS})
+            self._expires[user_id] = time.time() + self.ttl
+            return True
+
+    def append_history(self, user_id: str, entry: Dict[str, Any]) -> bool:
+        with self._lock:
+            if self._expired(user_id):
+                return False
+            self._history.setdefault(user_id, deque(maxlen=self.history_limit)).append(entry)
+            self._expires[user_id] = time.time() + self.ttl
+            return True
+
+    def history(self, user_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            if self._expired(user_id):
+                return []
+            return list(self._history.get(user_id, ()))
+
+    def delete(self, user_id: str):
+        with self._lock:
+            self._contexts.pop(user_id, None)
+            self._history.pop(user_id, None)
+            self._expires.pop(user_id, None)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_contexts (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS user_contexts_expires ON user_contexts (expires_at);
+CREATE TABLE IF NOT EXISTS user_context_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS user_context_history_user ON user_context_history (user_id, id);
+"""
+
+
+class SQLiteContextStore:
+    """Store shared by every worker process that opens the same file."""
+
+    def __init__(self, path: str = CONTEXT_STORE_PATH, ttl: int = CONTEXT_TTL_SECONDS,
+                 history_limit: int = CONTEXT_HISTORY_LIMIT):
+        self.path = path
+        self.ttl = ttl
+        self.history_limit = history_limit
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().executescript(_SQLITE_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _delete(self, conn: sqlite3.Connection, user_id: str):
+        conn.execute("DELETE FROM user_contexts WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM user_context_history WHERE user_id = ?", (user_id,))
+
+    def _touch(self, conn: sqlite3.Connection, user_id: str) -> bool:
+        """Extend a live context's TTL. Returns False (and drops it) if it has expired."""
+        now = time.time()
+        cursor = conn.execute(
+            "UPDATE user_contexts SET expires_at = ? WHERE user_id = ? AND expires_at > ?",
+            (now + self.ttl, user_id, now),
+        )
+        if cursor.rowcount == 0:
+            self._delete(conn, user_id)
+            return False
+        return True
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT data FROM user_contexts WHERE user_id = ? AND expires_at > ?", (user_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, user_id: str, fields: Dict[str, Any]):
+        data = {k: fields.get(k) for k in CONTEXT_FIELDS}
+        data["user_id"] = user_id
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            # History only outlives its context while the context is live
+            conn.execute(
+                "DELETE FROM user_context_history WHERE user_id = ? AND NOT EXISTS ("
+                " SELECT 1 FROM user_contexts WHERE user_id = ? AND expires_at > ?)",
+                (user_id, user_id, now),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO user_contexts (user_id, data, expires_at) VALUES (?, ?, ?)",
+                (user_id, json.dumps(data), now + self.ttl),
+            )
+            # Opportunistic cleanup of other users' expired contexts and their history
+            conn.execute(
+                "DELETE FROM user_context_history WHERE user_id IN ("
+                " SELECT user_id FROM user_contexts WHERE expires_at <= ?)",
+                (now,),
+            )
+            conn.execute("DELETE FROM user_contexts WHERE expires_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def update(self, user_id: str, **fields) -> bool:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM user_contexts WHERE user_id = ? AND expires_at > ?", (user_id, time.time())
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return False
+            data = json.loads(row[0])
+            data.update({k: v for k, v in fields.items() if k in CONTEXT_FIELDS})
+            conn.execute(
+                "UPDATE user_contexts SET data = ?, expires_at = ? WHERE user_id = ?",
+                (json.dumps(data), time.time() + self.ttl, user_id),
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def append_history(self, user_id: str, entry: Dict[str, Any]) -> bool:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not self._touch(conn, user_id):
+                conn.execute("COMMIT")
+                return False
+            conn.execute(
+                "INSERT INTO user_context_history (user_id, entry) VALUES (?, ?)",
+                (user_id, json.dumps(entry, ensure_ascii=False)),
+            )
+            # Drop whatever fell off the end of the window (walks the (user_id, id) index)
+            conn.execute(
+                "DELETE FROM user_context_history WHERE user_id = ? AND id <= ("
+                " SELECT id FROM user_context_history WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (user_id, user_id, self.history_limit),
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def history(self, user_id: str) -> List[Dict[str, Any]]:
+        if self.get(user_id) is None:
+            return []
+        rows = self._connect().execute(
+            "SELECT entry FROM user_context_history WHERE user_id = ? ORDER BY id", (user_id,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete(self, user_id: str):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._delete(conn, user_id)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class RedisContextStore:
+    """
+    Store on a Redis-protocol server. Each context is a hash at ctx:{user_id}
+    and its history a list at ctx:{user_id}:history; both carry the TTL.
+    """
+
+    def __init__(self, client, ttl: int = CONTEXT_TTL_SECONDS, history_limit: int = CONTEXT_HISTORY_LIMIT,
+                 prefix: str = "ctx:"):
+        self.client = client
+        self.ttl = ttl
+        self.history_limit = history_limit
+        self.prefix = prefix
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.prefix}{user_id}"
+
+    @staticmethod
+    def _text(value):
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.hgetall(self._key(user_id))
+        if not raw:
+            return None
+        return {self._text(k): json.loads(self._text(v)) for k, v in raw.items()}
+
+    def put(self, user_id: str, fields: Dict[str, Any]):
+        data = {k: fields.get(k) for k in CONTEXT_FIELDS}
+        data["user_id"] = user_id
+        key = self._key(user_id)
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={k: json.dumps(v) for k, v in data.items()})
+        pipe.expire(key, self.ttl)
+        pipe.expire(key + ":history", self.ttl)
+        pipe.execute()
+
+    def update(self, user_id: str, **fields) -> bool:
+        key = self._key(user_id)
+        fields = {k: json.dumps(v) for k, v in fields.items() if k in CONTEXT_FIELDS}
+        if not self.client.exists(key):
+            return False
+        pipe = self.client.pipeline()
+        if fields:
+            pipe.hset(key, mapping=fields)
+        pipe.expire(key, self.ttl)
+        pipe.expire(key + ":history", self.ttl)
+        pipe.execute()
+        return True
+
+    def append_history(self, user_id: str, entry: Dict[str, Any]) -> bool:
+        key = self._key(user_id)
+        if not self.client.exists(key):
+            return False
+        history_key = key + ":history"
+        pipe = self.client.pipeline()
+        pipe.rpush(history_key, json.dumps(entry, ensure_ascii=False))
+        pipe.ltrim(history_key, -self.history_limit, -1)
+        pipe.expire(history_key, self.ttl)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+        return True
+
+    def history(self, user_id: str) -> List[Dict[str, Any]]:
+        return [json.loads(self._text(v)) for v in self.client.lrange(self._key(user_id) + ":history", 0, -1)]
+
+    def delete(self, user_id: str):
+        key = self._key(user_id)
+        self.client.delete(key, key + ":history")
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the Redis commands RedisContextStore uses
+    (hash, list, expire, delete, exists, pipeline). Values are returned as
+    bytes, like redis-py without decode_responses.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+
+    def _live(self, key: str):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    @staticmethod
+    def _bytes(value) -> bytes:
+        return value if isinstance(value, bytes) else str(value).encode("utf-8")
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            h = self._live(key)
+            if h is None:
+                h = self._data[key] = {}
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            added = 0
+            for k, v in items.items():
+                added += self._bytes(k) not in h
+                h[self._bytes(k)] = self._bytes(v)
+            return added
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._live(key) or {})
+
+    def rpush(self, key, *values):
+        with self._lock:
+            lst = self._live(key)
+            if lst is None:
+                lst = self._data[key] = []
+            lst.extend(self._bytes(v) for v in values)
+            return len(lst)
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            lst = self._live(key)
+            if lst is not None:
+                n = len(lst)
+                start = max(0, start + n if start < 0 else start)
+                end = end + n if end < 0 else end
+                self._data[key] = lst[start:end + 1]
+            return True
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            lst = self._live(key) or []
+            n = len(lst)
+            start = max(0, start + n if start < 0 else start)
+            end = end + n if end < 0 else end
+            return list(lst[start:end + 1])
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if self._live(key) is None:
+                return False
+            self._expires[key] = time.time() + seconds
+            return True
+
+    def exists(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._live(key) is not None)
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                removed += self._live(key) is not None
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+            return removed
+
+    def pipeline(self):
+        return _LocalPipeline(self)
+
+
+class _LocalPipeline:
+    """Queues commands and runs them under the LocalRedis lock on execute()."""
+
+    def __init__(self, server: LocalRedis):
+        self._server = server
+        self._commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._server._lock:
+            results = [getattr(self._server, name)(*args, **kwargs) for name, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_context_store(kind: str = CONTEXT_STORE):
+    """Build a context store of the given kind ("memory", "sqlite", "redis" or "local-redis")."""
+    if kind == "memory":
+        return MemoryContextStore()
+    if kind == "sqlite":
+        return SQLiteContextStore()
+    if kind == "redis":
+        if redis is None:
+            raise RuntimeError("CONTEXT_STORE=redis requires the redis package")
+        return RedisContextStore(redis.Redis.from_url(REDIS_URL))
+    if kind == "local-redis":
+        return RedisContextStore(LocalRedis())
+    raise ValueError(f"Unknown context store: {kind}")
+
+
+def get_context_store():
+    """Return the process-wide context store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_context_store()
+    return _store
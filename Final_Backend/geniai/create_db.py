@@ -5,31 +5,34 @@ import numpy as np
 import faiss
 from dotenv import load_dotenv
 from pypdf import PdfReader
-import vertexai
-from vertexai.language_models import TextEmbeddingModel
-from google.api_core.exceptions import ResourceExhausted, GoogleAPIError
+from providers import GoogleAPIError, ResourceExhausted, get_embedding_model
 import re
 from agreement_analyzer import AgreementAnalyzer
 from chat_naming import generate_chat_name, save_chat_session
-from google.cloud import storage
 from google.cloud import secretmanager   # ✅ Added Secret Manager
 import tempfile
+from storage_backend import get_storage, resolve_uri
+from vector_index import build_index
+from artifact import artifact_path, write_artifact
+from chunk_spans import ChunkSpans
+from embedding_store import embeddings_path, save_embeddings
+from prompt_builder import document_excerpt
 
 load_dotenv()
 
 # GCP Project and Bucket
 PROJECT_ID = os.getenv("GCP_PROJECT") or os.getenv("GOOGLE_CLOUD_PROJECT") or "gen-ai-legal"
 LOCATION = os.getenv("GCP_LOCATION", "us-central1")
-GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "legal-agreement-analyzer")  # ✅ unified name
+# Bucket name and backend come from storage_backend (GCS_BUCKET_NAME / STORAGE_BACKEND)
 
-# Init VertexAI and GCS
-vertexai.init(project=PROJECT_ID, location=LOCATION)
-storage_client = storage.Client()
-secret_client = secretmanager.SecretManagerServiceClient()  # ✅ Secret Manager client
+secret_client = None  # ✅ Secret Manager client, created on first use so imports work offline
 
 def get_secret(secret_id, version="latest"):
     """Fetch secret from GCP Secret Manager."""
+    global secret_client
     try:
+        if secret_client is None:
+            secret_client = secretmanager.SecretManagerServiceClient()
         name = f"projects/{PROJECT_ID}/secrets/{secret_id}/versions/{version}"
         response = secret_client.access_secret_version(request={"name": name})
         return response.payload.data.decode("UTF-8")
@@ -38,52 +41,31 @@ def get_secret(secret_id, version="latest"):
         return None
 
 # -------------------------
-# GCS Storage Functions
+# Storage Functions (GCS, local or in-memory, see storage_backend.py)
 # -------------------------
 def read_pdf_text(pdf_path_or_gsuri):
-    if pdf_path_or_gsuri.startswith("gs://"):
-        _, _, bucket_name, *blob_parts = pdf_path_or_gsuri.split("/", 3) + [""]
-        blob_path = blob_parts[0] if blob_parts else ""
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_path)
+    if "://" in pdf_path_or_gsuri:
+        backend, name = resolve_uri(pdf_path_or_gsuri)
         with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
-            blob.download_to_filename(tmp.name)
+            tmp.write(backend.get(name))
+            tmp.flush()
             return load_pdf(tmp.name)
     else:
         return load_pdf(pdf_path_or_gsuri)
 
-def save_index_and_chunks_to_gcs(index, chunks, user_id, document_id):
-    """Save FAISS index and chunks to GCS."""
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
-
-    index_path = f"users/{user_id}/vectorstore/{document_id}/index.faiss"
-    index_blob = bucket.blob(index_path)
-
-    import os as _os
-    fd, temp_path = tempfile.mkstemp(suffix=".faiss")
-    _os.close(fd)
-    try:
-        faiss.write_index(index, temp_path)
-        with open(temp_path, "rb") as f:
-            index_blob.upload_from_file(f)
-    finally:
-        try:
-            _os.remove(temp_path)
-        except Exception:
-            pass
-
-    chunks_path = f"users/{user_id}/vectorstore/{document_id}/chunks.json"
-    chunks_blob = bucket.blob(chunks_path)
-    chunks_blob.upload_from_string(json.dumps(chunks, ensure_ascii=False))
-
-    return index_path, chunks_path
+def save_index_and_chunks_to_gcs(index, chunks, user_id, document_id, summary=None, embeddings=None):
+    """Save FAISS index, chunks, BM25 and summary to storage as one packed artifact,
+    plus the raw embeddings for re-indexing."""
+    storage = get_storage()
+    path = write_artifact(storage, artifact_path(user_id, document_id), index, chunks, summary)
+    if embeddings is not None:
+        save_embeddings(storage, embeddings_path(user_id, document_id), embeddings)
+    return path, path
 
 def save_summary_to_gcs(summary_data, user_id, document_id):
-    """Save summary to GCS."""
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
+    """Save summary to storage."""
     summary_path = f"users/{user_id}/summaries/{document_id}_summary.json"
-    summary_blob = bucket.blob(summary_path)
-    summary_blob.upload_from_string(json.dumps(summary_data, ensure_ascii=False))
+    get_storage().put(summary_path, json.dumps(summary_data, ensure_ascii=False), content_type="application/json")
     return summary_path
 
 
@@ -103,12 +85,8 @@ def load_pdf(file_path):
     return text
 
 
-def split_text(text, chunk_size=1200, overlap=200):
-    """
-    Semantic-aware chunking for legal agreements.
-    Splits primarily on section headers, numbered clauses, sub-clauses, and legal connectors.
-    Falls back to size-based chunking if needed.
-    """
+def split_pieces(text):
+    """Clause-level pieces of an agreement, split on section headers, numbered clauses and legal connectors."""
     # Define keywords/phrases to detect legal chunk boundaries
     keywords = [
         "Section", "Article", "ARTICLE", "Clause", "Sub-clause", "Definitions",
@@ -146,27 +124,61 @@ def split_text(text, chunk_size=1200, overlap=200):
             if sub.strip():
                 refined_chunks.append(sub.strip())
 
-    # Merge small chunks and enforce size limits with overlap
-    final_chunks = []
-    current = ""
-    for chunk in refined_chunks:
-        if len(current) + len(chunk) < chunk_size:
-            current += " " + chunk
+    return refined_chunks
+
+
+def split_spans(text, chunk_size=1200, overlap=200):
+    """
+    Semantic-aware chunking for legal agreements.
+    Splits primarily on section headers, numbered clauses, sub-clauses, and legal connectors,
+    then merges pieces up to chunk_size with `overlap` characters carried over.
+
+    Returns ChunkSpans over the pieces joined by single spaces: every chunk,
+    overlap included, is one contiguous span of that text, so it is stored once.
+    """
+    pieces = split_pieces(text)
+    buffer = " ".join(pieces)
+    starts, ends = [], []
+
+    def close(start, end):
+        # Like str.strip(): pieces end stripped, overlap can start on whitespace
+        while start < end and buffer[start].isspace():
+            start += 1
+        starts.append(start)
+        ends.append(end)
+
+    # Current chunk as (leading space, start, end): " " * lead + buffer[start:end]; None while empty
+    current = None
+    position = 0
+    for piece in pieces:
+        piece_start, piece_end = position, position + len(piece)
+        position = piece_end + 1
+        current_len = current[0] + current[2] - current[1] if current else 0
+        if current_len + len(piece) < chunk_size:
+            current = (current[0], current[1], piece_end) if current else (1, piece_start, piece_end)
+            continue
+        close(*(current[1:] if current else (piece_start, piece_start)))
+        if overlap > 0 and ends[-1] > starts[-1]:
+            # The previous chunk's tail, the joining space, then this piece
+            current = (0, max(starts[-1], ends[-1] - overlap), piece_end)
+        elif overlap > 0:
+            current = (1, piece_start, piece_end)
         else:
-            final_chunks.append(current.strip())
-            if overlap > 0 and final_chunks:
-                overlap_text = final_chunks[-1][-overlap:]
-                current = overlap_text + " " + chunk
-            else:
-                current = chunk
-    if current.strip():
-        final_chunks.append(current.strip())
+            current = (0, piece_start, piece_end)
+    if current:
+        close(current[1], current[2])
+
+    return ChunkSpans.from_text(buffer, starts, ends)
 
-    return final_chunks
+
+def split_text(text, chunk_size=1200, overlap=200):
+    """split_spans() as a list of strings."""
+    return list(split_spans(text, chunk_size, overlap))
 
 
 def load_embedding_model():
-    return TextEmbeddingModel.from_pretrained("text-embedding-004")
+    # Vertex text-embedding-004 by default, or the fake provider when EMBEDDING_PROVIDER=fake
+    return get_embedding_model()
 
 
 def get_embeddings(chunks, batch_size=32, max_retries=3):
@@ -190,10 +202,8 @@ def get_embeddings(chunks, batch_size=32, max_retries=3):
 
 
 def build_faiss_index(embeddings):
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
-    return index
+    # Flat, HNSW or IVF-PQ depending on size and VECTOR_INDEX_TARGET (see vector_index.py)
+    return build_index(embeddings)
 
 
 # Legacy function removed - use GCS functions instead
@@ -221,7 +231,7 @@ if __name__ == "__main__":
     print(f"Loaded PDF with {len(text)} characters")
 
     print("\nSplitting into chunks...")
-    chunks = split_text(text, chunk_size=1200, overlap=200)
+    chunks = split_spans(text, chunk_size=1200, overlap=200)
     print(f"Created {len(chunks)} chunks")
 
     print("Generating embeddings (this may take a moment)...")
@@ -239,8 +249,8 @@ if __name__ == "__main__":
     
     try:
         analyzer = AgreementAnalyzer()
-        # Use the first few processed chunks for better context
-        summary_text = " ".join(chunks[:5])  # Use first 5 chunks for summary
+        # Start of the document, up to SUMMARY_TOKEN_BUDGET
+        summary_text = document_excerpt(chunks)
         summary_result = analyzer.generate_summary(summary_text)
         
         print(f"\nAgreement Type: {summary_result['agreement_type']}")
@@ -250,7 +260,7 @@ if __name__ == "__main__":
         print(summary_result['summary'])
         print("-" * 50)
         
-        # Summary is saved to GCS via save_summary_to_gcs function
+        # Summary is saved to GCS inside the document's packed artifact
         print(f"\nSummary saved to GCS for user: {user_id}")
         
         # Generate and save chat session
@@ -263,8 +273,9 @@ if __name__ == "__main__":
             document_id = str(int(time.time() * 1000) + 1)  # Generate document ID
             
             # Save to GCS
-            index_path, chunks_path = save_index_and_chunks_to_gcs(index, chunks, user_id, document_id)
-            save_summary_to_gcs(summary_result, user_id, document_id)
+            index_path, chunks_path = save_index_and_chunks_to_gcs(
+                index, chunks, user_id, document_id, summary_result, embeddings
+            )
             
             save_chat_session(
                 chat_id=chat_id,
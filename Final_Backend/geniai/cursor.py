@@ -0,0 +1,44 @@
+"""
+Opaque keyset-pagination cursors.
+
+A cursor encodes the (sort key, id) of the last row on a page, e.g.
+(last_updated, id) for chat sessions or (created_at, id) for messages.
+The next page is "rows strictly after this pair" in the listing order, so
+every page is a single index range scan no matter how deep it is.
+Shared by the Django views and the FastAPI service.
+"""
+
+import json
+import base64
+from typing import Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(position, item_id) -> str:
+    """Encode a (sort key, id) pair. Datetimes are stored as ISO strings."""
+    if hasattr(position, "isoformat"):
+        position = position.isoformat()
+    raw = json.dumps([position, str(item_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Decode a cursor into (sort key, id). Raises ValueError on malformed input."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position, item_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, str) or not isinstance(item_id, str):
+        raise ValueError("Invalid cursor")
+    return position, item_id
+
+
+def page_size(value: Optional[str], default: int = DEFAULT_PAGE_SIZE) -> int:
+    """Parse a ?limit= value, clamped to 1..MAX_PAGE_SIZE. Raises ValueError if not an integer."""
+    if value in (None, ""):
+        return default
+    return max(1, min(int(value), MAX_PAGE_SIZE))
@@ -1,15 +1,127 @@
 import os
-from typing import Optional
+import time
+import threading
+from typing import Dict, List, Optional
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from geniai.models import Document, ChatSession, ChatMessage, DocumentSummary
 from users.models import User
 
+# Resolved users are cached by email and by id so building a DjangoSync or
+# authenticating a request doesn't cost a users-table query every time.
+# Entries are dropped when the user is saved or deleted in this process
+# (see GeniaiConfig.ready); other processes pick up changes within the TTL.
+USER_CACHE_TTL = float(os.getenv("DJANGO_SYNC_USER_CACHE_TTL", "300"))
+_user_cache: Dict[tuple, tuple] = {}
+_user_cache_lock = threading.Lock()
+
+
+def _cached_user(key: tuple, lookup) -> User:
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+    user = User.objects.get(**lookup)
+    with _user_cache_lock:
+        expires = now + USER_CACHE_TTL
+        _user_cache[("email", user.email)] = (user, expires)
+        _user_cache[("id", str(user.id))] = (user, expires)
+    return user
+
+
+def get_cached_user(email: str) -> User:
+    """Return the User for `email`, from cache when fresh. Raises User.DoesNotExist."""
+    return _cached_user(("email", email), {"email": email})
+
+
+def get_cached_user_by_id(user_id) -> User:
+    """Return the User with primary key `user_id`, from cache when fresh. Raises User.DoesNotExist."""
+    return _cached_user(("id", str(user_id)), {"id": user_id})
+
+
+def invalidate_cached_user(email: Optional[str] = None, user_id=None):
+    """Drop the cached entries of one user (by email or id), or all of them."""
+    with _user_cache_lock:
+        if email is None and user_id is None:
+            _user_cache.clear()
+            return
+        for key, (user, _) in list(_user_cache.items()):
+            if user.email == email or (user_id is not None and str(user.id) == str(user_id)):
+                del _user_cache[key]
+
+
+def invalidate_user_on_change(sender, instance, **kwargs):
+    """post_save/post_delete receiver for the user model."""
+    invalidate_cached_user(email=instance.email, user_id=instance.pk)
+
+
+def bump_message_count(chat_session_id, delta: int = 1) -> int:
+    """Atomically add `delta` to a session's message_count, touching only message_count/last_updated."""
+    return ChatSession.objects.filter(id=chat_session_id).update(
+        message_count=F('message_count') + delta,
+        last_updated=timezone.now()
+    )
+
+
+def create_chat_messages(chat_session_id: str, messages: List[Dict]) -> bool:
+    """
+    Insert several messages into one chat session in a single transaction.
+    
+    Message ids, when given, are idempotency keys: ids already stored are
+    skipped. message_count is bumped once with an F() expression. Messages
+    belong to the session's owner.
+    """
+    try:
+        with transaction.atomic():
+            ids = [m["id"] for m in messages if m.get("id")]
+            existing = set()
+            if ids:
+                existing = {str(i) for i in ChatMessage.objects.filter(id__in=ids).values_list('id', flat=True)}
+            new_messages = [m for m in messages if not m.get("id") or str(m["id"]) not in existing]
+            if not new_messages:
+                print(f"Chat messages for session {chat_session_id} already exist")
+                return True
+            
+            try:
+                session = ChatSession.objects.only("user_id").get(id=chat_session_id)
+            except ChatSession.DoesNotExist:
+                print(f"Chat session {chat_session_id} not found")
+                return False
+            bump_message_count(chat_session_id, len(new_messages))
+            
+            rows = []
+            for m in new_messages:
+                row = ChatMessage(
+                    chat_session_id=chat_session_id,
+                    user_id=session.user_id,
+                    message_type=m["message_type"],
+                    content=m["content"]
+                )
+                if m.get("id"):
+                    row.id = m["id"]
+                rows.append(row)
+            ChatMessage.objects.bulk_create(rows)
+        
+        print(f"Created {len(rows)} chat messages for session: {chat_session_id}")
+        return True
+    except Exception as e:
+        print(f"Failed to create chat messages in Django: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 class DjangoSync:
-    def __init__(self, base_url: str = None, auth_header: str = None, user_email: str = None):
-        self.user = None
+    def __init__(self, base_url: str = None, auth_header: str = None, user_email: str = None, user: User = None):
+        self.user = user
+        if user is not None:
+            return
         if user_email:
             try:
-                # Get existing user from database
-                self.user = User.objects.get(email=user_email)
+                # Get existing user from database (cached)
+                self.user = get_cached_user(user_email)
             except User.DoesNotExist:
                 print(f"User {user_email} not found in database")
                 # Don't create user here - they should be created through proper auth
@@ -73,29 +185,13 @@ class DjangoSync:
             traceback.print_exc()
             return False
     
-    def create_chat_message(self, chat_session_id: str, message_type: str, content: str) -> bool:
-        try:
-            session = ChatSession.objects.get(id=chat_session_id)
-            message = ChatMessage(
-                chat_session=session,
-                user=session.user,
-                message_type=message_type,
-                content=content
-            )
-            message.save()
-            
-            # Update message count
-            session.message_count = ChatMessage.objects.filter(chat_session=session).count()
-            session.save()
-            print(f"Updated message count to {session.message_count} for session {chat_session_id}")
-            
-            print(f"Created chat message for session: {chat_session_id}")
-            return True
-        except Exception as e:
-            print(f"Failed to create chat message in Django: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
+    def create_chat_message(self, chat_session_id: str, message_type: str, content: str, message_id: str = None) -> bool:
+        return self.create_chat_messages(chat_session_id, [
+            {"id": message_id, "message_type": message_type, "content": content}
+        ])
+    
+    def create_chat_messages(self, chat_session_id: str, messages: List[Dict]) -> bool:
+        return create_chat_messages(chat_session_id, messages)
     
     def create_summary(self, document_id: str, summary_data: dict) -> bool:
         try:
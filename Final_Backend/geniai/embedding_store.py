@@ -0,0 +1,78 @@
+"""
+Raw chunk embeddings stored next to each document's index.
+
+    users/{user_id}/vectorstore/{document_id}/embeddings.npy    (n, dim) matrix
+    users/{user_id}/vectorstore/{document_id}/embeddings.json   model, dim, count, dtype
+
+With the matrix kept, any index type can be rebuilt locally (see reindex.py)
+and the per-user search shards can be filled without calling Vertex again.
+EMBEDDING_STORE_DTYPE=float16 halves the bytes; vectors are always handed back
+as float32. On the local backend the .npy file is memory-mapped instead of
+read.
+"""
+
+import io
+import os
+import json
+import posixpath
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from providers import embedding_model_name
+from storage_backend import ObjectNotFound
+
+FILENAME = "embeddings.npy"
+META_FILENAME = "embeddings.json"
+STORE_DTYPE = os.getenv("EMBEDDING_STORE_DTYPE", "float32")
+DTYPES = ("float32", "float16")
+
+
+def embeddings_path(user_id: str, document_id: str) -> str:
+    return f"users/{user_id}/vectorstore/{document_id}/{FILENAME}"
+
+
+def embeddings_meta_path(path: str) -> str:
+    return posixpath.join(posixpath.dirname(path), META_FILENAME)
+
+
+def save_embeddings(storage, path: str, embeddings: np.ndarray, model: Optional[str] = None,
+                    dtype: Optional[str] = None) -> Dict:
+    """Write the matrix as .npy plus its metadata; returns the metadata."""
+    dtype = dtype or STORE_DTYPE
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown EMBEDDING_STORE_DTYPE: {dtype}")
+    matrix = np.ascontiguousarray(embeddings, dtype=dtype)
+    if matrix.ndim != 2:
+        raise ValueError("embeddings must be a 2-d matrix")
+    buffer = io.BytesIO()
+    np.save(buffer, matrix, allow_pickle=False)
+    storage.put(path, buffer.getvalue(), content_type="application/octet-stream")
+
+    meta = {
+        "model": model or embedding_model_name(),
+        "dim": int(matrix.shape[1]),
+        "count": int(matrix.shape[0]),
+        "dtype": dtype,
+    }
+    storage.put(embeddings_meta_path(path), json.dumps(meta), content_type="application/json")
+    return meta
+
+
+def load_embeddings_meta(storage, path: str) -> Optional[Dict]:
+    try:
+        return json.loads(storage.get_text(embeddings_meta_path(path)))
+    except ObjectNotFound:
+        return None
+
+
+def load_embeddings(storage, path: str, mmap: bool = True) -> Tuple[np.ndarray, Optional[Dict]]:
+    """(float32 matrix, metadata). Raises ObjectNotFound for documents stored without embeddings."""
+    local = storage.local_path(path) if mmap else None
+    if local and os.path.exists(local):
+        matrix = np.load(local, mmap_mode="r", allow_pickle=False)
+    else:
+        matrix = np.load(io.BytesIO(storage.get(path)), allow_pickle=False)
+    if matrix.dtype != np.float32:
+        matrix = matrix.astype("float32")
+    return matrix, load_embeddings_meta(storage, path)
@@ -1,112 +1,336 @@
 import os
 import json
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from google.cloud import storage
 from typing import List, Dict, Optional
+from storage_backend import GenerationMismatch, ObjectNotFound, StorageBackend, get_storage
+
+# Chat transcripts: users/{user}/chat_transcripts/{chat_id}/manifest.json holds the
+# latest messages inline plus a list of sealed NDJSON segments. Segments are
+# merged size-tiered: a new segment is merged into the one before it while it is
+# at least as large, so a chat keeps O(log n) segments and each message is
+# rewritten O(log n) times. Segments merged away are listed in the manifest's
+# "retired" and deleted at the next compaction, not at once, so a reader still
+# holding the previous manifest can fetch them.
+SEGMENT_MAX_MESSAGES = int(os.getenv("GCS_SEGMENT_MAX_MESSAGES", "256"))
+SEGMENT_MAX_BYTES = int(os.getenv("GCS_SEGMENT_MAX_BYTES", str(256 * 1024)))
+RECENT_IDS_KEPT = 512
+MANIFEST_WRITE_RETRIES = 5
+# Bounded pool for fallback reads of many small objects
+FETCH_WORKERS = int(os.getenv("GCS_FETCH_WORKERS", "16"))
 
 class GCSChatStorage:
-    def __init__(self):
-        self.bucket_name = os.getenv("GCS_BUCKET_NAME", "legal-agreement-analyzer-gen-ai-legal")
-        self.client = storage.Client()
-        self.bucket = self.client.bucket(self.bucket_name)
+    """Chat sessions and transcripts on the configured storage backend (GCS by default)."""
+    
+    def __init__(self, storage: Optional[StorageBackend] = None):
+        self.storage = storage or get_storage()
+        self.bucket_name = self.storage.bucket_name
     
     def _get_user_id(self, user_email: str) -> str:
         """Convert email to GCS-safe user ID"""
         return user_email.replace('@', '_').replace('.', '_')
     
+    def _session_index_path(self, user_id: str) -> str:
+        # Kept outside chat_sessions/ so prefix listings only see session objects
+        return f"users/{user_id}/chat_sessions_index.json"
+    
+    def _read_session_index(self, user_id: str):
+        """Return (index, generation); (None, 0) if the user has no index yet."""
+        try:
+            data, generation = self.storage.get_with_generation(self._session_index_path(user_id))
+        except ObjectNotFound:
+            return None, 0
+        return json.loads(data), generation
+    
+    def _scan_sessions(self, user_id: str) -> Dict[str, Dict]:
+        """Session objects under chat_sessions/ by id, fetched concurrently (for users without an index)."""
+        prefix = f"users/{user_id}/chat_sessions/"
+        names = [name for name in self.storage.list(prefix) if name.endswith('.json')]
+        return {str(s['id']): s for s in self._download_json_many(names) if s is not None and 'id' in s}
+    
+    def _update_session_index(self, user_id: str, mutate, seed: Optional[Dict[str, Dict]] = None) -> bool:
+        """
+        Read-modify-write the per-user session index under a generation
+        precondition. A missing index is first seeded from the session objects
+        (or `seed`), so sessions written before the index existed are kept.
+        """
+        for attempt in range(MANIFEST_WRITE_RETRIES):
+            index, generation = self._read_session_index(user_id)
+            if index is None:
+                if seed is None:
+                    seed = self._scan_sessions(user_id)
+                index = {"sessions": dict(seed)}
+            mutate(index["sessions"])
+            index["last_updated"] = datetime.now().isoformat()
+            try:
+                self.storage.put(
+                    self._session_index_path(user_id),
+                    json.dumps(index, ensure_ascii=False),
+                    content_type='application/json',
+                    if_generation_match=generation
+                )
+                return True
+            except GenerationMismatch:
+                print(f"Session index for {user_id} changed concurrently, retrying ({attempt + 1})")
+        return False
+    
+    def put_session(self, user_id: str, session_data: Dict) -> str:
+        """Write a session object and record it in the user's session index; raises if the index write fails."""
+        blob_path = f"users/{user_id}/chat_sessions/{session_data['id']}.json"
+        self.storage.put(
+            blob_path,
+            json.dumps(session_data, indent=2, ensure_ascii=False),
+            content_type='application/json'
+        )
+        if not self._update_session_index(user_id, lambda sessions: sessions.__setitem__(str(session_data['id']), session_data)):
+            raise RuntimeError(f"Session index for {user_id} kept changing; session {session_data['id']} not indexed")
+        return blob_path
+    
+    def patch_session(self, user_id: str, session_id: str, updates: Dict) -> bool:
+        """Apply a partial update to a session object and its index entry."""
+        blob_path = f"users/{user_id}/chat_sessions/{session_id}.json"
+        session_data = json.loads(self.storage.get(blob_path))
+        session_data.update(updates)
+        session_data["last_updated"] = datetime.now().isoformat()
+        self.storage.put(blob_path, json.dumps(session_data, indent=2, ensure_ascii=False), content_type='application/json')
+        return self._update_session_index(user_id, lambda sessions: sessions.__setitem__(str(session_id), session_data))
+    
+    def list_sessions(self, user_id: str) -> List[Dict]:
+        """
+        Sessions for a user, newest first. One GET of the session index; if the
+        index is missing, the session objects are fetched concurrently and the
+        index is rebuilt from them.
+        """
+        index, _ = self._read_session_index(user_id)
+        if index is not None:
+            sessions = list(index["sessions"].values())
+        else:
+            by_id = self._scan_sessions(user_id)
+            sessions = list(by_id.values())
+            if sessions:
+                self._update_session_index(user_id, lambda existing: None, seed=by_id)
+        sessions.sort(key=lambda x: x.get('last_updated', ''), reverse=True)
+        return sessions
+    
+    def _download_json_many(self, names: List[str]) -> List[Optional[Dict]]:
+        """Download JSON objects concurrently with a bounded pool; failed reads become None."""
+        def fetch(name):
+            try:
+                return json.loads(self.storage.get(name))
+            except Exception as e:
+                print(f"Error loading {name}: {e}")
+                return None
+        if len(names) <= 1:
+            return [fetch(name) for name in names]
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(names))) as pool:
+            return list(pool.map(fetch, names))
+    
     def save_chat_session(self, user_email: str, session_data: Dict) -> bool:
         """Save chat session to GCS"""
         try:
             user_id = self._get_user_id(user_email)
-            session_id = session_data['id']
-            
-            # Path: users/{user}/chat_sessions/{session_id}.json
-            blob_path = f"users/{user_id}/chat_sessions/{session_id}.json"
-            blob = self.bucket.blob(blob_path)
             
             # Add metadata
             session_data['last_updated'] = datetime.now().isoformat()
             session_data['user_email'] = user_email
             
-            blob.upload_from_string(
-                json.dumps(session_data, indent=2, ensure_ascii=False),
-                content_type='application/json'
-            )
+            # Path: users/{user}/chat_sessions/{session_id}.json
+            blob_path = self.put_session(user_id, session_data)
             
-            print(f"Chat session saved to GCS: gs://{self.bucket_name}/{blob_path}")
+            print(f"Chat session saved to GCS: {self.storage.uri(blob_path)}")
             return True
             
         except Exception as e:
             print(f"Failed to save chat session to GCS: {e}")
             return False
     
-    def save_chat_message(self, user_email: str, session_id: str, message_data: Dict) -> bool:
-        """Save individual message to GCS"""
+    def _transcript_prefix(self, user_id: str, session_id: str) -> str:
+        return f"users/{user_id}/chat_transcripts/{session_id}/"
+    
+    def _read_manifest(self, user_id: str, session_id: str):
+        """Return (manifest, generation); (None, 0) if the chat has no transcript yet."""
         try:
-            user_id = self._get_user_id(user_email)
-            message_id = message_data.get('id', datetime.now().isoformat())
-            
-            # Path: users/{user}/chat_messages/{session_id}/{message_id}.json
-            blob_path = f"users/{user_id}/chat_messages/{session_id}/{message_id}.json"
-            blob = self.bucket.blob(blob_path)
-            
-            # Add metadata
-            message_data['session_id'] = session_id
-            message_data['user_email'] = user_email
-            message_data['created_at'] = message_data.get('created_at', datetime.now().isoformat())
-            
-            blob.upload_from_string(
-                json.dumps(message_data, indent=2, ensure_ascii=False),
-                content_type='application/json'
-            )
-            
-            print(f"Message saved to GCS: gs://{self.bucket_name}/{blob_path}")
-            return True
-            
-        except Exception as e:
-            print(f"Failed to save message to GCS: {e}")
-            return False
+            data, generation = self.storage.get_with_generation(self._transcript_prefix(user_id, session_id) + "manifest.json")
+        except ObjectNotFound:
+            return None, 0
+        return json.loads(data), generation
+    
+    def _read_segment(self, name: str) -> List[Dict]:
+        data = self.storage.get_text(name)
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+    
+    def _write_segment(self, user_id: str, session_id: str, messages: List[Dict]) -> Dict:
+        """Write an immutable NDJSON segment and return its manifest entry."""
+        name = f"{self._transcript_prefix(user_id, session_id)}segments/{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.ndjson"
+        body = "\n".join(json.dumps(m, ensure_ascii=False) for m in messages) + "\n"
+        self.storage.put(name, body, content_type="application/x-ndjson")
+        return {"name": name, "count": len(messages), "bytes": len(body.encode("utf-8"))}
+    
+    def append_chat_messages(self, user_email: str, session_id: str, messages: List[Dict]) -> bool:
+        """
+        Append a batch of messages to a chat transcript.
+        
+        New messages go into the manifest's inline tail. When the tail grows past
+        SEGMENT_MAX_MESSAGES/SEGMENT_MAX_BYTES it is sealed into an NDJSON segment,
+        which is merged with the segments before it only while they are no larger
+        (see _seal_tail). The manifest is written with a generation precondition,
+        so concurrent writers retry instead of overwriting each other; segments
+        written by a losing attempt are deleted.
+        """
+        user_id = self._get_user_id(user_email)
+        batch = []
+        for message in messages:
+            message = dict(message)
+            message['id'] = str(message.get('id') or uuid.uuid4())
+            message['session_id'] = session_id
+            message['user_email'] = user_email
+            message['created_at'] = message.get('created_at', datetime.now().isoformat())
+            batch.append(message)
+        
+        for attempt in range(MANIFEST_WRITE_RETRIES):
+            written = []
+            try:
+                manifest, generation = self._read_manifest(user_id, session_id)
+                if manifest is None:
+                    manifest = {"chat_id": session_id, "segments": [], "tail": [], "recent_ids": [], "message_count": 0}
+                
+                # recent_ids makes redelivered batches (outbox retries) a no-op
+                seen = set(manifest["recent_ids"])
+                new_messages = [m for m in batch if m['id'] not in seen]
+                if not new_messages:
+                    return True
+                manifest["tail"].extend(new_messages)
+                manifest["message_count"] += len(new_messages)
+                manifest["recent_ids"] = (manifest["recent_ids"] + [m['id'] for m in new_messages])[-RECENT_IDS_KEPT:]
+                
+                superseded = []
+                tail_bytes = sum(len(json.dumps(m, ensure_ascii=False)) for m in manifest["tail"])
+                if len(manifest["tail"]) >= SEGMENT_MAX_MESSAGES or tail_bytes >= SEGMENT_MAX_BYTES:
+                    written, obsolete = self._seal_tail(user_id, session_id, manifest)
+                    # Retired by the previous compaction: no current manifest references them
+                    superseded = manifest.get("retired", [])
+                    manifest["retired"] = obsolete
+                manifest["last_updated"] = datetime.now().isoformat()
+                
+                self.storage.put(
+                    self._transcript_prefix(user_id, session_id) + "manifest.json",
+                    json.dumps(manifest, ensure_ascii=False),
+                    content_type='application/json',
+                    if_generation_match=generation
+                )
+                self._delete_objects(superseded)
+                print(f"Appended {len(new_messages)} messages to transcript {self.storage.uri(self._transcript_prefix(user_id, session_id))}")
+                return True
+            except GenerationMismatch:
+                # The manifest we built on is stale: its new segments are unreferenced
+                self._delete_objects(written)
+                print(f"Transcript manifest for {session_id} changed concurrently, retrying ({attempt + 1})")
+                continue
+            except Exception as e:
+                self._delete_objects(written)
+                print(f"Failed to append messages to GCS: {e}")
+                return False
+        return False
+    
+    def _seal_tail(self, user_id: str, session_id: str, manifest: Dict):
+        """
+        Move the manifest's tail into a segment, merged with the preceding
+        segments while they hold no more messages than it (size-tiered), so
+        only small recent segments are rewritten. Returns (written, obsolete)
+        object names; the manifest is updated in place.
+        """
+        segments = manifest["segments"]
+        messages = manifest["tail"]
+        obsolete = []
+        while segments and segments[-1]["count"] <= len(messages):
+            segment = segments.pop()
+            messages = self._read_segment(segment["name"]) + messages
+            obsolete.append(segment["name"])
+        sealed = self._write_segment(user_id, session_id, messages)
+        segments.append(sealed)
+        manifest["tail"] = []
+        return [sealed["name"]], obsolete
+    
+    def _delete_objects(self, names: List[str]):
+        for name in names:
+            try:
+                self.storage.delete(name)
+            except ObjectNotFound:
+                pass
+    
+    def save_chat_message(self, user_email: str, session_id: str, message_data: Dict) -> bool:
+        """Save a single message to the chat transcript in GCS"""
+        return self.append_chat_messages(user_email, session_id, [message_data])
     
     def load_chat_sessions(self, user_email: str) -> List[Dict]:
         """Load all chat sessions for a user from GCS"""
         try:
-            user_id = self._get_user_id(user_email)
-            prefix = f"users/{user_id}/chat_sessions/"
-            
-            sessions = []
-            blobs = self.client.list_blobs(self.bucket, prefix=prefix)
-            
-            for blob in blobs:
-                if blob.name.endswith('.json'):
-                    session_data = json.loads(blob.download_as_text())
-                    sessions.append(session_data)
-            
-            # Sort by last_updated
-            sessions.sort(key=lambda x: x.get('last_updated', ''), reverse=True)
-            return sessions
-            
+            return self.list_sessions(self._get_user_id(user_email))
         except Exception as e:
             print(f"Failed to load chat sessions from GCS: {e}")
             return []
     
     def load_chat_messages(self, user_email: str, session_id: str) -> List[Dict]:
-        """Load all messages for a session from GCS"""
+        """Load all messages for a session from GCS: the manifest plus its few segments"""
         try:
             user_id = self._get_user_id(user_email)
-            prefix = f"users/{user_id}/chat_messages/{session_id}/"
+            manifest, _ = self._read_manifest(user_id, session_id)
+            if manifest is None:
+                return self._load_legacy_chat_messages(user_email, session_id)
             
             messages = []
-            blobs = self.client.list_blobs(self.bucket, prefix=prefix)
-            
-            for blob in blobs:
-                if blob.name.endswith('.json'):
-                    message_data = json.loads(blob.download_as_text())
-                    messages.append(message_data)
-            
-            # Sort by created_at
-            messages.sort(key=lambda x: x.get('created_at', ''))
-            return messages
+            try:
+                segments = self._read_segments(manifest)
+            except ObjectNotFound:
+                # Two compactions since our manifest read; the current manifest lists live segments
+                manifest, _ = self._read_manifest(user_id, session_id)
+                segments = self._read_segments(manifest)
+            for segment_messages in segments:
+                messages.extend(segment_messages)
+            messages.extend(manifest["tail"])
+            # A retried outbox delivery can append after a newer turn; sorted is stable for equal times
+            return sorted(messages, key=lambda m: m.get("created_at") or "")
             
         except Exception as e:
             print(f"Failed to load chat messages from GCS: {e}")
-            return []
\ No newline at end of file
+            return []
+    
+    def _read_segments(self, manifest: Dict) -> List[List[Dict]]:
+        names = [seg["name"] for seg in manifest["segments"]]
+        if len(names) > 1:
+            with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(names))) as pool:
+                return list(pool.map(self._read_segment, names))
+        return [self._read_segment(name) for name in names]
+    
+    def _load_legacy_chat_messages(self, user_email: str, session_id: str) -> List[Dict]:
+        """
+        Load a chat stored the old way (one object per message) and migrate it
+        into a transcript so later loads take a single read.
+        """
+        user_id = self._get_user_id(user_email)
+        prefix = f"users/{user_id}/chat_messages/{session_id}/"
+        
+        names = [name for name in self.storage.list(prefix) if name.endswith('.json')]
+        messages = [m for m in self._download_json_many(names) if m is not None]
+        
+        # Sort by created_at
+        messages.sort(key=lambda x: x.get('created_at', ''))
+        if messages:
+            self.append_chat_messages(user_email, session_id, messages)
+        return messages
+
+
+_shared_storage = None
+_shared_storage_lock = threading.Lock()
+
+
+def get_chat_storage() -> GCSChatStorage:
+    """Process-wide GCSChatStorage, so callers reuse one client and connection pool."""
+    global _shared_storage
+    if _shared_storage is None:
+        with _shared_storage_lock:
+            if _shared_storage is None:
+                _shared_storage = GCSChatStorage()
+    return _shared_storage
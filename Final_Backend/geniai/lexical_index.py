@@ -0,0 +1,138 @@
+"""
+BM25 inverted index over a document's chunks.
+
+Built at ingest and stored as bm25.json next to chunks.json, so exact terms
+that dense embeddings blur ("indemnify", "Section 14.2", "Rs. 50,000") can
+still be matched, and so retrieval keeps working when the embedding API is
+slow or down. Results are combined with the FAISS ranking by reciprocal rank
+fusion (rrf()).
+
+Stored format (JSON, compact):
+
+    {"v": 1, "k1": 1.5, "b": 0.75, "lengths": [chunk token counts],
+     "postings": {term: [chunk delta, tf, chunk delta, tf, ...]}}
+"""
+
+import re
+import json
+import math
+import posixpath
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from storage_backend import ObjectNotFound
+
+FILENAME = "bm25.json"
+K1 = 1.5
+B = 0.75
+RRF_K = 60
+
+# Numbers keep their dots ("14.2") and drop thousands separators ("50,000" -> "50000")
+_TOKEN_RE = re.compile(r"\d+(?:[.,]\d+)*|[a-z]+")
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have if in into is it its of on or shall such that the
+their then there these this to was were will with which who whom any all been being
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token[0].isdigit():
+            token = token.replace(",", "").rstrip(".")
+        elif token in STOPWORDS:
+            continue
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, postings: Dict[str, List[Tuple[int, int]]], lengths: List[int],
+                 k1: float = K1, b: float = B):
+        self.postings = postings
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        self.avgdl = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+    @classmethod
+    def build(cls, chunks: Iterable[str], k1: float = K1, b: float = B) -> "BM25Index":
+        postings = defaultdict(list)
+        lengths = []
+        for i, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings[term].append((i, tf))
+        return cls(dict(postings), lengths, k1, b)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def _idf(self, df: int) -> float:
+        n = len(self.lengths)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """(chunk index, score) pairs, best first; only chunks sharing a term score."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(len(postings))
+            for i, tf in postings:
+                norm = 1 - self.b + self.b * self.lengths[i] / (self.avgdl or 1)
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    def to_json(self) -> str:
+        packed = {}
+        for term, postings in self.postings.items():
+            flat, last = [], 0
+            for i, tf in postings:
+                flat.extend((i - last, tf))
+                last = i
+            packed[term] = flat
+        return json.dumps({"v": 1, "k1": self.k1, "b": self.b, "lengths": self.lengths, "postings": packed},
+                          separators=(",", ":"), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> "BM25Index":
+        raw = json.loads(data)
+        postings = {}
+        for term, flat in raw["postings"].items():
+            entries, current = [], 0
+            for j in range(0, len(flat), 2):
+                current += flat[j]
+                entries.append((current, flat[j + 1]))
+            postings[term] = entries
+        return cls(postings, raw["lengths"], raw.get("k1", K1), raw.get("b", B))
+
+
+def rrf(rankings: Sequence[Sequence[int]], k: int = RRF_K) -> List[int]:
+    """Reciprocal rank fusion: ids ordered by the sum of 1 / (k + rank) over all rankings."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda item: (-scores[item], item))
+
+
+def lexical_path(chunks_path: str) -> str:
+    """Object name of the BM25 index stored next to a chunks.json object."""
+    return posixpath.join(posixpath.dirname(chunks_path), FILENAME)
+
+
+def save_lexical(storage, chunks_path: str, chunks: List[str]) -> BM25Index:
+    index = BM25Index.build(chunks)
+    storage.put(lexical_path(chunks_path), index.to_json(), content_type="application/json")
+    return index
+
+
+def load_lexical(storage, chunks_path: str, chunks: Optional[List[str]] = None) -> Optional[BM25Index]:
+    """The stored BM25 index, else one built from `chunks` (documents ingested before BM25)."""
+    try:
+        return BM25Index.from_json(storage.get_text(lexical_path(chunks_path)))
+    except ObjectNotFound:
+        return BM25Index.build(chunks) if chunks is not None else None
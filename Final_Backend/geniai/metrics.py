@@ -0,0 +1,59 @@
+"""
+Process-local metrics for the FastAPI service.
+
+Counters, gauges and simple timing summaries kept in memory and exposed
+through GET /api/metrics. Names are dotted strings, e.g. "outbox.delivered.gcs".
+"""
+
+import threading
+from collections import defaultdict
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, float] = {}
+_timings: Dict[str, Dict[str, float]] = {}
+
+
+def increment(name: str, value: float = 1):
+    """Add `value` to a counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name: str, value: float):
+    """Set a gauge to its current value."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, seconds: float):
+    """Record one duration in a count/sum/max summary."""
+    with _lock:
+        summary = _timings.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0, "last": 0.0})
+        summary["count"] += 1
+        summary["sum"] += seconds
+        summary["max"] = max(summary["max"], seconds)
+        summary["last"] = seconds
+
+
+def snapshot() -> Dict:
+    """Return a copy of all metrics."""
+    with _lock:
+        timings = {}
+        for name, summary in _timings.items():
+            timings[name] = dict(summary)
+            timings[name]["avg"] = summary["sum"] / summary["count"] if summary["count"] else 0.0
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": timings,
+        }
+
+
+def reset():
+    """Clear all metrics."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
@@ -0,0 +1,367 @@
+"""
+Write-behind outbox for chat persistence.
+
+Request handlers append one record to a local SQLite outbox and return.
+A background flusher claims batches of records, hands them to each sink
+(local registry, Django/Postgres, GCS) and retries failed sinks with
+exponential backoff. Every message carries a stable id that the sinks
+use as an idempotency key, so a record that is delivered twice (after a
+crash or a lost lease) does not produce duplicates.
+
+Several worker processes can share one outbox file: records are claimed
+with a short lease before delivery.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import defaultdict, OrderedDict
+from typing import Dict, List, Optional
+
+import metrics
+from session_registry import REGISTRY_PATH, get_registry
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", REGISTRY_PATH)
+FLUSH_INTERVAL = float(os.getenv("OUTBOX_FLUSH_INTERVAL", "0.25"))
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "12"))
+MAX_BACKOFF = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    pending_sinks TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_ready
+    ON outbox (status, next_attempt_at, created_at);
+"""
+
+
+class Outbox:
+    """Durable queue of persistence records backed by SQLite."""
+
+    def __init__(self, path: str = OUTBOX_PATH):
+        self.path = path
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, kind: str, payload: Dict, sinks: List[str], record_id: Optional[str] = None) -> str:
+        """Append one record. `record_id` doubles as the idempotency key for the whole record."""
+        record_id = record_id or str(uuid.uuid4())
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR IGNORE INTO outbox (id, kind, payload, pending_sinks, created_at, next_attempt_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (record_id, kind, json.dumps(payload, ensure_ascii=False), json.dumps(sinks), now, now),
+        )
+        metrics.increment("outbox.enqueued")
+        return record_id
+
+    def claim(self, limit: int = BATCH_SIZE) -> List[Dict]:
+        """Lease up to `limit` ready records for this owner, oldest first."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE outbox SET lease_owner = ?, lease_until = ? WHERE id IN ("
+                " SELECT id FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? AND lease_until < ?"
+                " ORDER BY created_at LIMIT ?)",
+                (self.owner, now + LEASE_SECONDS, now, now, limit),
+            )
+            rows = conn.execute(
+                "SELECT * FROM outbox WHERE lease_owner = ? AND lease_until > ? AND status = 'pending' "
+                "ORDER BY created_at",
+                (self.owner, now),
+            ).fetchall()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [
+            {
+                "id": row["id"],
+                "kind": row["kind"],
+                "payload": json.loads(row["payload"]),
+                "pending_sinks": json.loads(row["pending_sinks"]),
+                "attempts": row["attempts"],
+                "created_at": row["created_at"],
+            }
+            for row in rows
+        ]
+
+    def complete(self, record: Dict, delivered: List[str], errors: Dict[str, str]):
+        """
+        Record the outcome of one delivery round for a claimed record. Nothing
+        is written if this owner's lease has lapsed and another worker holds
+        the record; that worker records its own outcome.
+        """
+        remaining = [s for s in record["pending_sinks"] if s not in delivered]
+        conn = self._connect()
+        if not remaining:
+            cursor = conn.execute("DELETE FROM outbox WHERE id = ? AND lease_owner = ?",
+                                  (record["id"], self.owner))
+            if cursor.rowcount:
+                metrics.observe("outbox.delivery_lag", time.time() - record["created_at"])
+            else:
+                self._lease_lost(record)
+            return
+        attempts = record["attempts"] + 1
+        status = "dead" if attempts >= MAX_ATTEMPTS else "pending"
+        backoff = min(MAX_BACKOFF, 2 ** attempts)
+        cursor = conn.execute(
+            "UPDATE outbox SET pending_sinks = ?, attempts = ?, status = ?, next_attempt_at = ?, "
+            "lease_owner = NULL, lease_until = 0, last_error = ? WHERE id = ? AND lease_owner = ?",
+            (
+                json.dumps(remaining), attempts, status, time.time() + backoff,
+                json.dumps(errors)[:2000], record["id"], self.owner,
+            ),
+        )
+        if not cursor.rowcount:
+            self._lease_lost(record)
+            return
+        if status == "dead":
+            metrics.increment("outbox.dead")
+            print(f"Outbox record {record['id']} gave up after {attempts} attempts: {errors}")
+
+    def pending_messages(self, chat_id: str, sink: str = "local") -> List[Dict]:
+        """Messages for a chat in records that `sink` has not taken yet, oldest first."""
+        rows = self._connect().execute(
+            "SELECT payload, pending_sinks FROM outbox WHERE kind = 'chat_messages' AND status = 'pending' "
+            "AND json_extract(payload, '$.chat_id') = ? ORDER BY created_at",
+            (chat_id,),
+        ).fetchall()
+        return [
+            message
+            for row in rows if sink in json.loads(row["pending_sinks"])
+            for message in json.loads(row["payload"])["messages"]
+        ]
+
+    def _lease_lost(self, record: Dict):
+        metrics.increment("outbox.lease_lost")
+        print(f"Outbox record {record['id']} was re-claimed by another worker; leaving its outcome to that worker")
+
+    def stats(self) -> Dict:
+        """Pending/dead counts and the age of the oldest pending record."""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT COUNT(*) AS pending, MIN(created_at) AS oldest FROM outbox WHERE status = 'pending'"
+        ).fetchone()
+        dead = conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'dead'").fetchone()[0]
+        return {
+            "pending": row["pending"],
+            "dead": dead,
+            "oldest_pending_age": time.time() - row["oldest"] if row["oldest"] else 0.0,
+        }
+
+
+# ---------------------------
+# Sinks
+# ---------------------------
+# A sink takes a list of claimed records and returns the ids it delivered.
+# Sinks raising an exception count as a failure for every record passed in.
+
+def _message_records(records: List[Dict]):
+    """Group chat_messages payloads by (user_email, chat_id), keeping record order."""
+    groups = OrderedDict()
+    for record in records:
+        if record["kind"] != "chat_messages":
+            continue
+        payload = record["payload"]
+        key = (payload.get("user_email"), payload["chat_id"])
+        groups.setdefault(key, []).append(record)
+    return groups
+
+
+class LocalSink:
+    """Appends messages to the local session registry."""
+
+    name = "local"
+
+    def deliver(self, records: List[Dict]) -> List[str]:
+        registry = get_registry()
+        delivered = []
+        for (_, chat_id), group in _message_records(records).items():
+            messages = [m for record in group for m in record["payload"]["messages"]]
+            registry.append_messages(chat_id, messages)
+            delivered.extend(record["id"] for record in group)
+        return delivered
+
+
+class DjangoSink:
+    """Inserts messages into Django/Postgres, one transaction per chat per batch."""
+
+    name = "django"
+
+    def deliver(self, records: List[Dict]) -> List[str]:
+        from django.db import close_old_connections
+        from geniai.django_sync import create_chat_messages
+
+        close_old_connections()
+        delivered = []
+        for (_, chat_id), group in _message_records(records).items():
+            try:
+                # Rows take their user from the chat session, not the record's email
+                messages = [m for record in group for m in record["payload"]["messages"]]
+                if create_chat_messages(chat_id, messages):
+                    delivered.extend(record["id"] for record in group)
+            except Exception as e:
+                print(f"Outbox Django delivery failed for chat {chat_id}: {e}")
+        close_old_connections()
+        return delivered
+
+
+class GCSSink:
+    """Writes messages to the user's chat transcript in GCS."""
+
+    name = "gcs"
+
+    def __init__(self):
+        self._storage = None
+
+    def deliver(self, records: List[Dict]) -> List[str]:
+        if self._storage is None:
+            from geniai.gcs_chat_storage import get_chat_storage
+            self._storage = get_chat_storage()
+        delivered = []
+        for (user_email, chat_id), group in _message_records(records).items():
+            # One transcript append per chat per batch
+            messages = [m for record in group for m in record["payload"]["messages"]]
+            if self._storage.append_chat_messages(user_email, chat_id, messages):
+                delivered.extend(record["id"] for record in group)
+        return delivered
+
+
+class OutboxFlusher:
+    """Background thread that drains the outbox into its sinks."""
+
+    def __init__(self, outbox: Outbox, sinks: List, interval: float = FLUSH_INTERVAL):
+        self.outbox = outbox
+        self.sinks = {sink.name: sink for sink in sinks}
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush_once()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                delivered = self.flush_once()
+            except Exception as e:
+                print(f"Outbox flush failed: {e}")
+                delivered = 0
+            if not delivered:
+                self._stop.wait(self.interval)
+
+    def flush_once(self) -> int:
+        """Deliver one batch. Returns the number of records claimed."""
+        records = self.outbox.claim()
+        if records:
+            started = time.time()
+            delivered = defaultdict(list)
+            errors = defaultdict(dict)
+            for name, sink in self.sinks.items():
+                batch = [r for r in records if name in r["pending_sinks"]]
+                if not batch:
+                    continue
+                try:
+                    ok_ids = set(sink.deliver(batch))
+                except Exception as e:
+                    ok_ids = set()
+                    print(f"Outbox sink {name} failed: {e}")
+                for record in batch:
+                    if record["id"] in ok_ids:
+                        delivered[record["id"]].append(name)
+                    else:
+                        errors[record["id"]][name] = "delivery failed"
+                metrics.increment(f"outbox.delivered.{name}", len(ok_ids))
+                metrics.increment(f"outbox.failed.{name}", len(batch) - len(ok_ids))
+            for record in records:
+                # Records naming a sink this flusher doesn't know stay pending for another worker
+                unknown = [s for s in record["pending_sinks"] if s not in self.sinks]
+                for name in unknown:
+                    errors[record["id"]][name] = "no such sink"
+                self.outbox.complete(record, delivered[record["id"]], errors[record["id"]])
+            metrics.observe("outbox.flush", time.time() - started)
+        stats = self.outbox.stats()
+        metrics.set_gauge("outbox.pending", stats["pending"])
+        metrics.set_gauge("outbox.dead", stats["dead"])
+        metrics.set_gauge("outbox.lag_seconds", stats["oldest_pending_age"])
+        return len(records)
+
+
+_outbox = None
+_flusher = None
+_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox:
+    """Return the process-wide outbox."""
+    global _outbox
+    if _outbox is None:
+        with _lock:
+            if _outbox is None:
+                _outbox = Outbox()
+    return _outbox
+
+
+def start_flusher() -> OutboxFlusher:
+    """Start the background flusher with the default sinks."""
+    global _flusher
+    with _lock:
+        if _flusher is None:
+            _flusher = OutboxFlusher(get_outbox(), [LocalSink(), DjangoSink(), GCSSink()])
+    _flusher.start()
+    return _flusher
+
+
+def stop_flusher():
+    if _flusher is not None:
+        _flusher.stop()
+
+
+def record_chat_messages(chat_id: str, messages: List[Dict], user_email: Optional[str] = None) -> str:
+    """
+    Queue chat messages for persistence. Messages go to the local registry
+    always, and to Django and GCS when the user is known.
+    """
+    sinks = ["local"] + (["django", "gcs"] if user_email else [])
+    payload = {"chat_id": chat_id, "user_email": user_email, "messages": messages}
+    return get_outbox().enqueue("chat_messages", payload, sinks)
@@ -0,0 +1,172 @@
+"""
+Token-budgeted prompts for answers and summaries.
+
+Tokens are estimated locally (about PROMPT_CHARS_PER_TOKEN characters each,
+Gemini's rule of thumb for English) so no counting call is made. An answer
+prompt always keeps its instructions and the question; retrieved passages
+and conversation history share what is left of the model's budget:
+
+    history   newest lines first, up to PROMPT_HISTORY_SHARE of the room
+    context   passages in rank order; the passage that no longer fits is cut
+              at a word boundary (or dropped below MIN_PASSAGE_TOKENS) and
+              every lower-ranked one is dropped
+
+Summaries get the start of the document up to SUMMARY_TOKEN_BUDGET tokens.
+Every prompt's size is logged and observed as prompt.tokens.<purpose>.
+
+    PROMPT_TOKEN_BUDGET   one budget for every model (overrides the table)
+    PROMPT_TOKEN_BUDGETS  per-model overrides, e.g. "gemini-1.5-pro=16000,gemini-1.5-flash=6000"
+"""
+
+import os
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import metrics
+from context_packing import merge_chunks
+
+CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "4"))
+DEFAULT_TOKEN_BUDGET = 8000
+HISTORY_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", "0.25"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "1500"))
+# A cut passage shorter than this is dropped instead
+MIN_PASSAGE_TOKENS = 50
+
+
+def _parse_budgets(value: str) -> Dict[str, int]:
+    budgets = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, tokens = item.partition("=")
+        budgets[name.strip()] = int(tokens)
+    return budgets
+
+
+MODEL_TOKEN_BUDGETS = {
+    "gemini-1.5-flash": 8000,
+    "gemini-1.5-pro": 16000,
+    "gemini-1.0-pro": 6000,
+    **_parse_budgets(os.getenv("PROMPT_TOKEN_BUDGETS", "")),
+}
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "0")) or None
+
+ANSWER_TEMPLATE = """You are a professional legal assistant who explains complex legal documents in simple, easy-to-understand language for people without legal backgrounds.
+
+CONTEXT FROM DOCUMENT:
+{context}
+{history}
+USER QUESTION: {question}
+
+INSTRUCTIONS:
+- **Use simple language** - Explain legal terms in plain English that anyone can understand
+- **Break down complexity** - Take complex legal concepts and make them clear and accessible
+- **Provide practical understanding** - Help users grasp what the legal language actually means for them
+- **Maintain professionalism** - Be helpful and informative while staying professional
+{history_instruction}- **Give detailed answers when needed** - If the question requires steps, procedures, or comprehensive explanation, provide them
+
+RESPONSE STYLE:
+- Start with a clear, direct answer to the question
+- **If the question requires detailed steps or procedures, provide them clearly**
+- **Use bullet points and numbered lists when they make complex information easier to understand**
+- Break down complex legal concepts into simple, understandable parts
+- Use examples and practical explanations when helpful
+- Avoid legal jargon and complex terminology
+- Be informative and helpful without being overly casual
+- **Adapt response length to the complexity of the question**
+
+Remember: Your goal is to make legal documents understandable for non-legal professionals. Use clear, simple language while maintaining professional credibility. If a question needs detailed steps or comprehensive explanation, provide it."""
+
+HISTORY_INSTRUCTION = "- **Reference context** - Use previous conversation context when relevant\n"
+
+
+def estimate_tokens(text: str) -> int:
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """`text` cut to about `tokens` tokens, at a word boundary where there is one."""
+    limit = int(tokens * CHARS_PER_TOKEN)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    space = cut.rfind(" ")
+    return cut[:space] if space > limit // 2 else cut
+
+
+def model_budget(model=None) -> int:
+    """Prompt budget for an LLM object (or model name); DEFAULT_TOKEN_BUDGET for unknown models."""
+    if PROMPT_TOKEN_BUDGET:
+        return PROMPT_TOKEN_BUDGET
+    name = model if isinstance(model, str) else getattr(model, "model_name", "") or ""
+    return MODEL_TOKEN_BUDGETS.get(name.split("/")[-1], DEFAULT_TOKEN_BUDGET)
+
+
+def record_prompt(purpose: str, prompt: str, budget: Optional[int] = None) -> int:
+    """Log and observe a prompt's estimated size; returns it."""
+    tokens = estimate_tokens(prompt)
+    print(f"Prompt [{purpose}]: ~{tokens} tokens" + (f" of {budget}" if budget else ""))
+    metrics.observe(f"prompt.tokens.{purpose}", tokens)
+    return tokens
+
+
+def fit_passages(passages: Sequence[str], tokens: int) -> Tuple[List[str], int]:
+    """Passages, best first, that fit in `tokens`; and how many were cut or dropped."""
+    kept = []
+    for passage in passages:
+        cost = estimate_tokens(passage) + 1
+        if cost <= tokens:
+            kept.append(passage)
+            tokens -= cost
+            continue
+        # The best passage is always sent, cut if need be
+        if tokens >= MIN_PASSAGE_TOKENS or not kept:
+            kept.append(truncate_to_tokens(passage, max(tokens - 1, 0)))
+            return kept, len(passages) - len(kept) + 1
+        break
+    return kept, len(passages) - len(kept)
+
+
+def fit_history(lines: Sequence[str], tokens: int) -> List[str]:
+    """The newest history lines that fit in `tokens`, oldest first."""
+    kept = []
+    for line in reversed(lines):
+        cost = estimate_tokens(line) + 1
+        if cost > tokens:
+            break
+        kept.append(line)
+        tokens -= cost
+    return kept[::-1]
+
+
+def build_answer_prompt(question: str, passages: Sequence[str], history: Optional[Sequence[str]] = None,
+                        budget: Optional[int] = None, model=None) -> str:
+    """Answer prompt with as much context and history as fit in the model's budget."""
+    budget = budget or model_budget(model)
+    history_instruction = HISTORY_INSTRUCTION if history else ""
+    fixed = ANSWER_TEMPLATE.format(context="", history="", question=question,
+                                   history_instruction=history_instruction)
+    room = max(budget - estimate_tokens(fixed), 0)
+
+    history_lines = fit_history(history or [], int(room * HISTORY_SHARE))
+    history_text = "\n\nPREVIOUS CONVERSATION:\n" + "\n".join(history_lines) + "\n" if history_lines else ""
+    context, trimmed = fit_passages(list(passages), room - estimate_tokens(history_text))
+    dropped_history = len(history or []) - len(history_lines)
+    if trimmed or dropped_history:
+        metrics.increment("prompt.trimmed")
+        print(f"Prompt over budget: cut {trimmed} passages and {dropped_history} history lines")
+
+    prompt = ANSWER_TEMPLATE.format(context="\n\n".join(context), history=history_text, question=question,
+                                    history_instruction=history_instruction)
+    record_prompt("answer", prompt, budget)
+    return prompt
+
+
+def document_excerpt(chunks, budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """The start of the document, overlap between chunks removed, cut to `budget` tokens."""
+    wanted = int(budget * CHARS_PER_TOKEN)
+    count = 0
+    text = ""
+    while len(text) < wanted and count < len(chunks):
+        # About 1000 new characters per chunk once overlap is removed
+        count = min(len(chunks), max(count * 2, int(math.ceil(wanted / 1000)) + 1))
+        text = " ".join(merge_chunks(chunks, range(count)))
+    return truncate_to_tokens(text, budget)
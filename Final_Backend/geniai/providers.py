@@ -0,0 +1,301 @@
+"""
+LLM and embedding providers.
+
+Callers get model objects with the same surface as the Google SDKs
+(`generate_content(prompt).text`, `get_embeddings(texts)[i].values`), picked
+by environment variable:
+
+    LLM_PROVIDER        gemini (default) | fake
+    EMBEDDING_PROVIDER  vertex (default) | fake
+
+The fake providers need no credentials or network. Embeddings are
+deterministic 768-d unit vectors seeded from a hash of the text, and
+generated text is canned, so the ingest and question pipelines can be load
+tested and profiled without spending quota. Their behaviour is configured per
+provider with FAKE_LLM_* / FAKE_EMBEDDING_* variables:
+
+    *_LATENCY_MS         median latency per call (default 0)
+    *_LATENCY_DIST       fixed | uniform | normal | lognormal (default fixed)
+    *_LATENCY_SPREAD     spread around the median: +/- ms for uniform, std-dev
+                         ms for normal, sigma for lognormal (default 0)
+    *_ERROR_RATE         fraction of calls failing with ServiceUnavailable
+    *_EXHAUSTED_RATE     fraction of calls failing with ResourceExhausted (429)
+    FAKE_SEED            seed for latency/error draws (default 0)
+
+EMBEDDING_OUTPUT_DIM asks the embedding model for shorter vectors (Vertex
+output_dimensionality; text-embedding-004 supports 1..768). It applies to new
+uploads only: existing indexes keep their size, and query.embed_query asks
+for query vectors at each index's own size (get_embeddings_at_dim).
+
+Models are created once per process and reused.
+"""
+
+import os
+import time
+import random
+import hashlib
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+import metrics
+
+try:
+    from google.api_core.exceptions import GoogleAPIError, ResourceExhausted, ServiceUnavailable
+except ImportError:
+    class GoogleAPIError(Exception):
+        """Stand-ins for the google-api-core errors when it is not installed."""
+
+    class ResourceExhausted(GoogleAPIError):
+        pass
+
+    class ServiceUnavailable(GoogleAPIError):
+        pass
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "vertex")
+EMBEDDING_DIM = 768
+GEMINI_MODELS = ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-1.0-pro"]
+EMBEDDING_MODEL = "text-embedding-004"
+EMBEDDING_OUTPUT_DIM = int(os.getenv("EMBEDDING_OUTPUT_DIM", "0")) or None
+
+
+# ---------------------------
+# Live Google providers
+# ---------------------------
+
+def load_gemini(model_names: List[str] = GEMINI_MODELS):
+    """First Gemini model that answers a ping."""
+    import google.generativeai as genai
+
+    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise RuntimeError("Missing GEMINI_API_KEY/GOOGLE_API_KEY in environment.")
+    genai.configure(api_key=api_key)
+
+    for model_name in model_names:
+        try:
+            model = genai.GenerativeModel(model_name)
+            _ = model.generate_content("ping")
+            print(f"Using Gemini API model: {model_name}")
+            return model
+        except Exception:
+            continue
+    raise RuntimeError("Failed to initialize any Gemini API model.")
+
+
+def load_vertex_embeddings(model_name: str = EMBEDDING_MODEL):
+    import vertexai
+    from vertexai.language_models import TextEmbeddingModel
+
+    project_id = os.getenv("GCP_PROJECT") or os.getenv("GOOGLE_CLOUD_PROJECT") or "gen-ai-legal"
+    location = os.getenv("GCP_LOCATION", "us-central1")
+    vertexai.init(project=project_id, location=location)
+    model = TextEmbeddingModel.from_pretrained(model_name)
+    if EMBEDDING_OUTPUT_DIM:
+        return ReducedEmbeddingModel(model, EMBEDDING_OUTPUT_DIM)
+    return model
+
+
+class ReducedEmbeddingModel:
+    """Passes output_dimensionality on every call, so callers keep using get_embeddings(texts)."""
+
+    def __init__(self, model, dim: int):
+        self.model = model
+        self.dim = dim
+
+    def get_embeddings(self, texts):
+        return self.model.get_embeddings(texts, output_dimensionality=self.dim)
+
+
+# ---------------------------
+# Fake providers
+# ---------------------------
+
+class FaultProfile:
+    """Latency distribution and error injection for one fake provider."""
+
+    def __init__(self, latency_ms: float = 0.0, dist: str = "fixed", spread: float = 0.0,
+                 error_rate: float = 0.0, exhausted_rate: float = 0.0, seed: int = 0):
+        if dist not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {dist}")
+        self.latency_ms = latency_ms
+        self.dist = dist
+        self.spread = spread
+        self.error_rate = error_rate
+        self.exhausted_rate = exhausted_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "FaultProfile":
+        return cls(
+            latency_ms=float(os.getenv(f"{prefix}_LATENCY_MS", "0")),
+            dist=os.getenv(f"{prefix}_LATENCY_DIST", "fixed"),
+            spread=float(os.getenv(f"{prefix}_LATENCY_SPREAD", "0")),
+            error_rate=float(os.getenv(f"{prefix}_ERROR_RATE", "0")),
+            exhausted_rate=float(os.getenv(f"{prefix}_EXHAUSTED_RATE", "0")),
+            seed=int(os.getenv("FAKE_SEED", "0")),
+        )
+
+    def sample_latency(self) -> float:
+        """One latency draw in seconds."""
+        with self._lock:
+            if self.dist == "uniform":
+                ms = self._rng.uniform(self.latency_ms - self.spread, self.latency_ms + self.spread)
+            elif self.dist == "normal":
+                ms = self._rng.gauss(self.latency_ms, self.spread)
+            elif self.dist == "lognormal":
+                # latency_ms is the median, spread is sigma of the underlying normal
+                ms = self.latency_ms * self._rng.lognormvariate(0.0, self.spread)
+            else:
+                ms = self.latency_ms
+        return max(0.0, ms) / 1000.0
+
+    def apply(self, name: str):
+        """Sleep for one latency draw, then maybe raise an injected error."""
+        delay = self.sample_latency()
+        if delay:
+            time.sleep(delay)
+        metrics.observe(f"provider.{name}.latency", delay)
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.exhausted_rate:
+            metrics.increment(f"provider.{name}.exhausted")
+            raise ResourceExhausted(f"Injected quota error from fake {name} provider")
+        if roll < self.exhausted_rate + self.error_rate:
+            metrics.increment(f"provider.{name}.errors")
+            raise ServiceUnavailable(f"Injected error from fake {name} provider")
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeLLM:
+    """Canned, prompt-dependent text in place of Gemini."""
+
+    # (marker in the prompt, canned reply), first match wins
+    CANNED = [
+        ("CLASSIFY this document", "1. Residential Rental/Lease Agreement"),
+        ("Generate only the chat name", "Lease Agreement Analysis"),
+        ("ping", "pong"),
+    ]
+    SENTENCES = [
+        "The tenant pays rent monthly in advance and a refundable security deposit.",
+        "Either party may terminate the agreement with written notice.",
+        "The landlord is responsible for structural repairs; the tenant for day-to-day upkeep.",
+        "Late payment attracts a penalty as set out in the payment clause.",
+        "Disputes are resolved under the jurisdiction named in the agreement.",
+        "Subletting requires the prior written consent of the landlord.",
+    ]
+
+    def __init__(self, faults: Optional[FaultProfile] = None, sentences: int = 4):
+        self.faults = faults or FaultProfile()
+        self.sentences = sentences
+        self.calls = 0
+
+    def generate_content(self, prompt: str) -> FakeResponse:
+        self.calls += 1
+        metrics.increment("provider.llm.calls")
+        self.faults.apply("llm")
+        for marker, reply in self.CANNED:
+            if marker in prompt:
+                return FakeResponse(reply)
+        start = _digest(prompt)[0]
+        picked = [self.SENTENCES[(start + i) % len(self.SENTENCES)] for i in range(self.sentences)]
+        return FakeResponse(" ".join(picked))
+
+
+class FakeEmbedding:
+    def __init__(self, values: List[float]):
+        self.values = values
+
+
+class FakeEmbeddingModel:
+    """Hash-seeded unit vectors in place of the Vertex text embedding model."""
+
+    def __init__(self, faults: Optional[FaultProfile] = None, dim: int = EMBEDDING_DIM):
+        self.faults = faults or FaultProfile()
+        self.dim = dim
+        self.calls = 0
+
+    def vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(_digest(text)[:8], "little")
+        vec = np.random.default_rng(seed).standard_normal(self.dim).astype("float32")
+        return vec / np.linalg.norm(vec)
+
+    def get_embeddings(self, texts: List[str]) -> List[FakeEmbedding]:
+        self.calls += 1
+        metrics.increment("provider.embedding.calls")
+        self.faults.apply("embedding")
+        return [FakeEmbedding(self.vector(text).tolist()) for text in texts]
+
+
+# ---------------------------
+# Selection
+# ---------------------------
+
+def create_llm(kind: str = LLM_PROVIDER):
+    if kind == "gemini":
+        return load_gemini()
+    if kind == "fake":
+        return FakeLLM(FaultProfile.from_env("FAKE_LLM"))
+    raise ValueError(f"Unknown LLM provider: {kind}")
+
+
+def embedding_model_name(kind: str = EMBEDDING_PROVIDER) -> str:
+    """Name stored with saved embeddings, so vectors from different models are never mixed."""
+    dim = EMBEDDING_OUTPUT_DIM or EMBEDDING_DIM
+    if kind == "vertex":
+        return EMBEDDING_MODEL if dim == EMBEDDING_DIM else f"{EMBEDDING_MODEL}@{dim}"
+    return f"{kind}-{dim}"
+
+
+def get_embeddings_at_dim(model, texts: List[str], dim: int):
+    """Embeddings with `dim` dimensions whatever EMBEDDING_OUTPUT_DIM is, for indexes built under another setting."""
+    base = model.model if isinstance(model, ReducedEmbeddingModel) else model
+    if isinstance(base, FakeEmbeddingModel):
+        return FakeEmbeddingModel(base.faults, dim).get_embeddings(texts)
+    if dim == EMBEDDING_DIM:
+        return base.get_embeddings(texts)
+    return base.get_embeddings(texts, output_dimensionality=dim)
+
+
+def create_embedding_model(kind: str = EMBEDDING_PROVIDER):
+    if kind == "vertex":
+        return load_vertex_embeddings()
+    if kind == "fake":
+        return FakeEmbeddingModel(FaultProfile.from_env("FAKE_EMBEDDING"), EMBEDDING_OUTPUT_DIM or EMBEDDING_DIM)
+    raise ValueError(f"Unknown embedding provider: {kind}")
+
+
+_llm = None
+_embedding_model = None
+_lock = threading.Lock()
+
+
+def get_llm():
+    """Process-wide LLM for LLM_PROVIDER, created on first use."""
+    global _llm
+    if _llm is None:
+        with _lock:
+            if _llm is None:
+                _llm = create_llm()
+    return _llm
+
+
+def get_embedding_model():
+    """Process-wide embedding model for EMBEDDING_PROVIDER, created on first use."""
+    global _embedding_model
+    if _embedding_model is None:
+        with _lock:
+            if _embedding_model is None:
+                _embedding_model = create_embedding_model()
+    return _embedding_model
@@ -2,19 +2,48 @@ import os
 import json
 import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import faiss
 from dotenv import load_dotenv
-import google.generativeai as genai
-import vertexai
-from vertexai.language_models import TextEmbeddingModel
 from agreement_analyzer import AgreementAnalyzer
 from chat_naming import generate_chat_name_from_query, save_chat_session, load_chat_sessions, update_chat_session
+from providers import (
+    EMBEDDING_DIM,
+    EMBEDDING_OUTPUT_DIM,
+    get_embedding_model,
+    get_embeddings_at_dim,
+    get_llm,
+)
+from vector_index import META_FILENAME, apply_search_params
+from lexical_index import BM25Index, FILENAME as LEXICAL_FILENAME, rrf
+from context_packing import MMR_CANDIDATES, candidate_vectors, diversify, merge_chunks
+from prompt_builder import build_answer_prompt, document_excerpt
+import metrics
 
 load_dotenv()
 
 VECTOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "vectorstore")
 INDEX_PATH = os.path.join(VECTOR_DIR, "index.faiss")
 CHUNKS_PATH = os.path.join(VECTOR_DIR, "chunks.json")
+META_PATH = os.path.join(VECTOR_DIR, META_FILENAME)
+LEXICAL_PATH = os.path.join(VECTOR_DIR, LEXICAL_FILENAME)
+
+# Past this the query is answered from the BM25 index alone
+EMBED_TIMEOUT_SECONDS = float(os.getenv("EMBED_TIMEOUT_SECONDS", "5"))
+# Candidates taken from each ranking before fusion
+CANDIDATE_DEPTH = 20
+# Relevance gate: a question is answered only if its best chunk reaches this
+# cosine similarity or shares rare enough terms with a chunk to reach
+# RELEVANCE_MIN_BM25. Off (0) until a threshold is measured for the deployed
+# embedding model with calibrate_relevance.py.
+RELEVANCE_MIN_SIMILARITY = float(os.getenv("RELEVANCE_MIN_SIMILARITY", "0"))
+RELEVANCE_MIN_BM25 = float(os.getenv("RELEVANCE_MIN_BM25", "3.0"))
+OFF_TOPIC_REPLY = (
+    "I couldn't find anything in this document that relates to your question, so I can't answer it "
+    "from the agreement. If you meant something in the document, try rephrasing with the words it "
+    "uses - for example its parties, payments, term, termination or obligations."
+)
+_embed_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="embed-query")
 
 
 def load_index_and_chunks():
@@ -23,53 +52,157 @@ def load_index_and_chunks():
             "Vector store not found. Run create_db.py first to build the FAISS index."
         )
     index = faiss.read_index(INDEX_PATH)
+    meta = None
+    if os.path.exists(META_PATH):
+        with open(META_PATH, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    apply_search_params(index, meta)
     with open(CHUNKS_PATH, "r", encoding="utf-8") as f:
         chunks = json.load(f)
     return index, chunks
 
 
 def load_gemini_model():
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing GEMINI_API_KEY/GOOGLE_API_KEY in environment.")
-    genai.configure(api_key=api_key)
-    # Prefer the most available first
-    for model_name in ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-1.0-pro"]:
-        try:
-            model = genai.GenerativeModel(model_name)
-            _ = model.generate_content("ping")
-            print(f"Using Gemini API model: {model_name}")
-            return model
-        except Exception:
-            continue
-    raise RuntimeError("Failed to initialize any Gemini API model.")
+    return get_llm()
 
 
-def search(index, query_vector, k=3):
+def search_with_scores(index, query_vector, k=3):
+    """(chunk index, squared L2 distance) pairs, nearest first."""
     distances, indices = index.search(query_vector, k)
-    return indices[0]
+    # Approximate indexes (and k > ntotal) pad missing results with -1
+    return [(int(i), float(d)) for i, d in zip(indices[0], distances[0]) if i >= 0]
 
 
-def init_vertex_for_embeddings():
-    project_id = os.getenv("GCP_PROJECT") or os.getenv("GOOGLE_CLOUD_PROJECT") or "gen-ai-legal"
-    location = os.getenv("GCP_LOCATION", "us-central1")
-    vertexai.init(project=project_id, location=location)
+def search(index, query_vector, k=3):
+    return [i for i, _ in search_with_scores(index, query_vector, k)]
+
+
+def similarity(distance):
+    """Cosine similarity from squared L2 distance; only right for unit-length vectors."""
+    return 1.0 - distance / 2.0
+
+
+def hit_similarities(index, query_vector, hits):
+    """
+    Cosine similarity of each (chunk index, distance) hit to the query,
+    computed from the stored vectors: reduced-dimension embeddings and PCA
+    indexes are not unit length, so their L2 distances say nothing about the
+    angle. Falls back to similarity(distance) for indexes that cannot
+    reconstruct vectors (IVF).
+    """
+    if not hits:
+        return []
+    vectors = candidate_vectors(index, [i for i, _ in hits])
+    if vectors is None:
+        return [similarity(d) for _, d in hits]
+    query = np.asarray(query_vector, dtype="float32").reshape(-1)
+    return [float(s) for s in vectors @ (query / (np.linalg.norm(query) or 1.0))]
 
 
 def load_embedding_model():
-    return TextEmbeddingModel.from_pretrained("text-embedding-004")
+    return get_embedding_model()
 
 
-def embed_query(text):
-    init_vertex_for_embeddings()
+def embed_query(text, dim=None):
+    """
+    Query vector. `dim` (an index's d) asks the model for that many
+    dimensions when it differs from EMBEDDING_OUTPUT_DIM, so documents
+    embedded before the setting changed can still be searched.
+    """
     model = load_embedding_model()
-    values = model.get_embeddings([text])[0].values
+    if dim and dim != (EMBEDDING_OUTPUT_DIM or EMBEDDING_DIM):
+        metrics.increment("retrieval.embedding_dim_mismatch")
+        values = get_embeddings_at_dim(model, [text], dim)[0].values
+    else:
+        values = model.get_embeddings([text])[0].values
     return np.array([values], dtype="float32")
 
 
+def check_query_dim(index, q_vec):
+    """Raise, rather than let faiss assert, when a query vector cannot search this index."""
+    if q_vec.shape[1] != index.d:
+        raise ValueError(
+            f"Query embedding has {q_vec.shape[1]} dimensions but the index has {index.d}; "
+            f"it was built with a different embedding model or EMBEDDING_OUTPUT_DIM. Re-upload the document."
+        )
+
+
+def load_lexical_index(chunks):
+    if os.path.exists(LEXICAL_PATH):
+        with open(LEXICAL_PATH, "r", encoding="utf-8") as f:
+            return BM25Index.from_json(f.read())
+    return BM25Index.build(chunks)
+
+
+def is_relevant(best_similarity, best_bm25, min_similarity=None, min_bm25=None):
+    """
+    The gate: True/False, or None when there is no vector score to judge by
+    (embedding unavailable) and no strong lexical match either.
+    """
+    min_similarity = RELEVANCE_MIN_SIMILARITY if min_similarity is None else min_similarity
+    min_bm25 = RELEVANCE_MIN_BM25 if min_bm25 is None else min_bm25
+    if min_similarity <= 0 or best_bm25 >= min_bm25:
+        return True
+    if best_similarity is None:
+        return None
+    return best_similarity >= min_similarity
+
+
+def retrieve_scored(index, chunks, query, k=3, lexical=None, timeout=EMBED_TIMEOUT_SECONDS):
+    """
+    Top-k chunks for a query with their scores and the relevance gate's verdict:
+
+        {"ids": [...], "similarity": {id: cosine}, "bm25": {id: score},
+         "best_similarity": float or None, "best_bm25": float, "relevant": True/False/None}
+
+    FAISS and BM25 rankings are fused with reciprocal rank fusion and k of the
+    top MMR_CANDIDATES are picked by maximal marginal relevance, so
+    overlapping near-duplicate chunks do not fill every slot. If embedding
+    the query fails or takes longer than `timeout` seconds, the BM25 ranking
+    is used on its own, and "ids" is empty if that has no hit; callers then
+    answer with OFF_TOPIC_REPLY instead of calling the LLM. Gate outcomes are counted as
+    retrieval.gate.{passed,blocked,unknown}.
+    """
+    lexical = lexical or BM25Index.build(chunks)
+    depth = max(k, CANDIDATE_DEPTH)
+    lexical_hits = lexical.search(query, depth)
+    lexical_ranking = [i for i, _ in lexical_hits]
+    result = {"similarity": {}, "bm25": dict(lexical_hits), "best_similarity": None,
+              "best_bm25": lexical_hits[0][1] if lexical_hits else 0.0}
+
+    try:
+        # Asked at the index's own size, so indexes built under another EMBEDDING_OUTPUT_DIM still work
+        q_vec = _embed_pool.submit(embed_query, query, index.d).result(timeout=timeout)
+    except Exception as e:
+        print(f"Query embedding unavailable ({type(e).__name__}: {e}); using lexical retrieval only")
+        metrics.increment("retrieval.lexical_fallback")
+        # No BM25 hit either: no ids, rather than unrelated chunks for the LLM
+        result["ids"] = lexical_ranking[:k]
+    else:
+        check_query_dim(index, q_vec)
+        vector_hits = search_with_scores(index, q_vec, k=min(depth, index.ntotal))
+        similarities = hit_similarities(index, q_vec, vector_hits)
+        result["similarity"] = {i: s for (i, _), s in zip(vector_hits, similarities)}
+        if similarities:
+            result["best_similarity"] = max(similarities)
+        fused = rrf([[i for i, _ in vector_hits], lexical_ranking])
+        result["ids"] = diversify(index, q_vec, fused[:max(k, MMR_CANDIDATES)], k)
+
+    result["relevant"] = is_relevant(result["best_similarity"], result["best_bm25"])
+    outcome = {True: "passed", False: "blocked", None: "unknown"}[result["relevant"]]
+    metrics.increment(f"retrieval.gate.{outcome}")
+    return result
+
+
+def retrieve(index, chunks, query, k=3, lexical=None, timeout=EMBED_TIMEOUT_SECONDS):
+    """Indices of the top-k chunks for a query (see retrieve_scored)."""
+    return retrieve_scored(index, chunks, query, k, lexical, timeout)["ids"]
+
+
 def interactive_chat():
     # Load index and chunks
     index, chunks = load_index_and_chunks()
+    lexical = load_lexical_index(chunks)
 
     # Load Gemini model
     model = load_gemini_model()
@@ -101,8 +234,8 @@ def interactive_chat():
             try:
                 # Load the first few chunks to get document content for summary
                 if chunks:
-                    # Combine first few chunks for summary generation
-                    summary_text = " ".join(chunks[:5])  # Use first 5 chunks
+                    # Start of the document, up to SUMMARY_TOKEN_BUDGET
+                    summary_text = document_excerpt(chunks)
                     analyzer = AgreementAnalyzer()
                     summary_result = analyzer.generate_detailed_summary(summary_text)
                     
@@ -154,49 +287,17 @@ def interactive_chat():
         # Note: Chat session is only created when detailed summary is generated
         # Regular queries don't create new chat sessions
 
-        # Embed query and retrieve top-k chunks from FAISS
-        try:
-            q_vec = embed_query(query)
-            top_idx = search(index, q_vec, k=3)
-            context = [chunks[i] for i in top_idx]
-        except Exception as e:
-            print(f"Error embedding query: {e}")
-            print("Falling back to using the first few chunks as context.")
-            context = chunks[:3]
-
-        # Build conversation context
-        conversation_context = ""
-        if conversation_history:
-            conversation_context = "\n\nPREVIOUS CONVERSATION:\n" + "\n".join(conversation_history[-4:])  # Last 4 exchanges
-
-        prompt = f"""You are a professional legal assistant who explains complex legal documents in simple, easy-to-understand language for people without legal backgrounds.
-
-CONTEXT FROM DOCUMENT:
-{"\n\n".join(context)}
-
-{conversation_context}
-
-USER QUESTION: {query}
-
-INSTRUCTIONS:
-- **Use simple language** - Explain legal terms in plain English that anyone can understand
-- **Break down complexity** - Take complex legal concepts and make them clear and accessible
-- **Provide practical understanding** - Help users grasp what the legal language actually means for them
-- **Maintain professionalism** - Be helpful and informative while staying professional
-- **Reference context** - Use previous conversation context when relevant
-- **Give detailed answers when needed** - If the question requires steps, procedures, or comprehensive explanation, provide them
-
-RESPONSE STYLE:
-- Start with a clear, direct answer to the question
-- **If the question requires detailed steps or procedures, provide them clearly**
-- **Use bullet points and numbered lists when they make complex information easier to understand**
-- Break down complex legal concepts into simple, understandable parts
-- Use examples and practical explanations when helpful
-- Avoid legal jargon and complex terminology
-- Be informative and helpful without being overly casual
-- **Adapt response length to the complexity of the question**
-
-Remember: Your goal is to make legal documents understandable for non-legal professionals. Use clear, simple language while maintaining professional credibility. If a question needs detailed steps or comprehensive explanation, provide it."""
+        # Retrieve top-k chunks (FAISS + BM25, or BM25 alone if embedding fails)
+        retrieval = retrieve_scored(index, chunks, query, k=3, lexical=lexical)
+        if retrieval["relevant"] is False or not retrieval["ids"]:
+            # Nothing in the document is close enough (or nothing retrieved): no generation call
+            print(f"\nAssistant:\n{OFF_TOPIC_REPLY}\n")
+            continue
+        # Overlapping picks are sent as one passage
+        context = merge_chunks(chunks, retrieval["ids"])
+
+        # Context and conversation history packed into the model's token budget
+        prompt = build_answer_prompt(query, context, history=conversation_history, model=model)
 
         try:
             resp = model.generate_content(prompt)
@@ -0,0 +1,175 @@
+"""
+Rebuild FAISS indexes from stored embeddings, without calling Vertex.
+
+Every document ingested with embeddings.npy (see embedding_store.py) can get
+a new index type or target locally: the document's packed artifact (or
+legacy index.faiss) is rewritten with chunks, BM25 and summary kept as they
+are. --user-index also rebuilds the users' cross-document search shards in one
+commit each.
+
+    python reindex.py alice_example_com                      # re-run the size-adaptive choice
+    python reindex.py --all-users --type hnsw --target recall
+    python reindex.py bob_example_com --documents <id> <id> --user-index
+    python reindex.py --all-users --extract --dry-run         # what would change
+
+--extract first saves embeddings for documents stored without them, by
+reconstructing the vectors from exact (flat or HNSW) indexes.
+"""
+
+import sys
+import json
+import time
+import argparse
+from typing import Dict, List, Optional
+
+from artifact import ARTIFACT_FILENAME, PackedArtifact, write_artifact
+from embedding_store import FILENAME, load_embeddings, save_embeddings
+from providers import embedding_model_name
+from storage_backend import ObjectNotFound, get_storage
+from user_index import SHARD_DIR, get_user_index_store
+from vector_index import build_index, choose_spec, index_meta, read_index, save_index
+
+INDEX_TYPES = ["flat", "hnsw", "ivf_pq"]
+EXACT_TYPES = ("flat", "hnsw")
+
+
+def list_users(storage) -> List[str]:
+    return sorted({name.split("/")[1] for name in storage.list("users/") if "/vectorstore/" in name})
+
+
+def list_documents(storage, user_id: str) -> Dict[str, Dict[str, str]]:
+    """document_id -> {object filename: object name} for the user's per-document stores."""
+    prefix = f"users/{user_id}/vectorstore/"
+    documents = {}
+    for name in storage.list(prefix):
+        parts = name[len(prefix):].split("/")
+        if len(parts) == 2 and parts[0] != SHARD_DIR:
+            documents.setdefault(parts[0], {})[parts[1]] = name
+    return documents
+
+
+def _read_document(storage, objects: Dict[str, str]):
+    """(index, PackedArtifact or None) for either storage layout."""
+    if ARTIFACT_FILENAME in objects:
+        packed = PackedArtifact(storage, objects[ARTIFACT_FILENAME])
+        return packed.load_index(), packed
+    return read_index(storage, objects["index.faiss"]), None
+
+
+def extract_embeddings(storage, objects: Dict[str, str], document_dir: str, dry_run: bool = False) -> Optional[str]:
+    """Save embeddings reconstructed from an exact index; returns why not, if it could not."""
+    if ARTIFACT_FILENAME not in objects and "index.faiss" not in objects:
+        return "no index"
+    index, _ = _read_document(storage, objects)
+    meta = index_meta(index)
+    kind = meta["type"]
+    if kind not in EXACT_TYPES or meta.get("pca") or meta.get("sq"):
+        return f"{kind} index cannot reconstruct exact vectors"
+    if not dry_run:
+        save_embeddings(storage, document_dir + FILENAME, index.reconstruct_n(0, index.ntotal))
+    return None
+
+
+def reindex_document(storage, objects: Dict[str, str], embeddings, target: Optional[str] = None,
+                     kind: Optional[str] = None, dry_run: bool = False) -> Dict:
+    spec = choose_spec(len(embeddings), embeddings.shape[1], target, kind)
+    if dry_run:
+        return {"type": spec["type"]}
+    start = time.perf_counter()
+    index = build_index(embeddings, target, spec)
+    build_s = time.perf_counter() - start
+
+    if ARTIFACT_FILENAME in objects:
+        packed = PackedArtifact(storage, objects[ARTIFACT_FILENAME])
+        write_artifact(storage, objects[ARTIFACT_FILENAME], index, packed.spans(), packed.summary, packed.lexical())
+    else:
+        save_index(storage, objects["index.faiss"], index)
+    return {"type": spec["type"], "build_s": round(build_s, 3)}
+
+
+def reindex_user(storage, user_id: str, document_ids: Optional[List[str]] = None, target: Optional[str] = None,
+                 kind: Optional[str] = None, user_index: bool = False, extract: bool = False,
+                 dry_run: bool = False) -> Dict[str, str]:
+    """Rebuild one user's document indexes; returns document_id -> outcome."""
+    model = embedding_model_name()
+    results = {}
+    shard_documents = {}
+    for document_id, objects in sorted(list_documents(storage, user_id).items()):
+        if document_ids and document_id not in document_ids:
+            continue
+        document_dir = f"users/{user_id}/vectorstore/{document_id}/"
+        if FILENAME not in objects and extract:
+            reason = extract_embeddings(storage, objects, document_dir, dry_run)
+            if reason:
+                results[document_id] = f"skipped: {reason}"
+                continue
+            if dry_run:
+                results[document_id] = "would extract embeddings"
+                continue
+            objects[FILENAME] = document_dir + FILENAME
+        if FILENAME not in objects:
+            results[document_id] = "skipped: no stored embeddings (re-upload, or use --extract)"
+            continue
+
+        embeddings, meta = load_embeddings(storage, objects[FILENAME])
+        try:
+            outcome = reindex_document(storage, objects, embeddings, target, kind, dry_run)
+        except (RuntimeError, ValueError) as e:
+            # e.g. too few vectors to train IVF-PQ
+            results[document_id] = f"failed: {e}"
+            continue
+        results[document_id] = ("would build " if dry_run else "rebuilt ") + outcome["type"]
+
+        stored_model = (meta or {}).get("model", model)
+        if user_index and stored_model != model:
+            results[document_id] += f" (not added to user index: embedded with {stored_model})"
+        elif user_index:
+            chunks = None
+            if ARTIFACT_FILENAME in objects:
+                chunks = PackedArtifact(storage, objects[ARTIFACT_FILENAME]).spans()
+            shard_documents[document_id] = (embeddings, chunks)
+
+    if user_index and shard_documents and not dry_run:
+        store = get_user_index_store()
+        known = store.load(user_id).documents
+        batch = {}
+        for document_id, (embeddings, chunks) in shard_documents.items():
+            if chunks is None:
+                chunks = json.loads(storage.get_text(f"users/{user_id}/vectorstore/{document_id}/chunks.json"))
+            batch[document_id] = (embeddings, chunks, known.get(document_id, {}).get("filename"))
+        store.add_documents(user_id, batch)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild FAISS indexes from stored embeddings.")
+    parser.add_argument("users", nargs="*", help="storage user ids (email with @ and . replaced by _)")
+    parser.add_argument("--all-users", action="store_true")
+    parser.add_argument("--documents", nargs="*", help="only these document ids")
+    parser.add_argument("--target", choices=["recall", "balanced", "latency"], help="default: VECTOR_INDEX_TARGET")
+    parser.add_argument("--type", choices=INDEX_TYPES, help="force an index type instead of choosing by size")
+    parser.add_argument("--user-index", action="store_true", help="also rebuild the cross-document search shards")
+    parser.add_argument("--extract", action="store_true",
+                        help="save embeddings from exact indexes for documents stored without them")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    storage = get_storage()
+    users = list_users(storage) if args.all_users else args.users
+    if not users:
+        parser.error("give user ids or --all-users")
+
+    for user_id in users:
+        try:
+            results = reindex_user(storage, user_id, args.documents, args.target, args.type,
+                                   args.user_index, args.extract, args.dry_run)
+        except ObjectNotFound as e:
+            print(f"{user_id}: object disappeared while reindexing ({e}), run again")
+            continue
+        print(f"{user_id}: {len(results)} documents")
+        for document_id, outcome in results.items():
+            print(f"  {document_id}  {outcome}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import Document, DocumentSummary, ChatSession, ChatMessage
 from users.models import User
+from .django_sync import bump_message_count
 
 
 class DocumentSerializer(serializers.ModelSerializer):
@@ -109,9 +110,8 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         # Ensure user is set from chat_session
         validated_data['user'] = chat_session.user
         msg = ChatMessage.objects.create(chat_session=chat_session, **validated_data)
-        # increment message count
-        chat_session.message_count = (chat_session.message_count or 0) + 1
-        chat_session.save()
+        # increment message count atomically
+        bump_message_count(chat_session.id)
         return msg
 
 
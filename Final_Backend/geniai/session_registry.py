@@ -0,0 +1,352 @@
+"""
+Indexed chat-session registry.
+
+Chat sessions are kept in a SQLite database (WAL mode) keyed by chat id,
+with a (user_id, last_updated) index for user-scoped listing. Lookups,
+partial updates and counter increments touch a single row inside one
+transaction, so they stay constant-time no matter how many sessions exist,
+and several worker processes can share the same file safely.
+
+Chat messages are kept in the same database, appended by id so repeated
+deliveries are harmless. The legacy data/chat_sessions.json and
+data/chat_messages.json files are imported once on first use.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+REGISTRY_PATH = os.getenv("CHAT_REGISTRY_PATH", os.path.join(DATA_DIR, "chat_sessions.db"))
+LEGACY_SESSIONS_FILE = os.path.join(DATA_DIR, "chat_sessions.json")
+LEGACY_MESSAGES_FILE = os.path.join(DATA_DIR, "chat_messages.json")
+
+# Fields stored in their own columns; anything else goes into the `extra` JSON blob
+SESSION_COLUMNS = (
+    "id", "user_id", "name", "document_name", "document_path", "document_id",
+    "created_at", "last_updated", "message_count",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    name TEXT,
+    document_name TEXT,
+    document_path TEXT,
+    document_id TEXT,
+    created_at TEXT,
+    last_updated TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS chat_sessions_user_updated
+    ON chat_sessions (user_id, last_updated);
+CREATE INDEX IF NOT EXISTS chat_sessions_updated
+    ON chat_sessions (last_updated);
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id TEXT PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    message_type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_messages_chat_created
+    ON chat_messages (chat_id, created_at, id);
+CREATE TABLE IF NOT EXISTS registry_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SessionRegistry:
+    """Keyed store for chat-session metadata backed by SQLite."""
+
+    def __init__(self, path: str = REGISTRY_PATH, legacy_file: Optional[str] = LEGACY_SESSIONS_FILE,
+                 legacy_messages_file: Optional[str] = LEGACY_MESSAGES_FILE):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+        if legacy_file:
+            self._import_legacy(legacy_file)
+        if legacy_messages_file:
+            self._import_legacy_messages(legacy_messages_file)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connect())
+
+    def _import_legacy(self, legacy_file: str):
+        """Import sessions from the old JSON file once."""
+        with self._transaction() as conn:
+            done = conn.execute(
+                "SELECT value FROM registry_meta WHERE key = 'legacy_imported'"
+            ).fetchone()
+            if done:
+                return
+            sessions = []
+            if os.path.exists(legacy_file):
+                try:
+                    with open(legacy_file, "r", encoding="utf-8") as f:
+                        sessions = json.load(f)
+                except Exception as e:
+                    print(f"Error loading legacy chat sessions: {e}")
+            for session in sessions:
+                if session.get("id") is not None:
+                    self._upsert(conn, session, replace=False)
+            conn.execute(
+                "INSERT OR REPLACE INTO registry_meta (key, value) VALUES ('legacy_imported', ?)",
+                (datetime.now().isoformat(),),
+            )
+            if sessions:
+                print(f"Imported {len(sessions)} chat sessions from {legacy_file}")
+
+    def _import_legacy_messages(self, legacy_file: str):
+        """Import messages from the old {chat_id: [message, ...]} JSON file once."""
+        with self._transaction() as conn:
+            done = conn.execute(
+                "SELECT value FROM registry_meta WHERE key = 'legacy_messages_imported'"
+            ).fetchone()
+            if done:
+                return
+            messages = {}
+            if os.path.exists(legacy_file):
+                try:
+                    with open(legacy_file, "r", encoding="utf-8") as f:
+                        messages = json.load(f)
+                except Exception as e:
+                    print(f"Error loading legacy chat messages: {e}")
+            for chat_id, chat_messages in messages.items():
+                self._insert_messages(conn, chat_id, chat_messages)
+            conn.execute(
+                "INSERT OR REPLACE INTO registry_meta (key, value) VALUES ('legacy_messages_imported', ?)",
+                (datetime.now().isoformat(),),
+            )
+            if messages:
+                print(f"Imported messages for {len(messages)} chats from {legacy_file}")
+
+    @staticmethod
+    def _split(session: Dict):
+        columns = {k: session[k] for k in SESSION_COLUMNS if k in session}
+        extra = {k: v for k, v in session.items() if k not in SESSION_COLUMNS}
+        if "id" in columns:
+            columns["id"] = str(columns["id"])
+        return columns, extra
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict:
+        session = {k: row[k] for k in SESSION_COLUMNS}
+        if row["extra"]:
+            session.update(json.loads(row["extra"]))
+        if session.get("user_id") is None:
+            session.pop("user_id")
+        if session.get("document_id") is None:
+            session.pop("document_id")
+        return session
+
+    def _upsert(self, conn: sqlite3.Connection, session: Dict, replace: bool = True):
+        columns, extra = self._split(session)
+        columns["message_count"] = columns.get("message_count") or 0
+        columns["extra"] = json.dumps(extra, ensure_ascii=False) if extra else None
+        names = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        conn.execute(
+            f"{verb} INTO chat_sessions ({names}) VALUES ({placeholders})",
+            tuple(columns.values()),
+        )
+
+    def put(self, session: Dict):
+        """Insert or replace a whole session record."""
+        with self._transaction() as conn:
+            self._upsert(conn, session)
+
+    def get(self, chat_id) -> Optional[Dict]:
+        """Fetch one session by id."""
+        row = self._connect().execute(
+            "SELECT * FROM chat_sessions WHERE id = ?", (str(chat_id),)
+        ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def update(self, chat_id, updates: Dict) -> bool:
+        """Apply a partial update and bump last_updated. Returns False if the id is unknown."""
+        columns, extra = self._split(updates)
+        columns.pop("id", None)
+        columns["last_updated"] = datetime.now().isoformat()
+        with self._transaction() as conn:
+            if extra:
+                row = conn.execute(
+                    "SELECT extra FROM chat_sessions WHERE id = ?", (str(chat_id),)
+                ).fetchone()
+                if row is None:
+                    return False
+                merged = json.loads(row["extra"]) if row["extra"] else {}
+                merged.update(extra)
+                columns["extra"] = json.dumps(merged, ensure_ascii=False)
+            assignments = ", ".join(f"{k} = ?" for k in columns)
+            cursor = conn.execute(
+                f"UPDATE chat_sessions SET {assignments} WHERE id = ?",
+                (*columns.values(), str(chat_id)),
+            )
+            return cursor.rowcount > 0
+
+    def increment_message_count(self, chat_id, delta: int = 1) -> Optional[int]:
+        """Atomically add `delta` to message_count and return the new value."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE chat_sessions SET message_count = message_count + ?, last_updated = ? WHERE id = ?",
+                (delta, datetime.now().isoformat(), str(chat_id)),
+            )
+            if cursor.rowcount == 0:
+                return None
+            row = conn.execute(
+                "SELECT message_count FROM chat_sessions WHERE id = ?", (str(chat_id),)
+            ).fetchone()
+            return row["message_count"]
+
+    def list(self, user_id: Optional[str] = None, limit: Optional[int] = None,
+             after: Optional[tuple] = None) -> List[Dict]:
+        """
+        List sessions newest first, optionally scoped to one user.
+        
+        `after` is the (last_updated, id) of the last session of the previous
+        page; listing resumes strictly after it (keyset pagination).
+        """
+        sql = "SELECT * FROM chat_sessions"
+        clauses = []
+        params = []
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if after is not None:
+            clauses.append("(last_updated, id) < (?, ?)")
+            params.extend([after[0], str(after[1])])
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY last_updated DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        rows = self._connect().execute(sql, params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def delete(self, chat_id) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM chat_sessions WHERE id = ?", (str(chat_id),))
+            conn.execute("DELETE FROM chat_messages WHERE chat_id = ?", (str(chat_id),))
+            return cursor.rowcount > 0
+
+    @staticmethod
+    def _insert_messages(conn: sqlite3.Connection, chat_id, messages: List[Dict]) -> int:
+        inserted = 0
+        for message in messages:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO chat_messages (id, chat_id, message_type, content, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    str(message["id"]),
+                    str(chat_id),
+                    message["message_type"],
+                    message["content"],
+                    message.get("created_at") or datetime.now().isoformat(),
+                ),
+            )
+            inserted += cursor.rowcount
+        return inserted
+
+    def append_messages(self, chat_id, messages: List[Dict]) -> int:
+        """
+        Append messages to a chat and bump its message_count by the number
+        actually inserted. Messages whose id is already stored are skipped.
+        """
+        with self._transaction() as conn:
+            inserted = self._insert_messages(conn, chat_id, messages)
+            if inserted:
+                conn.execute(
+                    "UPDATE chat_sessions SET message_count = message_count + ?, last_updated = ? WHERE id = ?",
+                    (inserted, datetime.now().isoformat(), str(chat_id)),
+                )
+            return inserted
+
+    def message_count_with_pending(self, chat_id, pending_ids: List[str]) -> int:
+        """
+        message_count plus the `pending_ids` not stored yet, read in one
+        statement so a delivery landing meanwhile is counted exactly once.
+        """
+        placeholders = ", ".join("?" * len(pending_ids)) or "NULL"
+        row = self._connect().execute(
+            "SELECT (SELECT message_count FROM chat_sessions WHERE id = ?), "
+            f"(SELECT COUNT(*) FROM chat_messages WHERE chat_id = ? AND id IN ({placeholders}))",
+            (str(chat_id), str(chat_id), *[str(i) for i in pending_ids]),
+        ).fetchone()
+        return (row[0] or 0) + len(pending_ids) - row[1]
+
+    def get_messages(self, chat_id, limit: Optional[int] = None, after: Optional[tuple] = None,
+                     backward: bool = False) -> List[Dict]:
+        """
+        Return messages of a chat in creation order.
+        
+        With `limit`, returns one page: the oldest messages (or the newest ones
+        when `backward`), resuming strictly past the (created_at, id) pair
+        `after`. Pages are always returned in creation order.
+        """
+        sql = "SELECT id, message_type, content, created_at FROM chat_messages WHERE chat_id = ?"
+        params = [str(chat_id)]
+        if after is not None:
+            sql += " AND (created_at, id) " + ("<" if backward else ">") + " (?, ?)"
+            params.extend([after[0], str(after[1])])
+        sql += " ORDER BY created_at DESC, id DESC" if backward else " ORDER BY created_at, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        rows = [dict(row) for row in self._connect().execute(sql, params).fetchall()]
+        if backward:
+            rows.reverse()
+        return rows
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK around a block, so writers serialize across processes."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> SessionRegistry:
+    """Return the process-wide registry, creating it on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SessionRegistry()
+    return _registry
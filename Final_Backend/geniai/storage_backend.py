@@ -0,0 +1,350 @@
+"""
+Object storage behind one small interface.
+
+Backends (STORAGE_BACKEND env):
+    gcs     - Google Cloud Storage bucket GCS_BUCKET_NAME (default)
+    local   - files under STORAGE_LOCAL_ROOT/<bucket>, for running on a laptop
+    memory  - per-process dict, for tests and benchmarks
+
+Every backend supports put/get/get_range/list/exists/generation/delete.
+Generations are per-object version numbers (0 = missing); put() accepts
+if_generation_match for optimistic concurrency, raising GenerationMismatch
+when the object changed in between. Every call is counted in `ops` and in
+the "storage.<op>" metrics counters, so request-path round trips can be
+measured.
+"""
+
+import os
+import time
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import metrics
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")
+GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "legal-agreement-analyzer-gen-ai-legal")
+STORAGE_LOCAL_ROOT = os.getenv(
+    "STORAGE_LOCAL_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "storage")
+)
+
+
+class ObjectNotFound(Exception):
+    """The object does not exist."""
+
+
+class GenerationMismatch(Exception):
+    """if_generation_match did not match the object's current generation."""
+
+
+def _to_bytes(data: Union[bytes, str]) -> bytes:
+    return data.encode("utf-8") if isinstance(data, str) else data
+
+
+class StorageBackend:
+    """Common bookkeeping; subclasses implement the _-prefixed operations."""
+
+    scheme = ""
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self.ops = Counter()
+
+    def _count(self, op: str):
+        self.ops[op] += 1
+        metrics.increment(f"storage.{op}")
+
+    def uri(self, name: str) -> str:
+        return f"{self.scheme}://{self.bucket_name}/{name}"
+
+    def local_path(self, name: str) -> Optional[str]:
+        """Filesystem path of an object when the backend keeps it in a file (for np.load mmap), else None."""
+        return None
+
+    def put(self, name: str, data: Union[bytes, str], content_type: Optional[str] = None,
+            if_generation_match: Optional[int] = None) -> int:
+        """Write an object and return its new generation. if_generation_match=0 means "must not exist"."""
+        self._count("put")
+        return self._put(name, _to_bytes(data), content_type, if_generation_match)
+
+    def get(self, name: str) -> bytes:
+        return self.get_with_generation(name)[0]
+
+    def get_text(self, name: str) -> str:
+        return self.get(name).decode("utf-8")
+
+    def get_with_generation(self, name: str) -> Tuple[bytes, int]:
+        """Read an object and the generation that was read. Raises ObjectNotFound."""
+        self._count("get")
+        return self._get(name)
+
+    def get_range(self, name: str, start: int, length: int) -> bytes:
+        """Read `length` bytes starting at `start`."""
+        self._count("get_range")
+        return self._get_range(name, start, length)
+
+    def list(self, prefix: str = "") -> List[str]:
+        """Names of all objects under `prefix`, sorted."""
+        self._count("list")
+        return sorted(self._list(prefix))
+
+    def exists(self, name: str) -> bool:
+        self._count("exists")
+        return self._generation(name) > 0
+
+    def generation(self, name: str) -> int:
+        """Current generation of an object, 0 if it does not exist."""
+        self._count("generation")
+        return self._generation(name)
+
+    def delete(self, name: str):
+        """Delete an object. Raises ObjectNotFound."""
+        self._count("delete")
+        self._delete(name)
+
+
+class GCSBackend(StorageBackend):
+    scheme = "gs"
+
+    def __init__(self, bucket_name: str = GCS_BUCKET_NAME, client=None):
+        super().__init__(bucket_name)
+        from google.cloud import storage
+        self.client = client or storage.Client()
+        self.bucket = self.client.bucket(bucket_name)
+
+    def _put(self, name, data, content_type, if_generation_match):
+        from google.api_core.exceptions import PreconditionFailed
+        blob = self.bucket.blob(name)
+        try:
+            blob.upload_from_string(data, content_type=content_type, if_generation_match=if_generation_match)
+        except PreconditionFailed:
+            raise GenerationMismatch(name)
+        return blob.generation
+
+    def _get(self, name):
+        from google.api_core.exceptions import NotFound
+        blob = self.bucket.blob(name)
+        try:
+            data = blob.download_as_bytes()
+        except NotFound:
+            raise ObjectNotFound(name)
+        return data, blob.generation
+
+    def _get_range(self, name, start, length):
+        from google.api_core.exceptions import NotFound
+        if length <= 0:
+            return b""
+        try:
+            return self.bucket.blob(name).download_as_bytes(start=start, end=start + length - 1)
+        except NotFound:
+            raise ObjectNotFound(name)
+
+    def _list(self, prefix):
+        return [blob.name for blob in self.client.list_blobs(self.bucket, prefix=prefix)]
+
+    def _generation(self, name):
+        blob = self.bucket.get_blob(name)
+        return blob.generation if blob else 0
+
+    def _delete(self, name):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(name).delete()
+        except NotFound:
+            raise ObjectNotFound(name)
+
+
+class LocalBackend(StorageBackend):
+    """
+    Objects as files under root/<bucket>/<name>. The generation is stored as
+    the file's mtime in nanoseconds and bumped on every write; preconditioned
+    writes hold an exclusive lock file so workers on one host serialize.
+    """
+
+    scheme = "file"
+
+    def __init__(self, bucket_name: str = GCS_BUCKET_NAME, root: str = STORAGE_LOCAL_ROOT):
+        super().__init__(bucket_name)
+        self.root = os.path.join(os.path.abspath(root), bucket_name)
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def uri(self, name: str) -> str:
+        return f"file://{self._path(name)}"
+
+    def local_path(self, name: str) -> Optional[str]:
+        return self._path(name)
+
+    def _path(self, name: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Object name escapes the storage root: {name}")
+        return path
+
+    def _generation(self, name):
+        try:
+            return os.stat(self._path(name)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _put(self, name, data, content_type, if_generation_match):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock, _FileLock(os.path.join(self.root, ".lock")):
+            current = self._generation(name)
+            if if_generation_match is not None and current != if_generation_match:
+                raise GenerationMismatch(name)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            generation = max(time.time_ns(), current + 1)
+            os.utime(tmp, ns=(generation, generation))
+            os.replace(tmp, path)
+            return generation
+
+    def _get(self, name):
+        path = self._path(name)
+        try:
+            with open(path, "rb") as f:
+                generation = os.fstat(f.fileno()).st_mtime_ns
+                return f.read(), generation
+        except FileNotFoundError:
+            raise ObjectNotFound(name)
+
+    def _get_range(self, name, start, length):
+        try:
+            with open(self._path(name), "rb") as f:
+                f.seek(start)
+                return f.read(max(0, length))
+        except FileNotFoundError:
+            raise ObjectNotFound(name)
+
+    def _list(self, prefix):
+        names = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".tmp") or filename == ".lock":
+                    continue
+                name = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    names.append(name)
+        return names
+
+    def _delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            raise ObjectNotFound(name)
+
+
+class _FileLock:
+    """Exclusive flock on a lock file where available (no-op elsewhere)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, "a")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        return False
+
+
+class MemoryBackend(StorageBackend):
+    scheme = "mem"
+
+    def __init__(self, bucket_name: str = GCS_BUCKET_NAME):
+        super().__init__(bucket_name)
+        self._objects: Dict[str, Tuple[bytes, int]] = {}
+        self._next_generation = 1
+        self._lock = threading.Lock()
+
+    def _put(self, name, data, content_type, if_generation_match):
+        with self._lock:
+            current = self._objects.get(name, (b"", 0))[1]
+            if if_generation_match is not None and current != if_generation_match:
+                raise GenerationMismatch(name)
+            generation = self._next_generation
+            self._next_generation += 1
+            self._objects[name] = (bytes(data), generation)
+            return generation
+
+    def _get(self, name):
+        with self._lock:
+            if name not in self._objects:
+                raise ObjectNotFound(name)
+            return self._objects[name]
+
+    def _get_range(self, name, start, length):
+        return self._get(name)[0][start:start + max(0, length)]
+
+    def _list(self, prefix):
+        with self._lock:
+            return [name for name in self._objects if name.startswith(prefix)]
+
+    def _generation(self, name):
+        with self._lock:
+            return self._objects.get(name, (b"", 0))[1]
+
+    def _delete(self, name):
+        with self._lock:
+            if self._objects.pop(name, None) is None:
+                raise ObjectNotFound(name)
+
+
+def create_storage(kind: str = STORAGE_BACKEND, bucket_name: str = GCS_BUCKET_NAME) -> StorageBackend:
+    if kind == "gcs":
+        return GCSBackend(bucket_name)
+    if kind == "local":
+        return LocalBackend(bucket_name)
+    if kind == "memory":
+        return MemoryBackend(bucket_name)
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+
+_backends: Dict[str, StorageBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_storage(bucket_name: Optional[str] = None) -> StorageBackend:
+    """Process-wide backend for a bucket (default GCS_BUCKET_NAME), created on first use."""
+    bucket_name = bucket_name or GCS_BUCKET_NAME
+    backend = _backends.get(bucket_name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(bucket_name)
+            if backend is None:
+                backend = _backends[bucket_name] = create_storage(STORAGE_BACKEND, bucket_name)
+    return backend
+
+
+def resolve_uri(uri: str) -> Tuple[StorageBackend, str]:
+    """
+    (backend, object name) for a stored URI such as gs://bucket/path or the
+    file:// / mem:// URIs written by the other backends.
+    """
+    if uri.startswith("file://"):
+        backend = get_storage()
+        root = backend.root if isinstance(backend, LocalBackend) else ""
+        path = uri[len("file://"):]
+        if root and path.startswith(root + os.sep):
+            return backend, os.path.relpath(path, root).replace(os.sep, "/")
+        raise ValueError(f"URI is outside the configured storage root: {uri}")
+    scheme, sep, rest = uri.partition("://")
+    if not sep or "/" not in rest:
+        raise ValueError(f"Not a storage URI: {uri}")
+    bucket_name, name = rest.split("/", 1)
+    return get_storage(bucket_name), name
@@ -0,0 +1,491 @@
+import os
+import sys
+import json
+import tempfile
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from datetime import timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.models import User
+from .models import ChatSession, ChatMessage
+from .django_sync import DjangoSync, create_chat_messages
+
+# The FastAPI-side modules import each other by bare name, as api.py does
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from context_store import LocalRedis, MemoryContextStore, RedisContextStore, SQLiteContextStore  # noqa: E402
+
+
+class SessionsWithMessagesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='power@example.com', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('api_list_sessions_with_messages')
+
+    def _make_sessions(self, sessions, messages_each):
+        start = timezone.now()
+        for i in range(sessions):
+            session = ChatSession.objects.create(user=self.user, name=f'Chat {i}')
+            for j in range(messages_each):
+                msg = ChatMessage.objects.create(
+                    chat_session=session, user=self.user, message_type='user', content=f'm{j}'
+                )
+                # auto_now_add ignores explicit values; space the timestamps out afterwards
+                ChatMessage.objects.filter(id=msg.id).update(created_at=start + timedelta(seconds=j))
+
+    def _get(self, **params):
+        response = self.client.get(self.url, params)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_query_count_does_not_grow_with_sessions(self):
+        self._make_sessions(30, 3)
+        # One query for the sessions, one prefetch for their messages
+        with self.assertNumQueries(2):
+            data = self._get()
+        self.assertEqual(len(data), 30)
+        self.assertTrue(all(len(s['messages']) == 3 for s in data))
+
+    def test_message_window_keeps_most_recent_in_order(self):
+        self._make_sessions(1, 10)
+        data = self._get(messages=4)
+        contents = [m['content'] for m in data[0]['messages']]
+        self.assertEqual(len(contents), 4)
+        self.assertEqual(contents, sorted(contents, key=lambda c: int(c[1:])))
+        self.assertEqual(contents[-1], 'm9')
+
+
+class ChatSessionPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='pager@example.com', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_cover_every_session_once(self):
+        for i in range(7):
+            ChatSession.objects.create(user=self.user, name=f'Chat {i}')
+        url = reverse('api_list_chat_sessions')
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 3}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get(url, params)
+            seen += [s['id'] for s in response.json()]
+            cursor = response.get('X-Next-Cursor')
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get(reverse('api_list_chat_sessions'), {'cursor': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+class DjangoSyncMessageTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@example.com', password='x')
+        self.session = ChatSession.objects.create(user=self.owner, name='Chat')
+
+    def test_messages_belong_to_the_session_owner(self):
+        other = User.objects.create_user(email='other@example.com', password='x')
+        self.assertTrue(DjangoSync(user=other).create_chat_messages(str(self.session.id), [
+            {'id': None, 'message_type': 'user', 'content': 'q'},
+        ]))
+        # The outbox sink writes without any DjangoSync user
+        self.assertTrue(create_chat_messages(str(self.session.id), [
+            {'id': None, 'message_type': 'assistant', 'content': 'a'},
+        ]))
+        self.assertEqual(list(ChatMessage.objects.values_list('user_id', flat=True)), [self.owner.id] * 2)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.message_count, 2)
+
+    def test_unknown_session_is_rejected(self):
+        self.assertFalse(create_chat_messages(
+            '00000000-0000-0000-0000-000000000000', [{'message_type': 'user', 'content': 'q'}]
+        ))
+
+
+class ContextStoreTests(SimpleTestCase):
+    """The same behaviour from every backend; redis runs on the LocalRedis stand-in."""
+
+    def setUp(self):
+        self.now = 1000.0
+        clock = mock.patch('time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.stores = {
+            'memory': MemoryContextStore(ttl=60, history_limit=3),
+            'sqlite': SQLiteContextStore(os.path.join(tmp.name, 'contexts.db'), ttl=60, history_limit=3),
+            'redis': RedisContextStore(LocalRedis(), ttl=60, history_limit=3),
+        }
+
+    def test_history_is_capped_to_the_newest_entries(self):
+        for name, store in self.stores.items():
+            with self.subTest(store=name):
+                store.put('u1', {'email': 'u1@example.com'})
+                for i in range(5):
+                    self.assertTrue(store.append_history('u1', {'i': i}))
+                self.assertEqual(store.history('u1'), [{'i': 2}, {'i': 3}, {'i': 4}])
+                self.assertEqual(store.get('u1')['email'], 'u1@example.com')
+
+    def test_expired_context_does_not_bring_back_its_history(self):
+        for name, store in self.stores.items():
+            with self.subTest(store=name):
+                store.put('u1', {'email': 'u1@example.com'})
+                store.append_history('u1', {'i': 1})
+                self.now += 61
+                self.assertIsNone(store.get('u1'))
+                self.assertFalse(store.append_history('u1', {'i': 2}))
+                self.assertFalse(store.update('u1', current_chat_id='c1'))
+                store.put('u1', {'email': 'u1@example.com'})
+                self.assertEqual(store.history('u1'), [])
+
+    def test_cleanup_of_other_users_drops_their_history(self):
+        for name, store in self.stores.items():
+            with self.subTest(store=name):
+                store.put('old', {'email': 'old@example.com'})
+                store.append_history('old', {'i': 1})
+                self.now += 61
+                store.put('new', {'email': 'new@example.com'})
+                store.put('old', {'email': 'old@example.com'})
+                self.assertEqual(store.history('old'), [])
+
+    def test_writes_extend_the_ttl(self):
+        for name, store in self.stores.items():
+            with self.subTest(store=name):
+                store.put('u1', {'email': 'u1@example.com'})
+                self.now += 40
+                self.assertTrue(store.update('u1', current_chat_id='c1'))
+                self.now += 40
+                self.assertEqual(store.get('u1')['current_chat_id'], 'c1')
+
+    def test_delete_removes_context_and_history(self):
+        for name, store in self.stores.items():
+            with self.subTest(store=name):
+                store.put('u1', {'email': 'u1@example.com'})
+                store.append_history('u1', {'i': 1})
+                store.delete('u1')
+                self.assertIsNone(store.get('u1'))
+                store.put('u1', {'email': 'u1@example.com'})
+                self.assertEqual(store.history('u1'), [])
+
+
+class BenchIngestBaselineTests(SimpleTestCase):
+    def setUp(self):
+        # bench_ingest switches the providers to fake at import
+        env = mock.patch.dict(os.environ)
+        env.start()
+        self.addCleanup(env.stop)
+        import bench_ingest
+        self.bench = bench_ingest
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def _run(self, *args):
+        with redirect_stdout(StringIO()), redirect_stderr(StringIO()):
+            return self.bench.main(['--pages', '5', '--no-samples', *args])
+
+    def test_identical_rerun_reports_no_regressions(self):
+        baseline = os.path.join(self.tmp, 'before.json')
+        after = os.path.join(self.tmp, 'after.json')
+        self.assertEqual(self._run('--output', baseline), 0)
+        self.assertEqual(self._run('--baseline', baseline, '--output', after), 0)
+        with open(after, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['regressions'], [])
+
+    def test_slowdown_beyond_the_noise_band_is_flagged(self):
+        def results(wall, spread):
+            stage = {'wall_s': wall, 'cpu_s': wall, 'wall_spread_s': spread, 'cpu_spread_s': spread}
+            return {'documents': [{'name': 'doc', 'stages': {'embed': stage}}]}
+
+        # Within 3x the run-to-run spread: noise
+        self.assertEqual(self.bench.compare(results(1.3, 0.2), results(1.0, 0.2)), [])
+        flagged = self.bench.compare(results(1.5, 0.01), results(1.0, 0.01))
+        self.assertEqual({r['metric'] for r in flagged}, {'wall_s', 'cpu_s'})
+
+
+class RelevanceSimilarityTests(SimpleTestCase):
+    def test_similarity_is_cosine_for_vectors_that_are_not_unit_length(self):
+        import numpy as np
+        from query import hit_similarities, search_with_scores
+        from vector_index import build_index
+
+        rng = np.random.default_rng(0)
+        # Reduced-dimension embeddings are not normalized
+        vectors = (rng.normal(size=(50, 32)) * 3).astype('float32')
+        query = vectors[7:8] * 0.5
+        index = build_index(vectors, spec={'type': 'flat'})
+        hits = search_with_scores(index, query, 5)
+        expected = [float(vectors[i] @ query[0] / np.linalg.norm(vectors[i]) / np.linalg.norm(query)) for i, _ in hits]
+        self.assertEqual(hits[0][0], 7)
+        np.testing.assert_allclose(hit_similarities(index, query, hits), expected, rtol=1e-5)
+
+
+def _message(i, created_at=None):
+    return {'id': f'm{i}', 'message_type': 'user', 'content': f'q{i}',
+            'created_at': created_at or f'2026-01-01T00:00:{i:02d}'}
+
+
+class PendingMessageCountTests(SimpleTestCase):
+    def setUp(self):
+        from outbox import Outbox
+        from session_registry import SessionRegistry
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'chat.db')
+        self.registry = SessionRegistry(path, legacy_file=None, legacy_messages_file=None)
+        self.outbox = Outbox(path)
+        self.registry.put({'id': 'c1', 'user_id': 'u1', 'message_count': 0})
+
+    def _count(self):
+        pending = [m['id'] for m in self.outbox.pending_messages('c1')]
+        return self.registry.message_count_with_pending('c1', pending)
+
+    def test_turns_waiting_in_the_outbox_are_counted(self):
+        self.outbox.enqueue('chat_messages', {'chat_id': 'c1', 'messages': [_message(1), _message(2)]}, ['local'])
+        self.outbox.enqueue('chat_messages', {'chat_id': 'c2', 'messages': [_message(3)]}, ['local'])
+        self.assertEqual(self._count(), 2)
+
+    def test_delivered_but_unacknowledged_messages_count_once(self):
+        self.outbox.enqueue('chat_messages', {'chat_id': 'c1', 'messages': [_message(1), _message(2)]}, ['local'])
+        self.registry.append_messages('c1', [_message(1), _message(2)])
+        self.assertEqual(self._count(), 2)
+
+
+class _Sink:
+    def __init__(self, name, failures=0):
+        self.name = name
+        self.failures = failures
+        self.received = []
+
+    def deliver(self, records):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('sink down')
+        self.received += [r['id'] for r in records]
+        return [r['id'] for r in records]
+
+
+class OutboxTests(SimpleTestCase):
+    def setUp(self):
+        from outbox import Outbox
+
+        self.now = 1000.0
+        clock = mock.patch('time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'outbox.db')
+        self.outbox = Outbox(self.path)
+
+    def test_a_leased_record_goes_to_one_worker_until_the_lease_lapses(self):
+        from outbox import LEASE_SECONDS, Outbox
+
+        other = Outbox(self.path)
+        self.outbox.enqueue('chat_messages', {'chat_id': 'c1', 'messages': []}, ['local'])
+        record = self.outbox.claim()[0]
+        self.assertEqual(other.claim(), [])
+        self.now += LEASE_SECONDS + 1
+        self.assertEqual([r['id'] for r in other.claim()], [record['id']])
+        # The first worker lost its lease: its outcome is not recorded
+        self.outbox.complete(record, ['local'], {})
+        self.assertEqual(self.outbox.stats()['pending'], 1)
+
+    def test_only_the_failed_sink_is_retried_after_backoff(self):
+        from outbox import OutboxFlusher
+
+        local, django = _Sink('local'), _Sink('django', failures=1)
+        flusher = OutboxFlusher(self.outbox, [local, django])
+        record_id = self.outbox.enqueue('chat_messages', {'chat_id': 'c1', 'messages': []}, ['local', 'django'])
+        self.assertEqual(flusher.flush_once(), 1)
+        self.assertEqual(flusher.flush_once(), 0)
+        self.now += 3
+        self.assertEqual(flusher.flush_once(), 1)
+        self.assertEqual((local.received, django.received), ([record_id], [record_id]))
+        self.assertEqual(self.outbox.stats(), {'pending': 0, 'dead': 0, 'oldest_pending_age': 0.0})
+
+    def test_record_is_dead_after_max_attempts(self):
+        from outbox import OutboxFlusher
+
+        flusher = OutboxFlusher(self.outbox, [_Sink('local', failures=99)])
+        self.outbox.enqueue('chat_messages', {'chat_id': 'c1', 'messages': []}, ['local'])
+        with mock.patch('outbox.MAX_ATTEMPTS', 2):
+            for _ in range(2):
+                flusher.flush_once()
+                self.now += 600
+        self.assertEqual(self.outbox.stats()['dead'], 1)
+        self.assertEqual(flusher.flush_once(), 0)
+
+    def test_redelivery_is_idempotent(self):
+        from outbox import LocalSink
+        from session_registry import SessionRegistry
+
+        record_id = self.outbox.enqueue('chat_messages', {'chat_id': 'c1', 'messages': [_message(1)]}, ['local'])
+        self.outbox.enqueue('chat_messages', {'chat_id': 'c1', 'messages': [_message(1)]}, ['local'], record_id)
+        records = self.outbox.claim()
+        self.assertEqual(len(records), 1)
+        registry = SessionRegistry(os.path.join(os.path.dirname(self.path), 'chat.db'),
+                                   legacy_file=None, legacy_messages_file=None)
+        registry.put({'id': 'c1', 'user_id': 'u1', 'message_count': 0})
+        with mock.patch('outbox.get_registry', return_value=registry):
+            LocalSink().deliver(records)
+            LocalSink().deliver(records)
+        self.assertEqual(len(registry.get_messages('c1')), 1)
+        self.assertEqual(registry.get('c1')['message_count'], 1)
+
+
+class PackedArtifactTests(SimpleTestCase):
+    def setUp(self):
+        import numpy as np
+        from vector_index import build_index
+
+        # Neighbouring chunks overlap, as the splitter makes them; some text is not ASCII
+        words = [f'clause{i} déclaration' for i in range(4000)]
+        self.chunks = [' '.join(words[i:i + 60]) for i in range(0, 3960, 40)]
+        rng = np.random.default_rng(0)
+        self.index = build_index(rng.normal(size=(len(self.chunks), 16)).astype('float32'), spec={'type': 'flat'})
+
+    def test_round_trip_reads_only_the_requested_chunks(self):
+        from artifact import PackedArtifact, write_artifact
+        from storage_backend import MemoryBackend
+
+        storage = MemoryBackend()
+        write_artifact(storage, 'doc.pack', self.index, self.chunks, {'summary': 'Lease'})
+        size = len(storage.get('doc.pack'))
+        reads = []
+        get_range = storage.get_range
+        storage.get_range = lambda name, start, length: reads.append(length) or get_range(name, start, length)
+
+        packed = PackedArtifact(storage, 'doc.pack', prefetch=1024)
+        self.assertEqual(packed.summary, {'summary': 'Lease'})
+        self.assertEqual(packed.load_index().ntotal, len(self.chunks))
+        top = packed.lexical().search('clause1234', 1)[0][0]
+        self.assertIn('clause1234 ', self.chunks[top])
+        self.assertEqual(packed.fetch([57, 3]), [self.chunks[57], self.chunks[3]])
+        self.assertLess(sum(reads), size)
+        self.assertEqual(PackedArtifact(storage, 'doc.pack').chunks(), self.chunks)
+
+
+class UserIndexStoreTests(SimpleTestCase):
+    def test_concurrent_commit_is_retried_without_losing_either_document(self):
+        import numpy as np
+        from storage_backend import MemoryBackend
+        from user_index import UserIndexStore, shard_prefix
+
+        storage = MemoryBackend()
+        store, other = UserIndexStore(storage), UserIndexStore(storage)
+        rng = np.random.default_rng(0)
+        vectors = {d: rng.normal(size=(3, 8)).astype('float32') for d in ('d1', 'd2')}
+        chunks = ['first chunk', 'second chunk', 'third chunk']
+
+        put = storage.put
+        raced = []
+
+        def racing_put(name, data, **kwargs):
+            # Another writer publishes d2 just before our first manifest write
+            if name.endswith('manifest.json') and not raced:
+                raced.append(True)
+                other.add_document('u1', 'd2', vectors['d2'], chunks, 'b.pdf')
+            return put(name, data, **kwargs)
+
+        storage.put = racing_put
+        store.add_document('u1', 'd1', vectors['d1'], chunks, 'a.pdf')
+        storage.put = put
+
+        shard = UserIndexStore(storage).load('u1')
+        self.assertEqual(set(shard.documents), {'d1', 'd2'})
+        self.assertEqual(shard.index.ntotal, 6)
+        hit = shard.search(vectors['d2'][1], k=1)[0]
+        self.assertEqual((hit['document_id'], hit['text']), ('d2', 'second chunk'))
+        # The losing attempt's index object was cleaned up
+        indexes = [n for n in storage.list(shard_prefix('u1')) if n.endswith('.faiss')]
+        self.assertEqual(indexes, [shard_prefix('u1') + shard.manifest['index']])
+
+
+class TranscriptTests(SimpleTestCase):
+    def setUp(self):
+        from gcs_chat_storage import GCSChatStorage
+        from storage_backend import MemoryBackend
+
+        self.storage = MemoryBackend()
+        self.chat = GCSChatStorage(self.storage)
+
+    def test_late_delivery_of_an_older_turn_loads_in_time_order(self):
+        chat = self.chat
+        chat.append_chat_messages('a@example.com', 's1', [_message(2)])
+        # A retried outbox record for an earlier turn arrives after the newer one
+        chat.append_chat_messages('a@example.com', 's1', [_message(1)])
+        self.assertEqual([m['id'] for m in chat.load_chat_messages('a@example.com', 's1')], ['m1', 'm2'])
+
+    def test_compaction_keeps_segments_of_the_previous_manifest_readable(self):
+        with mock.patch('gcs_chat_storage.SEGMENT_MAX_MESSAGES', 2):
+            for i in range(4):
+                self.chat.append_chat_messages('a@example.com', 's1', [_message(i)])
+            before, _ = self.chat._read_manifest('a_example_com', 's1')
+            for i in range(4, 8):
+                self.chat.append_chat_messages('a@example.com', 's1', [_message(i)])
+            # A reader still holding `before` can fetch every segment it lists
+            self.assertEqual(len(self.chat._read_segments(before)), len(before['segments']))
+            for i in range(8, 40):
+                self.chat.append_chat_messages('a@example.com', 's1', [_message(i)])
+            manifest, _ = self.chat._read_manifest('a_example_com', 's1')
+            live = {seg['name'] for seg in manifest['segments']} | set(manifest['retired'])
+        stored = set(self.storage.list('users/a_example_com/chat_transcripts/s1/segments/'))
+        self.assertEqual(stored, live)
+        self.assertEqual([m['id'] for m in self.chat.load_chat_messages('a@example.com', 's1')],
+                         [f'm{i}' for i in range(40)])
+
+
+class PromptBudgetTests(SimpleTestCase):
+    def test_passages_that_fit_are_kept_whole(self):
+        from prompt_builder import fit_passages
+
+        self.assertEqual(fit_passages(['a' * 40, 'b' * 40], 100), (['a' * 40, 'b' * 40], 0))
+
+    def test_overflowing_passage_is_cut_and_the_rest_dropped(self):
+        from prompt_builder import MIN_PASSAGE_TOKENS, estimate_tokens, fit_passages
+
+        passages = ['word ' * 100, 'word ' * 200, 'tail ' * 50]
+        budget = estimate_tokens(passages[0]) + 1 + MIN_PASSAGE_TOKENS + 10
+        kept, trimmed = fit_passages(passages, budget)
+        self.assertEqual(len(kept), 2)
+        self.assertEqual(kept[0], passages[0])
+        self.assertTrue(passages[1].startswith(kept[1]))
+        self.assertEqual(trimmed, 2)
+        self.assertLessEqual(sum(estimate_tokens(p) + 1 for p in kept), budget)
+
+    def test_short_remainder_drops_the_passage(self):
+        from prompt_builder import MIN_PASSAGE_TOKENS, estimate_tokens, fit_passages
+
+        passages = ['word ' * 100, 'word ' * 200]
+        kept, trimmed = fit_passages(passages, estimate_tokens(passages[0]) + MIN_PASSAGE_TOKENS - 10)
+        self.assertEqual((kept, trimmed), ([passages[0]], 1))
+
+    def test_best_passage_is_always_sent(self):
+        from prompt_builder import estimate_tokens, fit_passages
+
+        kept, trimmed = fit_passages(['word ' * 1000], 20)
+        self.assertEqual(trimmed, 1)
+        self.assertTrue(kept[0])
+        self.assertLessEqual(estimate_tokens(kept[0]), 20)
+
+    def test_answer_prompt_stays_within_budget(self):
+        from prompt_builder import build_answer_prompt, estimate_tokens
+
+        history = [f'User: question {i} ' + 'x ' * 100 for i in range(50)]
+        prompt = build_answer_prompt('What is the notice period?', ['clause ' * 2000] * 5, history, budget=3000)
+        self.assertLessEqual(estimate_tokens(prompt), 3000)
+        self.assertIn('What is the notice period?', prompt)
+        self.assertIn('question 49', prompt)
@@ -0,0 +1,290 @@
+"""
+Per-user vector index across all of a user's documents.
+
+Each user has one shard under users/{user_id}/vectorstore/_all/:
+
+    manifest.json       documents (slot, filename, text and chunk spans) and the current index object
+    index-<id>.faiss    IndexIDMap2 over IndexFlatL2
+
+Vector ids encode (document slot, chunk index) as slot * CHUNK_ID_SPACE + chunk,
+so one search returns hits from every document and a document can be removed
+with remove_ids(). Flat is used because per-user shards stay well inside the
+exact-search range (see vector_index.TARGETS) and HNSW cannot delete.
+
+Writers read the manifest, write a new uniquely named index object and then
+replace the manifest with if_generation_match, retrying on conflict, so
+concurrent uploads from several workers never lose a document. Readers cache
+shards per process and revalidate with one generation lookup per search.
+
+    python user_index.py backfill <user_id>   # index a user's existing documents
+"""
+
+import os
+import sys
+import json
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+import faiss
+
+from chunk_spans import ChunkSpans
+from storage_backend import GenerationMismatch, ObjectNotFound, get_storage
+from vector_index import load_index, serialize_index
+
+CHUNK_ID_SPACE = 1 << 20
+SHARD_DIR = "_all"
+CACHE_SIZE = int(os.getenv("USER_INDEX_CACHE_SIZE", "32"))
+MAX_COMMIT_ATTEMPTS = 5
+
+
+def shard_prefix(user_id: str) -> str:
+    return f"users/{user_id}/vectorstore/{SHARD_DIR}/"
+
+
+def _chunk_text(entry: Dict, chunk_index: int) -> str:
+    if "chunks" in entry:
+        # Shards written before chunks were stored as spans
+        return entry["chunks"][chunk_index]
+    start, end = entry["spans"][2 * chunk_index:2 * chunk_index + 2]
+    return entry["text"][start:end]
+
+
+class UserIndex:
+    """One user's shard: the id-mapped index plus the document table."""
+
+    def __init__(self, manifest: Optional[Dict] = None, index=None):
+        self.manifest = manifest or {"next_slot": 0, "documents": {}, "index": None}
+        self.index = index
+
+    @property
+    def documents(self) -> Dict:
+        return self.manifest["documents"]
+
+    def _ensure_index(self, dim: int):
+        if self.index is None:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+        elif self.index.d != dim:
+            raise ValueError(f"Embedding dimension {dim} does not match the user index ({self.index.d})")
+
+    def add_document(self, document_id: str, embeddings: np.ndarray, chunks,
+                     filename: Optional[str] = None):
+        """Add (or replace) a document's chunk vectors; `chunks` is a ChunkSpans or a list of strings."""
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+        if len(embeddings) != len(chunks):
+            raise ValueError("embeddings and chunks differ in length")
+        if len(chunks) >= CHUNK_ID_SPACE:
+            raise ValueError(f"Too many chunks for one document ({len(chunks)})")
+        self.remove_document(document_id)
+        self._ensure_index(embeddings.shape[1])
+
+        slot = self.manifest["next_slot"]
+        self.manifest["next_slot"] = slot + 1
+        ids = slot * CHUNK_ID_SPACE + np.arange(len(chunks), dtype="int64")
+        self.index.add_with_ids(embeddings, ids)
+        spans = chunks if isinstance(chunks, ChunkSpans) else ChunkSpans.from_chunks(chunks)
+        self.documents[document_id] = {
+            "slot": slot,
+            "filename": filename,
+            "text": spans.data.decode("utf-8"),
+            # Character offsets into "text", flattened start, end, start, end, ...
+            "spans": spans.char_spans().ravel().tolist(),
+        }
+
+    def remove_document(self, document_id: str) -> bool:
+        entry = self.documents.pop(document_id, None)
+        if entry is None:
+            return False
+        if self.index is not None:
+            start = entry["slot"] * CHUNK_ID_SPACE
+            self.index.remove_ids(faiss.IDSelectorRange(start, start + CHUNK_ID_SPACE))
+        return True
+
+    def search(self, query_vector: np.ndarray, k: int = 10) -> List[Dict]:
+        if self.index is None or self.index.ntotal == 0:
+            return []
+        query_vector = np.ascontiguousarray(query_vector, dtype="float32").reshape(1, -1)
+        distances, ids = self.index.search(query_vector, min(k, self.index.ntotal))
+        by_slot = {entry["slot"]: (doc_id, entry) for doc_id, entry in self.documents.items()}
+        hits = []
+        for distance, vector_id in zip(distances[0], ids[0]):
+            if vector_id < 0:
+                continue
+            slot, chunk_index = divmod(int(vector_id), CHUNK_ID_SPACE)
+            if slot not in by_slot:
+                continue
+            document_id, entry = by_slot[slot]
+            hits.append({
+                "document_id": document_id,
+                "filename": entry.get("filename"),
+                "chunk_index": chunk_index,
+                "distance": float(distance),
+                "text": _chunk_text(entry, chunk_index),
+            })
+        return hits
+
+
+class UserIndexStore:
+    """Loads, caches and updates per-user shards in a storage backend."""
+
+    def __init__(self, storage=None, cache_size: int = CACHE_SIZE):
+        self.storage = storage or get_storage()
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _manifest_path(self, user_id: str) -> str:
+        return shard_prefix(user_id) + "manifest.json"
+
+    def _read(self, user_id: str):
+        """(UserIndex, manifest generation); an empty shard has generation 0."""
+        try:
+            data, generation = self.storage.get_with_generation(self._manifest_path(user_id))
+        except ObjectNotFound:
+            return UserIndex(), 0
+        manifest = json.loads(data.decode("utf-8"))
+        index = None
+        if manifest.get("index"):
+            index = load_index(self.storage.get(shard_prefix(user_id) + manifest["index"]))
+        return UserIndex(manifest, index), generation
+
+    def _remember(self, user_id: str, generation: int, shard: UserIndex):
+        with self._lock:
+            self._cache[user_id] = (generation, shard)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def load(self, user_id: str) -> UserIndex:
+        """The user's shard, from cache when the manifest has not changed."""
+        generation = self.storage.generation(self._manifest_path(user_id))
+        with self._lock:
+            cached = self._cache.get(user_id)
+        if cached and cached[0] == generation:
+            return cached[1]
+        try:
+            shard, generation = self._read(user_id)
+        except ObjectNotFound:
+            # The index object was replaced between reading the manifest and fetching it
+            shard, generation = self._read(user_id)
+        self._remember(user_id, generation, shard)
+        return shard
+
+    def _commit(self, user_id: str, mutate):
+        """Apply `mutate(shard)` and publish it, retrying when another writer got there first."""
+        prefix = shard_prefix(user_id)
+        for _ in range(MAX_COMMIT_ATTEMPTS):
+            try:
+                shard, generation = self._read(user_id)
+            except ObjectNotFound:
+                continue
+            if not mutate(shard):
+                return shard
+            old_index = shard.manifest.get("index")
+            new_index = None
+            if shard.index is not None and shard.index.ntotal > 0:
+                new_index = f"index-{uuid.uuid4().hex}.faiss"
+                self.storage.put(prefix + new_index, serialize_index(shard.index))
+            shard.manifest["index"] = new_index
+            try:
+                generation = self.storage.put(
+                    self._manifest_path(user_id),
+                    json.dumps(shard.manifest, ensure_ascii=False),
+                    content_type="application/json",
+                    if_generation_match=generation,
+                )
+            except GenerationMismatch:
+                if new_index:
+                    self.storage.delete(prefix + new_index)
+                continue
+            if old_index and old_index != new_index:
+                try:
+                    self.storage.delete(prefix + old_index)
+                except ObjectNotFound:
+                    pass
+            self._remember(user_id, generation, shard)
+            return shard
+        raise RuntimeError(f"Could not update the vector index for {user_id}: too many concurrent writers")
+
+    def add_document(self, user_id: str, document_id: str, embeddings: np.ndarray, chunks,
+                     filename: Optional[str] = None):
+        def mutate(shard):
+            shard.add_document(document_id, embeddings, chunks, filename)
+            return True
+        return self._commit(user_id, mutate)
+
+    def add_documents(self, user_id: str, documents: Dict[str, tuple]):
+        """Add or replace several documents in one commit; values are (embeddings, chunks, filename)."""
+        def mutate(shard):
+            for document_id, (embeddings, chunks, filename) in documents.items():
+                shard.add_document(document_id, embeddings, chunks, filename)
+            return bool(documents)
+        return self._commit(user_id, mutate)
+
+    def remove_document(self, user_id: str, document_id: str) -> bool:
+        removed = False
+
+        def mutate(shard):
+            nonlocal removed
+            removed = shard.remove_document(document_id)
+            return removed
+        self._commit(user_id, mutate)
+        return removed
+
+    def search(self, user_id: str, query_vector: np.ndarray, k: int = 10) -> List[Dict]:
+        return self.load(user_id).search(query_vector, k)
+
+    def backfill(self, user_id: str) -> List[str]:
+        """Add the user's existing per-document indexes that the shard does not have yet."""
+        from artifact import ARTIFACT_FILENAME, PackedArtifact
+        from embedding_store import FILENAME as EMBEDDINGS_FILENAME, load_embeddings
+        from vector_index import read_index
+
+        prefix = f"users/{user_id}/vectorstore/"
+        known = set(self.load(user_id).documents)
+        added = []
+        for name in self.storage.list(prefix):
+            parts = name[len(prefix):].split("/")
+            if len(parts) != 2 or parts[0] in (SHARD_DIR, *known):
+                continue
+            document_id = parts[0]
+            if parts[1] == ARTIFACT_FILENAME:
+                packed = PackedArtifact(self.storage, name)
+                index, chunks = packed.load_index(), packed.spans()
+            elif parts[1] == "index.faiss":
+                index = read_index(self.storage, name)
+                chunks = json.loads(self.storage.get_text(f"{prefix}{document_id}/chunks.json"))
+            else:
+                continue
+            known.add(document_id)
+            try:
+                # Stored raw vectors, which quantized indexes cannot reconstruct exactly
+                embeddings, _ = load_embeddings(self.storage, f"{prefix}{document_id}/{EMBEDDINGS_FILENAME}")
+            except ObjectNotFound:
+                embeddings = index.reconstruct_n(0, index.ntotal)
+            self.add_document(user_id, document_id, embeddings, chunks)
+            added.append(document_id)
+        return added
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_user_index_store() -> UserIndexStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = UserIndexStore()
+    return _store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "backfill":
+        print("Usage: python user_index.py backfill <user_id>")
+        sys.exit(1)
+    added = get_user_index_store().backfill(sys.argv[2])
+    print(f"Indexed {len(added)} documents: {', '.join(added)}")
@@ -0,0 +1,237 @@
+"""
+Size-adaptive FAISS index factory.
+
+build_index() picks the index type from the vector count and a
+latency/recall target (VECTOR_INDEX_TARGET: recall | balanced | latency),
+using thresholds from bench_retrieval.py runs:
+
+    n <= flat_max   IndexFlatL2      exact, and fastest at small sizes
+    n <= hnsw_max   IndexHNSWFlat    graph search, no training
+    larger          IndexIVFPQ       trained coarse quantizer + product codes
+
+The chosen type and its search parameters (efSearch, nprobe) are described by
+index_meta() and stored as index_meta.json next to index.faiss;
+load_index() re-applies them, because FAISS does not persist all of them with
+the index itself.
+
+VECTOR_INDEX_COMPRESSION shrinks flat and HNSW indexes (bench_compression.py
+measures what each option costs in recall):
+
+    none          float32 vectors (default)
+    fp16 | sq8    scalar quantization, 2 or 1 bytes per dimension
+    pca256        PCA to 256 dims fitted on the document's own vectors
+    pca256+sq8    both
+
+PCA is only applied where the projection matrix it adds to the index is
+smaller than what it saves (~400+ vectors for pca256 at 768-d); small
+documents shrink more by asking the model for fewer dimensions
+(EMBEDDING_OUTPUT_DIM, see providers.py).
+"""
+
+import os
+import json
+import math
+import posixpath
+from typing import Dict, Optional
+
+import numpy as np
+import faiss
+
+from storage_backend import ObjectNotFound
+
+INDEX_TARGET = os.getenv("VECTOR_INDEX_TARGET", "balanced")
+INDEX_COMPRESSION = os.getenv("VECTOR_INDEX_COMPRESSION", "none")
+META_FILENAME = "index_meta.json"
+
+# Per target: (flat_max, hnsw_max, efSearch, nprobe)
+TARGETS = {
+    "recall": (50000, 2000000, 128, 32),
+    "balanced": (20000, 500000, 64, 16),
+    "latency": (5000, 200000, 32, 8),
+}
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 40
+PQ_BITS = 8
+TRAIN_SAMPLE = 100000
+MIN_POINTS_PER_CENTROID = 39
+SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+
+
+def _target(target: Optional[str]):
+    target = target or INDEX_TARGET
+    if target not in TARGETS:
+        raise ValueError(f"Unknown VECTOR_INDEX_TARGET: {target}")
+    return TARGETS[target]
+
+
+def parse_compression(value: Optional[str] = None) -> Dict:
+    """{"pca": dims or None, "sq": "fp16" | "sq8" | None} from a VECTOR_INDEX_COMPRESSION value."""
+    value = (value or INDEX_COMPRESSION).lower()
+    parsed = {"pca": None, "sq": None}
+    for part in filter(None, value.split("+")):
+        if part == "none":
+            continue
+        if part in SQ_TYPES:
+            parsed["sq"] = part
+        elif part.startswith("pca") and part[3:].isdigit():
+            parsed["pca"] = int(part[3:])
+        else:
+            raise ValueError(f"Unknown VECTOR_INDEX_COMPRESSION: {value}")
+    return parsed
+
+
+def _pq_subquantizers(dim: int) -> int:
+    # ~8 dims per code byte, and it must divide dim
+    for m in (dim // 8, 64, 48, 32, 16, 8, 4, 2, 1):
+        if m and dim % m == 0:
+            return m
+    return 1
+
+
+def choose_spec(n: int, dim: int, target: Optional[str] = None, kind: Optional[str] = None,
+                compression: Optional[str] = None) -> Dict:
+    """Index type and parameters for `n` vectors of `dim` dimensions; `kind` forces the type."""
+    flat_max, hnsw_max, ef_search, nprobe = _target(target)
+    if kind is None:
+        kind = "flat" if n <= flat_max else "hnsw" if n <= hnsw_max else "ivf_pq"
+    if kind == "flat":
+        spec = {"type": "flat"}
+    elif kind == "hnsw":
+        spec = {"type": "hnsw", "M": HNSW_M, "efConstruction": HNSW_EF_CONSTRUCTION, "efSearch": ef_search}
+    elif kind == "ivf_pq":
+        spec = {"type": "ivf_pq", "nlist": max(1, min(int(4 * math.sqrt(n)), n // MIN_POINTS_PER_CENTROID)),
+                "nbits": PQ_BITS, "nprobe": nprobe}
+    else:
+        raise ValueError(f"Unknown index type: {kind}")
+
+    reduce = parse_compression(compression)
+    # The stored projection is pca x dim floats: only worth it once the vectors save more than that
+    if reduce["pca"] and reduce["pca"] < dim and n * (dim - reduce["pca"]) >= reduce["pca"] * dim:
+        spec["pca"] = reduce["pca"]
+        dim = reduce["pca"]
+    if kind == "ivf_pq":
+        spec["m"] = _pq_subquantizers(dim)
+    elif reduce["sq"]:
+        spec["sq"] = reduce["sq"]
+    return spec
+
+
+def create_index(spec: Dict, dim: int):
+    kind = spec["type"]
+    inner_dim = spec.get("pca") or dim
+    sq = SQ_TYPES[spec["sq"]] if spec.get("sq") else None
+    if kind == "flat":
+        index = faiss.IndexScalarQuantizer(inner_dim, sq) if sq is not None else faiss.IndexFlatL2(inner_dim)
+    elif kind == "hnsw":
+        M = spec.get("M", HNSW_M)
+        index = faiss.IndexHNSWSQ(inner_dim, sq, M) if sq is not None else faiss.IndexHNSWFlat(inner_dim, M)
+        index.hnsw.efConstruction = spec.get("efConstruction", HNSW_EF_CONSTRUCTION)
+    elif kind == "ivf_pq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(inner_dim), inner_dim, spec["nlist"], spec["m"],
+                                 spec.get("nbits", PQ_BITS))
+    else:
+        raise ValueError(f"Unknown index type: {kind}")
+    if inner_dim != dim:
+        # Queries go through the same PCA inside the index, so callers keep passing full vectors
+        index = faiss.IndexPreTransform(faiss.PCAMatrix(dim, inner_dim), index)
+    return index
+
+
+def build_index(embeddings: np.ndarray, target: Optional[str] = None, spec: Optional[Dict] = None):
+    """Create, train if needed, and fill an index for `embeddings`."""
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    n, dim = embeddings.shape
+    spec = spec or choose_spec(n, dim, target)
+    index = create_index(spec, dim)
+    if not index.is_trained:
+        sample = embeddings
+        if n > TRAIN_SAMPLE:
+            sample = embeddings[np.random.default_rng(0).choice(n, TRAIN_SAMPLE, replace=False)]
+        index.train(sample)
+        if isinstance(index, faiss.IndexPreTransform):
+            # Full eigenvector matrix, only needed for training; keeps dim x dim floats out of the index
+            faiss.downcast_VectorTransform(index.chain.at(0)).PCAMat.clear()
+    index.add(embeddings)
+    apply_search_params(index, spec)
+    return index
+
+
+def _base_index(index):
+    """The index doing the search, under any IndexIDMap or PCA wrapper."""
+    index = faiss.downcast_index(index)
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexPreTransform)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def _sq_name(index) -> Optional[str]:
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return {qtype: name for name, qtype in SQ_TYPES.items()}.get(index.sq.qtype, str(index.sq.qtype))
+    return None
+
+
+def index_meta(index) -> Dict:
+    """Type and search parameters of a built index, as stored in index_meta.json."""
+    base = _base_index(index)
+    meta = {"dim": index.d, "ntotal": index.ntotal, "metric": "l2"}
+    if isinstance(base, faiss.IndexHNSW):
+        meta.update(type="hnsw", M=base.hnsw.nb_neighbors(1), efSearch=base.hnsw.efSearch)
+    elif isinstance(base, faiss.IndexIVFPQ):
+        meta.update(type="ivf_pq", nlist=base.nlist, m=base.pq.M, nbits=base.pq.nbits, nprobe=base.nprobe)
+    elif isinstance(base, faiss.IndexIVF):
+        meta.update(type="ivf_flat", nlist=base.nlist, nprobe=base.nprobe)
+    else:
+        meta["type"] = "flat"
+    if base.d != index.d:
+        meta["pca"] = base.d
+    sq = _sq_name(base)
+    if sq:
+        meta["sq"] = sq
+    return meta
+
+
+def apply_search_params(index, meta: Optional[Dict] = None, target: Optional[str] = None):
+    """Set efSearch/nprobe from `meta`, falling back to the target's defaults."""
+    meta = meta or {}
+    _, _, ef_search, nprobe = _target(target)
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = int(meta.get("efSearch", ef_search))
+    elif isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(int(meta.get("nprobe", nprobe)), base.nlist)
+    return index
+
+
+def meta_path(index_path: str) -> str:
+    """Object name of the metadata stored next to an index object."""
+    return posixpath.join(posixpath.dirname(index_path), META_FILENAME)
+
+
+def serialize_index(index) -> bytes:
+    return faiss.serialize_index(index).tobytes()
+
+
+def load_index(data: bytes, meta: Optional[Dict] = None):
+    """Deserialize an index and apply its stored search parameters (legacy indexes have no meta)."""
+    index = faiss.deserialize_index(np.frombuffer(data, dtype="uint8"))
+    return apply_search_params(index, meta)
+
+
+def save_index(storage, index_path: str, index):
+    """Write index.faiss and its index_meta.json to a storage backend."""
+    storage.put(index_path, serialize_index(index))
+    storage.put(meta_path(index_path), json.dumps(index_meta(index)), content_type="application/json")
+
+
+def load_meta(storage, index_path: str) -> Optional[Dict]:
+    try:
+        return json.loads(storage.get_text(meta_path(index_path)))
+    except ObjectNotFound:
+        return None
+
+
+def read_index(storage, index_path: str):
+    """Load an index from a storage backend with its search parameters applied."""
+    return load_index(storage.get(index_path), load_meta(storage, index_path))
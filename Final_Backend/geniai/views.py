@@ -1,6 +1,10 @@
+from django.db.models import Prefetch, Q
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
 from rest_framework import status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from .serializers import (
     DocumentSerializer,
     DocumentSummarySerializer,
@@ -8,6 +12,28 @@ from .serializers import (
     ChatMessageSerializer,
 )
 from .models import Document, ChatSession, ChatMessage
+from .cursor import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, page_size
+
+
+def _decode_cursor_param(value):
+    """Decode ?cursor= into (datetime, id), or None when absent."""
+    if not value:
+        return None
+    position, item_id = decode_cursor(value)
+    parsed = parse_datetime(position)
+    if parsed is None:
+        raise ValueError("Invalid cursor")
+    return parsed, item_id
+
+
+def _page_response(serializer_class, rows, limit, key):
+    """Serialize one page (fetched with limit + 1 rows) and set X-Next-Cursor when more rows exist."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    response = Response(serializer_class(rows, many=True).data)
+    if has_more:
+        response[NEXT_CURSOR_HEADER] = encode_cursor(*key(rows[-1]))
+    return response
 
 
 @api_view(['POST'])
@@ -70,9 +96,26 @@ def api_create_chat_message(request):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def api_list_chat_sessions(request):
-    sessions = ChatSession.objects.filter(user=request.user).order_by('-last_updated')
-    data = ChatSessionSerializer(sessions, many=True).data
-    return Response(data)
+    """
+    List the user's sessions newest first, one page at a time.
+    
+    ?limit=N sets the page size; the cursor for the next page comes back in
+    the X-Next-Cursor header and is passed as ?cursor=.
+    """
+    try:
+        limit = page_size(request.query_params.get('limit'))
+        cursor = _decode_cursor_param(request.query_params.get('cursor'))
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    sessions = ChatSession.objects.filter(user=request.user)
+    if cursor:
+        last_updated, session_id = cursor
+        sessions = sessions.filter(
+            Q(last_updated__lt=last_updated) | Q(last_updated=last_updated, id__lt=session_id)
+        )
+    page = list(sessions.order_by('-last_updated', '-id')[:limit + 1])
+    return _page_response(ChatSessionSerializer, page, limit, lambda s: (s.last_updated, s.id))
 
 
 @api_view(['GET', 'POST'])
@@ -84,9 +127,28 @@ def api_chat_messages(request, chat_session_id):
         return Response({"detail": "Chat session not found for current user"}, status=status.HTTP_404_NOT_FOUND)
     
     if request.method == 'GET':
-        messages = ChatMessage.objects.filter(chat_session=sess).order_by('created_at')
-        data = ChatMessageSerializer(messages, many=True).data
-        return Response(data)
+        # Oldest first by default; ?direction=backward pages from the newest message
+        # towards older ones. Each page is returned in chronological order.
+        try:
+            limit = page_size(request.query_params.get('limit'))
+            cursor = _decode_cursor_param(request.query_params.get('cursor'))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        backward = request.query_params.get('direction') == 'backward'
+        
+        messages = ChatMessage.objects.filter(chat_session=sess)
+        if cursor:
+            created_at, message_id = cursor
+            if backward:
+                messages = messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+            else:
+                messages = messages.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id))
+        ordering = ('-created_at', '-id') if backward else ('created_at', 'id')
+        page = list(messages.order_by(*ordering)[:limit + 1])
+        response = _page_response(ChatMessageSerializer, page, limit, lambda m: (m.created_at, m.id))
+        if backward:
+            response.data = list(reversed(response.data))
+        return response
     
     elif request.method == 'POST':
         data = request.data.copy()
@@ -98,23 +160,60 @@ def api_chat_messages(request, chat_session_id):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-@api_view(['GET'])
-@permission_classes([permissions.IsAuthenticated])
-def api_list_sessions_with_messages(request):
-    sessions = ChatSession.objects.filter(user=request.user).order_by('-last_updated')
-    result = []
-    for s in sessions:
-        messages = ChatMessage.objects.filter(chat_session=s).order_by('created_at')
-        result.append({
+# Messages returned per session by api_list_sessions_with_messages (most recent ones)
+SESSION_MESSAGES_DEFAULT = 50
+SESSION_MESSAGES_MAX = 200
+SESSION_STREAM_CHUNK = 100
+
+
+def _stream_sessions_with_messages(sessions, window):
+    """Yield the sessions as one JSON array, one session at a time."""
+    encoder = JSONEncoder()
+    yield '['
+    for i, s in enumerate(sessions):
+        # Prefetched newest-first for the window; send them oldest-first as before
+        messages = list(reversed(s.recent_messages))
+        item = {
             'id': str(s.id),
             'name': s.name,
             'message_count': s.message_count,
             'created_at': s.created_at,
             'last_updated': s.last_updated,
-            'document_id': str(s.document.id) if s.document_id else None,
+            'document_id': str(s.document_id) if s.document_id else None,
             'messages': ChatMessageSerializer(messages, many=True).data,
-        })
-    return Response(result)
+            # Pass to the messages endpoint with direction=backward to load older messages
+            'messages_cursor': (
+                encode_cursor(messages[0].created_at, messages[0].id)
+                if len(messages) == window else None
+            ),
+        }
+        yield (',' if i else '') + encoder.encode(item)
+    yield ']'
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def api_list_sessions_with_messages(request):
+    """
+    List the user's sessions with their most recent messages.
+    
+    Messages are loaded with one prefetch query per chunk of sessions and
+    capped per session (?messages=N, default 50). The response is streamed.
+    """
+    try:
+        window = int(request.query_params.get('messages', SESSION_MESSAGES_DEFAULT))
+    except ValueError:
+        return Response({"detail": "messages must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    window = max(1, min(window, SESSION_MESSAGES_MAX))
+    
+    recent = ChatMessage.objects.order_by('-created_at', '-id')[:window]
+    sessions = (
+        ChatSession.objects.filter(user=request.user)
+        .order_by('-last_updated')
+        .prefetch_related(Prefetch('messages', queryset=recent, to_attr='recent_messages'))
+        .iterator(chunk_size=SESSION_STREAM_CHUNK)
+    )
+    return StreamingHttpResponse(_stream_sessions_with_messages(sessions, window), content_type='application/json')
 
 
 @api_view(['GET'])
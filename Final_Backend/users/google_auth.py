@@ -0,0 +1,195 @@
+"""
+Google sign-in token verification.
+
+ID tokens (JWTs) are verified locally against Google's signing keys. The
+keys are held in a JWKS cache that honours the Cache-Control max-age of the
+certs response and refreshes ahead of expiry in the background, so logins
+normally do no network I/O at all. An unknown `kid` (key rotation) forces
+one rate-limited refresh.
+
+Access tokens cannot be verified locally; they still go to the userinfo
+endpoint, over a pooled HTTP session.
+
+Set GOOGLE_CERTS_URL to point the cache at another JWKS endpoint, e.g. a
+users.local_jwks.LocalJWKS server for offline tests and benchmarks.
+"""
+
+import os
+import re
+import time
+import threading
+from typing import Dict, Optional
+
+import jwt
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+GOOGLE_CERTS_URL = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_USERINFO_URL = "https://www.googleapis.com/oauth2/v3/userinfo"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+DEFAULT_MAX_AGE = 3600
+REFRESH_AHEAD_SECONDS = 300
+MIN_FORCED_REFRESH_INTERVAL = 30
+CLOCK_SKEW_SECONDS = 30
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+def _pooled_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=2)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Shared by key refreshes and userinfo calls so connections are reused
+http_session = _pooled_session()
+
+
+class GoogleTokenError(Exception):
+    """The token is invalid, expired or not issued for this app."""
+
+
+class JWKSCache:
+    """Signing keys by kid, refreshed ahead of the Cache-Control expiry."""
+
+    def __init__(self, url: str = GOOGLE_CERTS_URL, session: Optional[requests.Session] = None,
+                 refresh_ahead: float = REFRESH_AHEAD_SECONDS):
+        self.url = url
+        self.session = session or http_session
+        self.refresh_ahead = refresh_ahead
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._expires_at = 0.0
+        self._last_forced = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.fetches = 0
+
+    def _fetch(self):
+        response = self.session.get(self.url, timeout=5)
+        response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get("keys", []):
+            try:
+                keys[jwk["kid"]] = jwt.PyJWK(jwk)
+            except Exception as e:
+                print(f"Skipping unusable JWK {jwk.get('kid')}: {e}")
+        match = _MAX_AGE_RE.search(response.headers.get("Cache-Control", ""))
+        max_age = int(match.group(1)) if match else DEFAULT_MAX_AGE
+        self._keys = keys
+        self._expires_at = time.time() + max_age
+        self.fetches += 1
+
+    def refresh(self):
+        with self._lock:
+            self._fetch()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Background JWKS refresh failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="jwks-refresh", daemon=True).start()
+
+    def get_key(self, kid: str) -> jwt.PyJWK:
+        now = time.time()
+        if now >= self._expires_at:
+            with self._lock:
+                if time.time() >= self._expires_at:
+                    self._fetch()
+        elif now >= self._expires_at - self.refresh_ahead:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and time.time() - self._last_forced >= MIN_FORCED_REFRESH_INTERVAL:
+            # Probably a freshly rotated key
+            with self._lock:
+                self._last_forced = time.time()
+                self._fetch()
+            key = self._keys.get(kid)
+        if key is None:
+            raise GoogleTokenError(f"Unknown signing key: {kid}")
+        return key
+
+
+_jwks_cache = None
+_jwks_lock = threading.Lock()
+
+
+def get_jwks_cache() -> JWKSCache:
+    global _jwks_cache
+    if _jwks_cache is None:
+        with _jwks_lock:
+            if _jwks_cache is None:
+                _jwks_cache = JWKSCache()
+    return _jwks_cache
+
+
+def google_client_ids():
+    client_ids = getattr(settings, "GOOGLE_CLIENT_ID", "") or ""
+    return [c.strip() for c in client_ids.split(",") if c.strip()]
+
+
+def verify_google_id_token(token: str, audience=None, jwks: Optional[JWKSCache] = None) -> Dict:
+    """
+    Verify a Google ID token locally and return its claims. The audience is
+    always checked: with no client id configured every token is rejected,
+    since any app's Google ID token would otherwise pass.
+    """
+    jwks = jwks or get_jwks_cache()
+    audience = audience if audience is not None else google_client_ids()
+    if not audience:
+        raise GoogleTokenError("GOOGLE_CLIENT_ID is not configured")
+    try:
+        header = jwt.get_unverified_header(token)
+        key = jwks.get_key(header.get("kid"))
+        claims = jwt.decode(
+            token,
+            key.key,
+            algorithms=["RS256"],
+            audience=audience,
+            leeway=CLOCK_SKEW_SECONDS,
+        )
+    except jwt.InvalidTokenError as e:
+        raise GoogleTokenError(str(e))
+    if claims.get("iss") not in GOOGLE_ISSUERS:
+        raise GoogleTokenError("Wrong issuer")
+    if claims.get("email") and claims.get("email_verified") in (False, "false"):
+        raise GoogleTokenError("Email not verified")
+    return claims
+
+
+def fetch_google_userinfo(access_token: str) -> Dict:
+    """Resolve an OAuth access token through the userinfo endpoint."""
+    response = http_session.get(
+        GOOGLE_USERINFO_URL, headers={"Authorization": f"Bearer {access_token}"}, timeout=10
+    )
+    if response.status_code != 200:
+        raise GoogleTokenError(f"Google token verification failed: {response.text}")
+    user_info = response.json()
+    if "error" in user_info:
+        raise GoogleTokenError("Invalid Google token")
+    return user_info
+
+
+def verify_google_token(token: str) -> Dict:
+    """
+    Claims for a Google sign-in token: ID tokens are verified locally,
+    anything else is treated as an access token and sent to userinfo.
+    """
+    try:
+        jwt.get_unverified_header(token)
+    except jwt.DecodeError:
+        return fetch_google_userinfo(token)
+    return verify_google_id_token(token)
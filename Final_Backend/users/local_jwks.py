@@ -0,0 +1,87 @@
+"""
+Local stand-in for Google's JWKS endpoint.
+
+Serves a freshly generated RSA signing key as a JWKS document over HTTP on
+127.0.0.1 and issues ID tokens signed with it, so Google login can be
+tested and benchmarked offline:
+
+    server = LocalJWKS(client_id="test-client").start()
+    os.environ["GOOGLE_CERTS_URL"] = server.url   # or JWKSCache(url=server.url)
+    token = server.issue("someone@example.com")
+    ...
+    server.stop()
+"""
+
+import json
+import time
+import uuid
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+class LocalJWKS:
+    def __init__(self, client_id: str = "local-client", max_age: int = 3600, issuer: str = "https://accounts.google.com"):
+        self.client_id = client_id
+        self.max_age = max_age
+        self.issuer = issuer
+        self.requests = 0
+        self._server = None
+        self.rotate()
+
+    def rotate(self):
+        """Replace the signing key (simulates Google rotating its keys)."""
+        self.kid = uuid.uuid4().hex
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self._private_key.public_key()))
+        jwk.update({"kid": self.kid, "alg": "RS256", "use": "sig"})
+        self._jwks = json.dumps({"keys": [jwk]}).encode("utf-8")
+
+    def issue(self, email: str, name: str = "Test User", lifetime: int = 3600, **claims) -> str:
+        """Sign an ID token with Google-shaped claims."""
+        now = int(time.time())
+        payload = {
+            "iss": self.issuer,
+            "aud": self.client_id,
+            "sub": uuid.uuid5(uuid.NAMESPACE_URL, email).hex,
+            "email": email,
+            "email_verified": True,
+            "name": name,
+            "iat": now,
+            "exp": now + lifetime,
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self._private_key, algorithm="RS256", headers={"kid": self.kid})
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/oauth2/v3/certs"
+
+    def start(self) -> "LocalJWKS":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", f"public, max-age={stub.max_age}")
+                self.send_header("Content-Length", str(len(stub._jwks)))
+                self.end_headers()
+                self.wfile.write(stub._jwks)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, name="local-jwks", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
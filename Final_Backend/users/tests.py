@@ -1,3 +1,39 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from .google_auth import GoogleTokenError, JWKSCache, verify_google_id_token
+from .local_jwks import LocalJWKS
+
+
+class GoogleIdTokenTests(SimpleTestCase):
+    def setUp(self):
+        self.server = LocalJWKS(client_id='test-client').start()
+        self.jwks = JWKSCache(url=self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_keys_fetched_once_for_many_logins(self):
+        for i in range(20):
+            token = self.server.issue(f'user{i}@example.com')
+            claims = verify_google_id_token(token, audience=['test-client'], jwks=self.jwks)
+            self.assertEqual(claims['email'], f'user{i}@example.com')
+        self.assertEqual(self.server.requests, 1)
+
+    def test_rotated_key_triggers_refresh(self):
+        verify_google_id_token(self.server.issue('a@example.com'), audience=['test-client'], jwks=self.jwks)
+        self.server.rotate()
+        claims = verify_google_id_token(self.server.issue('b@example.com'), audience=['test-client'], jwks=self.jwks)
+        self.assertEqual(claims['email'], 'b@example.com')
+        self.assertEqual(self.server.requests, 2)
+
+    def test_wrong_audience_rejected(self):
+        token = self.server.issue('a@example.com')
+        with self.assertRaises(GoogleTokenError):
+            verify_google_id_token(token, audience=['other-client'], jwks=self.jwks)
+
+    def test_missing_client_id_rejects_every_token(self):
+        token = self.server.issue('a@example.com')
+        with self.assertRaises(GoogleTokenError):
+            verify_google_id_token(token, audience=[], jwks=self.jwks)
+        with self.settings(GOOGLE_CLIENT_ID=''), self.assertRaises(GoogleTokenError):
+            verify_google_id_token(token, jwks=self.jwks)
@@ -10,6 +10,7 @@ from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 from django.contrib.auth.hashers import make_password
 import requests
+from .google_auth import GoogleTokenError, verify_google_token
 
 
 User = get_user_model()
@@ -91,32 +92,19 @@ class ManualLoginView(APIView):
 class GoogleLoginView(APIView):
   def post(self,request):
     print(f"Google login request data: {request.data}")
-    token = request.data.get("token") # frontend sends Google access token
+    token = request.data.get("token") # Google ID token or access token
 
     if not token:
       print("No token provided")
       return Response({"error": "Token is required"}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-      # Get user info from Google using access token
-      import requests
-      print(f"Getting user info with token: {token[:50]}...")
-      user_info_response = requests.get(
-        'https://www.googleapis.com/oauth2/v3/userinfo',
-        headers={'Authorization': f'Bearer {token}'}
-      )
-      
-      print(f"Google response status: {user_info_response.status_code}")
-      print(f"Google response: {user_info_response.text}")
-      
-      if user_info_response.status_code != 200:
-        return Response({"error": f"Google token verification failed: {user_info_response.text}"}, status=status.HTTP_400_BAD_REQUEST)
-      
-      user_info = user_info_response.json()
-      print(f"User info from Google: {user_info}")
-
-      if 'error' in user_info:
-        return Response({"error": "Invalid Google token"}, status=status.HTTP_400_BAD_REQUEST)
+      # ID tokens are verified locally against cached Google keys;
+      # access tokens are resolved through the userinfo endpoint
+      try:
+        user_info = verify_google_token(token)
+      except GoogleTokenError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
       email = user_info.get('email')
       name = user_info.get('name', email.split('@')[0] if email else 'User')
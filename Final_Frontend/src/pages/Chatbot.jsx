@@ -70,6 +70,7 @@ const Chatbot = () => {
           title: s.name || `Chat ${idx + 1}`,
           date: new Date(s.last_updated || s.created_at || Date.now()).toLocaleDateString('en-US', { month: 'short', day: 'numeric', year: 'numeric' }),
           documentId: s.document_id || null,
+          olderCursor: s.messages_cursor || null,
           messages: (s.messages || []).map((m, i) => ({
             id: i + 1,
             type: m.message_type === 'user' ? 'user' : 'assistant',
@@ -105,6 +106,32 @@ const Chatbot = () => {
 
   // Remove duplicate useEffect - sessions are loaded in auth check above
 
+  const loadOlderMessages = async () => {
+    if (!activeSession || !activeSession.olderCursor) return;
+    try {
+      const { messages: older, nextCursor } = await legalApi.getChatMessagesPage(activeSession.id, {
+        cursor: activeSession.olderCursor,
+        direction: 'backward',
+      });
+      const mapped = older.map(m => ({
+        id: m.id,
+        type: m.message_type === 'user' ? 'user' : 'assistant',
+        content: m.content,
+        timestamp: new Date(m.created_at || Date.now()),
+      }));
+      setChatData(prev => ({
+        ...prev,
+        sessions: prev.sessions.map(session =>
+          session.id === activeSession.id
+            ? { ...session, olderCursor: nextCursor, messages: [...mapped, ...session.messages] }
+            : session
+        )
+      }));
+    } catch (e) {
+      console.error('Error loading older messages:', e);
+    }
+  };
+
 
 
   const toggleSidebar = () => setSidebarVisible(!sidebarVisible);
@@ -416,6 +443,18 @@ const Chatbot = () => {
               </div>
             )}
 
+            {activeSession && activeSession.olderCursor && (
+              <div className="text-center">
+                <button
+                  type="button"
+                  onClick={loadOlderMessages}
+                  className="text-sm text-foreground/70 hover:text-foreground underline"
+                >
+                  Load earlier messages
+                </button>
+              </div>
+            )}
+
             {messages.map(message => (
               <div
                 key={message.id}
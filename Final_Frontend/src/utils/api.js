@@ -262,6 +262,30 @@ export const legalApi = {
     return res.json();
   },
 
+  async getChatSessionsPage({ cursor = null, limit = null } = {}) {
+    const params = new URLSearchParams();
+    if (cursor) params.set('cursor', cursor);
+    if (limit) params.set('limit', limit);
+    const res = await fetchWithAuth(`${DJANGO_BASE_URL}/api/geniai/chat-sessions/list/?${params}`, {
+      headers: { ...getAuthHeaders() },
+    });
+    if (!res.ok) throw new Error('Fetch sessions failed');
+    return { sessions: await res.json(), nextCursor: res.headers.get('X-Next-Cursor') };
+  },
+
+  // One page of messages in chronological order. direction 'backward' walks
+  // from the newest message towards older ones.
+  async getChatMessagesPage(chatSessionId, { cursor = null, limit = null, direction = 'forward' } = {}) {
+    const params = new URLSearchParams({ direction });
+    if (cursor) params.set('cursor', cursor);
+    if (limit) params.set('limit', limit);
+    const res = await fetchWithAuth(`${DJANGO_BASE_URL}/api/geniai/chat-sessions/${chatSessionId}/messages/?${params}`, {
+      headers: { ...getAuthHeaders() },
+    });
+    if (!res.ok) throw new Error('Fetch messages failed');
+    return { messages: await res.json(), nextCursor: res.headers.get('X-Next-Cursor') };
+  },
+
   async getChatMessages(chatSessionId) {
     const res = await fetchWithAuth(`${DJANGO_BASE_URL}/api/geniai/chat-sessions/${chatSessionId}/messages/`, {
       headers: { ...getAuthHeaders() },